@@ -32,4 +32,4 @@ export FFLAGS=-m64
 export HDF5=/cluster/apps/gcc-6.3.0/hdf5-1.10.9-xlzu7dxaclmzssn5ukcnhyfyp6z7jtor/lib
 export LDFLAGS="-L/cluster/apps/gcc-6.3.0/hdf5-1.10.9-xlzu7dxaclmzssn5ukcnhyfyp6z7jtor/lib -I$DIR/grib2/include"
 export CPPFLAGS="-I/cluster/apps/gcc-6.3.0/hdf5-1.10.9-xlzu7dxaclmzssn5ukcnhyfyp6z7jtor/include"
-export PATH=TO_CHANGE/convert_geotiff:$DIR/netcdf/bin:$PATH
+export PATH=$DIR/netcdf/bin:$PATH
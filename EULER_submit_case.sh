@@ -7,7 +7,7 @@ usage()
 {
     echo "Script to setup and simulate a WRF case"
     echo
-    echo "Syntax: simulate_case.sh [-h|-v|-y|-d|-t|-o|-a|-n|-l]"
+    echo "Syntax: simulate_case.sh [-h|-v|-y|-d|-t|-o|-a|-n|-r|-s|-l|-A]"
     echo "options:"
     echo "  h     Print this help"
     echo "  v     Enable verbose outputs"
@@ -17,17 +17,40 @@ usage()
     echo "  o     Longitude of the grid center in deg (required)"
     echo "  a     Latitude of the grid center in deg (required)"
     echo "  n     Number of cores used to execute wrf (required)"
-    echo "  r     Requested run time in hours (required)"
+    echo "  r     Requested run time in hours (required), of every segment with -s"
+    echo "  s     Split the wrf run into a chain of jobs that simulate this many hours each and continue from the restart files"
     echo "  l     Switching between LES (flag set) and MESO (default) mode"
+    echo "  A     Choose the number of cores, the decomposition and the run time from the previous runs (-n not required, -r is the limit of the run time, 120 h if not set)"
+}
+
+######################################
+# Parse a YAML file
+######################################
+parse_yaml() {
+   local prefix=$2
+   local s='[[:space:]]*' w='[a-zA-Z0-9_]*' fs=$(echo @|tr @ '\034')
+   sed -ne "s|^\($s\):|\1|" \
+        -e "s|^\($s\)\($w\)$s:$s[\"']\(.*\)[\"']$s\$|\1$fs\2$fs\3|p" \
+        -e "s|^\($s\)\($w\)$s:$s\(.*\)$s\$|\1$fs\2$fs\3|p"  $1 |
+   awk -F$fs '{
+      indent = length($1)/2;
+      vname[indent] = $2;
+      for (i in vname) {if (i > indent) {delete vname[i]}}
+      if (length($3) > 0) {
+         vn=""; for (i=0; i<indent; i++) {vn=(vn)(vname[i])("_")}
+         printf("%s%s%s=\"%s\"\n", "'$prefix'",vn, $2, $3);
+      }
+   }'
 }
 
 ######################################
 # Main
 ######################################
 verbose=false
-while getopts "lvy:d:a:o:t:n:r:h" option; do
+while getopts "lAvy:d:a:o:t:n:r:s:h" option; do
     case $option in
         l  ) les=true;;
+        A  ) advise=true;;
         v  ) verbose=true;;
         y  ) yaml="$OPTARG";;
         d  ) date="$OPTARG";;
@@ -36,6 +59,7 @@ while getopts "lvy:d:a:o:t:n:r:h" option; do
         t  ) dt="$OPTARG";;
         n  ) n_cores="$OPTARG";;
         r  ) runtime="$OPTARG";;
+        s  ) segment_hours="$OPTARG";;
         h  ) usage; exit;;
         \? ) echo "Unknown option: -$OPTARG" >&2; exit 1;;
         :  ) echo "Missing option argument for -$OPTARG" >&2; exit 1;;
@@ -44,18 +68,40 @@ while getopts "lvy:d:a:o:t:n:r:h" option; do
 done
 
 
-# Check if mandatory fields are set
-if [ ! "$yaml" ] || [ ! "$date" ] || [ ! "$lon" ] || [ ! "$lat" ] || [ ! "$dt" ] || [ ! "$n_cores" ] || [ ! "$runtime" ]; then
-  echo "arguments -y, -o, -a, -t, -n, -r, and -d must be provided"
-  echo "$usage" >&2; exit 1
-fi
-
 if [ "$les" = "true" ]; then
     les_string="-l"
 else
     les_string=""
 fi
 
+# the run time of a segmented run is requested for each segment
+exec_string=""
+job_hours=$dt
+if [ "$segment_hours" ]; then
+    exec_string="-s $segment_hours"
+    job_hours=$segment_hours
+fi
+
+# choose the fastest number of cores of the previous runs that keeps the parallel efficiency and finishes a job
+# within the requested run time
+if [ "$advise" = "true" ] && [ "$yaml" ] && [ "$dt" ]; then
+    eval $(parse_yaml $yaml)
+    advice=$(python3 src/mpi_advisor.py -y $yaml -t $job_hours $les_string --history $out_out_directory --max-walltime ${runtime:-120} --shell)
+    if [ $? -ne 0 ]; then
+        echo "Failed to get a recommendation from the previous runs"
+        exit 1
+    fi
+    eval $advice
+    # exec_wrf.sh sets the decomposition for the allocated cores
+    exec_string="$exec_string -p"
+fi
+
+# Check if mandatory fields are set
+if [ ! "$yaml" ] || [ ! "$date" ] || [ ! "$lon" ] || [ ! "$lat" ] || [ ! "$dt" ] || [ ! "$n_cores" ] || [ ! "$runtime" ]; then
+  echo "arguments -y, -o, -a, -t, -n, -r, and -d must be provided"
+  echo "$usage" >&2; exit 1
+fi
+
 if [ "$verbose" = "true" ]; then
     verbose_string="-v"
 else
@@ -76,9 +122,18 @@ submit_out=$(sh $file)
 jobid=$(echo $submit_out | sed 's/[^0-9]*//g')
 echo $submit_out
 
-# submit the job for running WRF and set up the dependency to the previous job
-echo "Submitting exec_wrf.sh"
-echo sbatch -d afterok:$jobid -n $n_cores --cpus-per-task=1 --time=$runtime:00:00 --mem-per-cpu=4096 --wrap=\"bash exec_wrf.sh $options_string\" > $file
-cat $file
-sh $file
+# submit the jobs for running WRF, each job depends on the previous one, a segmented run is a chain of jobs that each
+# continue from the restart files of the previous one, the jobs after the end of the run exit at once
+n_jobs=1
+if [ "$segment_hours" ]; then
+    n_jobs=$(( (dt + segment_hours - 1) / segment_hours ))
+fi
+for (( i=1; i<=n_jobs; i++ )); do
+    echo "Submitting exec_wrf.sh ($i/$n_jobs)"
+    echo sbatch -d afterok:$jobid -n $n_cores --cpus-per-task=1 --time=$runtime:00:00 --mem-per-cpu=4096 --wrap=\"bash exec_wrf.sh $options_string $exec_string\" > $file
+    cat $file
+    submit_out=$(sh $file)
+    jobid=$(echo $submit_out | sed 's/[^0-9]*//g')
+    echo $submit_out
+done
 rm $file
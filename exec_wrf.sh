@@ -7,7 +7,7 @@ usage()
 {
     echo "Execute wrf for an already set up case"
     echo
-    echo "Syntax: exec_wrf.sh [-h|-v|-y|-d|-t|-o|-a|-n|-l]"
+    echo "Syntax: exec_wrf.sh [-h|-v|-y|-d|-t|-o|-a|-n|-l|-p|-s]"
     echo "options:"
     echo "  h     Print this help"
     echo "  v     Enable verbose outputs"
@@ -18,6 +18,8 @@ usage()
     echo "  a     Latitude of the grid center in deg (required)"
     echo "  n     Number of cores used to execute wrf (required)"
     echo "  l     Switching between LES (flag set) and MESO (default) mode"
+    echo "  p     Set the MPI decomposition (nproc_x, nproc_y) that minimizes the halo exchange"
+    echo "  s     Only run the next segment of this many simulated hours, continuing from the latest restart files"
 }
 
 ######################################
@@ -96,9 +98,10 @@ check_success() {
 # Main
 ######################################
 verbose=false
-while getopts "lvy:d:a:o:t:n:h" option; do
+while getopts "lpvy:d:a:o:t:n:s:h" option; do
     case $option in
         l  ) les=true;;
+        p  ) decompose=true;;
         v  ) verbose=true;;
         y  ) yaml="$OPTARG";;
         d  ) date="$OPTARG";;
@@ -106,6 +109,7 @@ while getopts "lvy:d:a:o:t:n:h" option; do
         a  ) lat="$OPTARG";;
         t  ) dt="$OPTARG";;
         n  ) n_cores="$OPTARG";;
+        s  ) segment_hours="$OPTARG";;
         h  ) usage; exit;;
         \? ) echo "Unknown option: -$OPTARG" >&2; exit 1;;
         :  ) echo "Missing option argument for -$OPTARG" >&2; exit 1;;
@@ -130,10 +134,15 @@ case_directory="$out_out_directory/$case_name"
 # Setting up variables depending on the mode
 if [ "$les" = "true" ]; then
     run_directory="$case_directory/LES"
+    mode="LES"
 else
     run_directory="$case_directory/MESO"
+    mode="MESO"
 fi
 
+# wrf.exe appends its wall time, cpu time, peak memory and io to the telemetry of the case
+telemetry="python3 $current_directory/src/stage_telemetry.py run -c $case_directory -m $mode"
+
 ###########
 # Running wrf.exe
 ###########
@@ -143,21 +152,83 @@ if [ "$verbose" = "true" ]; then
     start=`date +%s`
 fi
 
+# a segmented run continues from the latest complete restart files, the namelist is rewritten for the segment
+if [ "$segment_hours" ]; then
+    segment=$(python3 $current_directory/src/restart_segments.py -i namelist.input -s $segment_hours --shell)
+    if [ $? -ne 0 ]; then
+        echo "$segment"
+        echo "Failed to set up the restart segment"
+        exit 1
+    fi
+    eval $segment
+    if [ "$complete" = "true" ]; then
+        echo "The run is already complete"
+        exit 0
+    fi
+    echo "Running $run_hours hours from $segment_start, restart: $restart"
+fi
+
+# the history files are written directly to the OUT directory (history_outname) so that they can be
+# converted while wrf is running, remove the logs of a previous run as they mark the end of the run and the marker
+# of a finished segment as the next segment is running now
+rm -f ../OUT/wrf_rsl.* ../OUT/wrf_segment_done
+
+# without a number of cores mpirun starts one rank per allocated task
 if [ "$n_cores" -gt 0 ]; then
-  mpirun -np $n_cores ./wrf.exe
+    n_ranks=$n_cores
 else
-  mpirun ./wrf.exe
+    n_ranks=${SLURM_NTASKS:-$(nproc)}
 fi
 
-for file in rsl.*; do
-    cp "${file}" "../OUT/wrf_${file}"
-done;
+if [ "$decompose" = "true" ]; then
+    python3 $current_directory/src/mpi_advisor.py -i namelist.input -n $n_ranks --inject namelist.input
+    if [ $? -ne 0 ]; then
+        echo "Failed to set the decomposition"
+        exit 1
+    fi
+fi
 
-# move output files to the OUT directory
-mv wrfout_* ../OUT
+if [ "$n_cores" -gt 0 ]; then
+  $telemetry -s wrf -n $n_ranks -- mpirun -np $n_cores ./wrf.exe
+else
+  $telemetry -s wrf -n $n_ranks -- mpirun ./wrf.exe
+fi
+
+# the namelist of the whole run is restored with its time stamp so that the setup does not consider it changed
+if [ "$segment_hours" ]; then
+    cp -p namelist.input.full namelist.input
+else
+    for file in rsl.*; do
+        cp "${file}" "../OUT/wrf_${file}"
+    done;
+fi
+
+# move output files to the OUT directory if they were not written there directly
+if ls wrfout_* > /dev/null 2>&1; then
+    mv wrfout_* ../OUT
+fi
 
 check_wrf_exe_out "rsl.error.*" ../OUT
 
+# the logs of the segments are collected and only copied to OUT after the last segment as they mark the end of the run,
+# after the other segments a marker keeps the postprocessing following the run until the next segment starts
+if [ "$segment_hours" ]; then
+    for file in rsl.*; do
+        if [ "$restart" = "true" ]; then
+            cat "${file}" >> "segment_${file}"
+        else
+            cp "${file}" "segment_${file}"
+        fi
+    done;
+    if [ "$last" = "true" ]; then
+        for file in segment_rsl.*; do
+            cp "${file}" "../OUT/wrf_${file#segment_}"
+        done;
+    else
+        echo "$segment_start $run_hours" > ../OUT/wrf_segment_done
+    fi
+fi
+
 if [ "$verbose" = "true" ]; then
     end=`date +%s`
     echo "done in `expr $end - $start` seconds"
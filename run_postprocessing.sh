@@ -7,7 +7,7 @@ usage()
 {
     echo "Run the postprocessing with downscaling the ERA5 data and converting it"
     echo
-    echo "Syntax: setup_case.sh [-h|-v|-y|-d|-t|-o|-a|-n|-l]"
+    echo "Syntax: setup_case.sh [-h|-v|-y|-d|-t|-o|-a|-n|-l|-e|-f]"
     echo "options:"
     echo "  h     Print this help"
     echo "  v     Enable verbose outputs"
@@ -16,9 +16,10 @@ usage()
     echo "  t     Total simulation interval in hours (required)"
     echo "  o     Longitude of the grid center in deg (required)"
     echo "  a     Latitude of the grid center in deg (required)"
-    echo "  n     Number of cores used to execute wrf (required)"
+    echo "  n     Number of cores used for the conversion, all available cores if -1 (required)"
     echo "  l     Switching between LES (flag set) and MESO (default) mode"
     echo "  e     If set the ERA5 data is downscaled and converted as well"
+    echo "  f     Follow a running simulation and convert the wrf output while it is written"
 }
 
 ######################################
@@ -92,10 +93,11 @@ check_success() {
 # Main
 ######################################
 verbose=false
-while getopts "levy:d:a:o:t:n:h" option; do
+while getopts "lefvy:d:a:o:t:n:h" option; do
     case $option in
         l  ) les=true;;
         e  ) era5=true;;
+        f  ) follow=true;;
         v  ) verbose=true;;
         y  ) yaml="$OPTARG";;
         d  ) date="$OPTARG";;
@@ -130,13 +132,18 @@ if [ "$les" = "true" ]; then
     namelist_wps="namelist_les.wps"
     run_directory_wrf="$case_directory/LES"
     time_offset=$LES_time_offset_h
+    mode="LES"
 else
     num_domains=$MESO_num_domains
     namelist_wps="namelist_meso.wps"
     run_directory_wrf="$case_directory/MESO"
     time_offset=0
+    mode="MESO"
 fi
 
+# every stage appends its wall time, cpu time, peak memory and io to the telemetry of the case
+telemetry="python3 $current_directory/src/stage_telemetry.py run -c $case_directory"
+
 era5_arg=""
 if [ "$era5" = "true" ]; then
     if [[ -z "${TMPDIR}" ]]; then
@@ -174,7 +181,7 @@ if [ "$era5" = "true" ]; then
     ###########
     cd $run_directory_post/WPS
 
-    ./metgrid.exe >& log.metgrid
+    $telemetry -m POST -s metgrid -- ./metgrid.exe >& log.metgrid
 
     cp log.metgrid ../OUT/
 
@@ -204,8 +211,20 @@ era5_fields="-pm PRES GHT SEAICE SKINTEMP LANDSEA RH UU VV TT SNOALB LAI12M GREE
 wrf_fields="-pw U V W T P CLDFRA CLOUDFRAC RH QCLOUD QRAIN QICE QSNOW QGRAUP QVAPOR HGT"
 namelist_args="-ni $run_directory_wrf/WRF/namelist.input -nw $run_directory_wrf/WPS/namelist.wps"
 
-conversion_args="-w $run_directory_wrf/OUT $era5_arg $era5_fields $wrf_fields -n $case_name -o $outfile -d d0$num_domains -dt $averaging_dt $namelist_args -to 1 --lbc_offset 6"
-python3 $current_directory/src/convert_wrfout.py $conversion_args -c 6
+# reduce the time windows in parallel on all the available cores if the number of cores is not set
+if [ "$n_cores" -gt 0 ]; then
+    n_workers=$n_cores
+else
+    n_workers=$(nproc)
+fi
+
+conversion_args="-w $run_directory_wrf/OUT $era5_arg $era5_fields $wrf_fields -n $case_name -o $outfile -d d0$num_domains -dt $averaging_dt $namelist_args -to 1 --lbc_offset 6 --workers $n_workers --resume"
+# poll the output folder and convert the windows as soon as wrf has written them
+if [ "$follow" = "true" ]; then
+    conversion_args="$conversion_args --follow"
+fi
+
+$telemetry -m $mode -s conversion -n $n_workers -- python3 $current_directory/src/convert_wrfout.py $conversion_args -c 6
 
 if [ "$verbose" = "true" ]; then
     end=`date +%s`
@@ -0,0 +1,129 @@
+import argparse
+from datetime import datetime
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from file_catalog import get_catalog, query_files
+from output_backend import backend_extensions, open_output
+
+# property sets that are benchmarked, the postprocessing set is the one used by run_postprocessing.sh
+property_sets = {
+    'wind': {
+        'wrf': ['U', 'V', 'W'],
+        'met_em': [],
+    },
+    'column': {
+        'wrf': ['PW', 'CLOUDFRAC'],
+        'met_em': [],
+    },
+    'postprocessing': {
+        'wrf': ['U', 'V', 'W', 'T', 'P', 'CLDFRA', 'CLOUDFRAC', 'RH', 'QCLOUD', 'QRAIN', 'QICE', 'QSNOW', 'QGRAUP', 'QVAPOR', 'HGT'],
+        'met_em': ['PRES', 'GHT', 'SEAICE', 'SKINTEMP', 'LANDSEA', 'RH', 'UU', 'VV', 'TT', 'SNOALB', 'LAI12M', 'GREENFRAC', 'ALBEDO12M',
+                   'SCB_DOM', 'SOILCTOP', 'HGT_M', 'LU_INDEX', 'LANDUSEF', 'LANDMASK'],
+    },
+}
+
+def run_conversion(command, logfile):
+    # run the conversion in a separate process to measure the peak memory of this conversion only
+    with open(logfile, 'w') as log:
+        t_start = time.perf_counter()
+        process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT)
+        _, status, rusage = os.wait4(process.pid, 0)
+        t_total = time.perf_counter() - t_start
+
+    if os.waitstatus_to_exitcode(status) != 0:
+        with open(logfile, 'r') as log:
+            print(log.read()[-2000:])
+        print('Conversion failed, see', logfile)
+        sys.exit(1)
+
+    # ru_maxrss is given in kilobytes on linux
+    return t_total, rusage.ru_maxrss / 1024.0
+
+parser = argparse.ArgumentParser(description='Benchmark the conversion on synthetic data, all unknown arguments are passed to convert_wrfout.py')
+parser.add_argument('-i', '--input_folder', type=str, required=True, help='Folder with the wrf and met_em subfolders created by generate_synthetic_data.py')
+parser.add_argument('-s', '--property_sets', type=str, nargs='+', default=['wind', 'postprocessing'], choices=property_sets.keys(), help='Property sets to benchmark')
+parser.add_argument('-d', '--domain', type=str, default='d01', help='Domain identifier of the input files')
+parser.add_argument('-o', '--output_folder', type=str, help='Folder for the converted outputs and logs, a temporary folder if not set')
+parser.add_argument('-j', '--json', type=str, help='Append the results as json lines to this file to track regressions')
+args, converter_args = parser.parse_known_args()
+
+convert_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'convert_wrfout.py')
+wrf_folder = os.path.join(args.input_folder, 'wrf')
+met_em_folder = os.path.join(args.input_folder, 'met_em')
+
+wrf_files, wrf_times = query_files(wrf_folder, get_catalog(wrf_folder), args.domain, 'wrfout')
+met_em_files, met_em_times = query_files(met_em_folder, get_catalog(met_em_folder), args.domain, 'met_em')
+if len(wrf_files) == 0:
+    print('No wrfout files found in', wrf_folder)
+    sys.exit(1)
+
+# the windows cover the full hours after the first output, the first output itself is not part of any window
+t_end = min(wrf_times[-1], met_em_times[-1]).replace(minute=0, second=0, microsecond=0)
+converted_files = [file for file, t in zip(wrf_files, wrf_times) if wrf_times[0] < t <= t_end]
+converted_met_em_files = [file for file, t in zip(met_em_files, met_em_times) if wrf_times[0] <= t < t_end]
+
+# the outputs and logs are kept in the output folder, the temporary folder is only removed after all conversions
+# succeeded so that the log of a failed conversion remains
+if args.output_folder is None:
+    output_folder = tempfile.mkdtemp(prefix='benchmark_')
+else:
+    output_folder = args.output_folder
+    os.makedirs(output_folder, exist_ok=True)
+
+print('{:<16}{:>10}{:>10}{:>12}{:>12}{:>12}{:>14}'.format('properties', 'windows', 'files', 'files/s', 'MB/s', 's/window', 'peak RSS MB'))
+
+for name in args.property_sets:
+    property_set = property_sets[name]
+    outfile = os.path.join(output_folder, name)
+    command = [sys.executable, convert_script, '-w', wrf_folder, '-n', 'benchmark', '-o', outfile, '-d', args.domain, '-to', '0',
+               '-pw'] + property_set['wrf']
+    input_files = list(converted_files)
+    if len(property_set['met_em']) > 0:
+        command += ['-e', met_em_folder, '-pm'] + property_set['met_em']
+        input_files += converted_met_em_files
+    command += converter_args
+
+    # outputs of a previous benchmark in the output folder would be counted as the result of this conversion
+    for extension in backend_extensions.values():
+        if os.path.isdir(outfile + extension):
+            shutil.rmtree(outfile + extension)
+        elif os.path.exists(outfile + extension):
+            os.remove(outfile + extension)
+
+    t_total, peak_rss = run_conversion(command, os.path.join(output_folder, name + '.log'))
+
+    # the output may be a netcdf file or a directory store depending on the converter arguments
+    num_windows = 0
+    for backend, extension in backend_extensions.items():
+        if os.path.exists(outfile + extension):
+            output = open_output(outfile + extension, 'r' if backend == 'netcdf' else 'a', backend)
+            num_windows = output['benchmark']['wrf'].dimensions['time'].size
+            output.close()
+
+    input_mb = sum(os.path.getsize(file) for file in input_files) / 1e6
+    result = {
+        'timestamp': datetime.now().isoformat(),
+        'property_set': name,
+        'converter_args': converter_args,
+        'windows': num_windows,
+        'files': len(input_files),
+        'seconds': t_total,
+        'files_per_second': len(input_files) / t_total,
+        'mb_per_second': input_mb / t_total,
+        'seconds_per_window': t_total / max(num_windows, 1),
+        'peak_rss_mb': peak_rss,
+    }
+    print('{:<16}{:>10}{:>10}{:>12.1f}{:>12.1f}{:>12.3f}{:>14.0f}'.format(
+        name, result['windows'], result['files'], result['files_per_second'], result['mb_per_second'], result['seconds_per_window'], result['peak_rss_mb']))
+
+    if args.json:
+        with open(args.json, 'a') as f:
+            f.write(json.dumps(result) + '\n')
+
+if args.output_folder is None:
+    shutil.rmtree(output_folder)
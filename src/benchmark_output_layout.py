@@ -0,0 +1,96 @@
+import argparse
+from netCDF4 import Dataset
+import numpy as np
+import os
+import tempfile
+import time
+from output_layout import access_patterns, get_dim_sizes, plan_layout, set_chunk_cache
+
+def get_synthetic_frame(rng, nz, ny, nx):
+    # smooth field with some noise so that the compression behaves similar to real model output
+    z = np.linspace(0.0, 1.0, nz)[:, None, None]
+    y = np.linspace(0.0, 2 * np.pi, ny)[None, :, None]
+    x = np.linspace(0.0, 2 * np.pi, nx)[None, None, :]
+    phase = rng.uniform(0.0, 2 * np.pi)
+    data = 10.0 * z + np.sin(x + phase) * np.cos(y - phase) + 0.1 * rng.standard_normal((nz, ny, nx))
+    return data.astype(np.float32)
+
+def write_file(filename, args, pattern, complevel):
+    compression = 'zlib' if complevel > 0 else None
+    rng = np.random.default_rng(0)
+
+    ncfile = Dataset(filename, mode='w', format='NETCDF4')
+    ncfile.createDimension('time', None)
+    ncfile.createDimension('z', args.nz)
+    ncfile.createDimension('lat', args.ny)
+    ncfile.createDimension('lon', args.nx)
+    dims = ('time', 'z', 'lat', 'lon')
+    layout = plan_layout(dims, get_dim_sizes(ncfile, dims, args.time_size), np.float32, pattern, compression, complevel)
+    var = ncfile.createVariable('U', np.float32, dims, **layout)
+    set_chunk_cache(var)
+
+    # write the entries one by one and sync after every entry like the conversion
+    t_write = 0.0
+    for i in range(args.nt):
+        data = get_synthetic_frame(rng, args.nz, args.ny, args.nx)
+        t_start = time.perf_counter()
+        var[i] = data
+        ncfile.sync()
+        t_write += time.perf_counter() - t_start
+
+    t_start = time.perf_counter()
+    ncfile.close()
+    t_write += time.perf_counter() - t_start
+    return t_write, layout['chunksizes']
+
+def read_latency(filename, args, read_pattern):
+    rng = np.random.default_rng(1)
+    ncfile = Dataset(filename)
+    var = ncfile['U']
+
+    t_read = 0.0
+    for i in range(args.repeat):
+        t, k, j, l = rng.integers(args.nt), rng.integers(args.nz), rng.integers(args.ny), rng.integers(args.nx)
+        t_start = time.perf_counter()
+        if read_pattern == 'frame':
+            var[t]
+        elif read_pattern == 'column':
+            var[t, :, j, l]
+        elif read_pattern == 'timeseries':
+            var[:, k, j, l]
+        t_read += time.perf_counter() - t_start
+
+    ncfile.close()
+    return t_read / args.repeat
+
+parser = argparse.ArgumentParser(description='Benchmark the output layouts for the different access patterns')
+parser.add_argument('--nx', type=int, default=200, help='Number of cells in x direction')
+parser.add_argument('--ny', type=int, default=200, help='Number of cells in y direction')
+parser.add_argument('--nz', type=int, default=40, help='Number of vertical layers')
+parser.add_argument('--nt', type=int, default=48, help='Number of time entries that are written')
+parser.add_argument('--time_size', type=int, default=12, help='Expected number of time entries the chunks are sized for')
+parser.add_argument('-c', '--compress', type=int, nargs='+', default=[0, 1, 6], help='Compression levels to benchmark')
+parser.add_argument('-p', '--patterns', type=str, nargs='+', default=access_patterns, choices=access_patterns, help='Access patterns to plan the layout for')
+parser.add_argument('-r', '--repeat', type=int, default=20, help='Number of reads per read pattern')
+parser.add_argument('-d', '--directory', type=str, help='Directory for the benchmark files, a temporary directory if not set')
+args = parser.parse_args()
+
+raw_bytes = 4 * args.nt * args.nz * args.ny * args.nx
+
+with tempfile.TemporaryDirectory(dir=args.directory) as directory:
+    header = '{:<12}{:>6}{:>22}{:>12}{:>8}'.format('layout', 'level', 'chunks', 'write MB/s', 'ratio')
+    header += ''.join('{:>16}'.format(read_pattern + ' ms') for read_pattern in access_patterns)
+    print(header)
+
+    for pattern in args.patterns:
+        for complevel in args.compress:
+            filename = os.path.join(directory, pattern + '_' + str(complevel) + '.nc')
+            t_write, chunksizes = write_file(filename, args, pattern, complevel)
+
+            line = '{:<12}{:>6}{:>22}{:>12.1f}{:>8.2f}'.format(
+                pattern, complevel, str(chunksizes), raw_bytes / t_write / 1e6, raw_bytes / os.path.getsize(filename))
+            for read_pattern in access_patterns:
+                line += '{:>16.2f}'.format(1e3 * read_latency(filename, args, read_pattern))
+            print(line)
+
+            os.remove(filename)
@@ -0,0 +1,155 @@
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import re
+import sys
+import tempfile
+import threading
+import download_engine
+from download_engine import download_url, retrieve_cds, is_grib
+
+# payloads served by the stand-in, a valid grib file starts with GRIB and ends with 7777
+grib_data = b'GRIB' + bytes(range(256)) * 64 + b'7777'
+
+# fake cdsapi module, the client downloads the requested dataset from the stand-in and resumes an existing target
+# like the real client
+fake_cdsapi = '''
+import os
+import urllib.request
+
+class Client:
+    def __init__(self, url=None, key=None, quiet=False):
+        if url is None:
+            raise Exception('Missing/incomplete configuration file')
+        self.url = url
+
+    def retrieve(self, dataset, request, target):
+        offset = os.path.getsize(target) if os.path.exists(target) else 0
+        headers = {'Range': 'bytes={}-'.format(offset)} if offset > 0 else {}
+        with urllib.request.urlopen(urllib.request.Request(self.url + '/' + dataset, headers=headers)) as response:
+            with open(target, 'ab' if response.status == 206 else 'wb') as f:
+                f.write(response.read())
+'''
+
+class StandIn(BaseHTTPRequestHandler):
+    # the behaviour of every path, the requests with their range header are recorded per path
+    routes = {}
+    requests = {}
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        path = self.path.lstrip('/')
+        StandIn.requests.setdefault(path, []).append(self.headers.get('Range'))
+        route = StandIn.routes.get(path)
+        if route is None:
+            self.send_error(404)
+            return
+        if route['status'] != 200:
+            self.send_error(route['status'])
+            return
+
+        data = route['data']
+        match = re.match(r'bytes=(\d+)-', self.headers.get('Range') or '')
+        if match is not None and route.get('ranges', True):
+            offset = int(match.group(1))
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(offset, len(data) - 1, len(data)))
+        else:
+            offset = 0
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(data) - offset))
+        self.end_headers()
+
+        # a truncated response closes the connection after a part of the announced length
+        body = data[offset:]
+        if route.get('truncate_once', False) and len(StandIn.requests[path]) == 1:
+            body = body[:len(body) // 2]
+            self.close_connection = True
+        self.wfile.write(body)
+
+def check(name, condition):
+    results.append(condition)
+    print('{:<56}{}'.format(name, 'ok' if condition else 'FAILED'))
+
+parser = argparse.ArgumentParser(description='Check the download engine against a local HTTP and CDS stand-in')
+parser.add_argument('--retries', type=int, default=3, help='Number of attempts per file')
+args = parser.parse_args()
+
+StandIn.routes = {
+    'full.grib': {'status': 200, 'data': grib_data},
+    'norange.grib': {'status': 200, 'data': grib_data, 'ranges': False},
+    'truncated.grib': {'status': 200, 'data': grib_data, 'truncate_once': True},
+    'html.grib': {'status': 200, 'data': b'<html>maintenance</html>'},
+    'error.grib': {'status': 500},
+    'reanalysis-era5-single-levels': {'status': 200, 'data': grib_data},
+    'reanalysis-era5-pressure-levels': {'status': 200, 'data': b'<html>maintenance</html>'},
+}
+server = ThreadingHTTPServer(('127.0.0.1', 0), StandIn)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+
+# no waiting between the attempts
+download_engine.retry_backoff_s = 0.0
+results = []
+
+with tempfile.TemporaryDirectory() as folder:
+    with open(os.path.join(folder, 'cdsapi.py'), 'w') as f:
+        f.write(fake_cdsapi)
+    sys.path.insert(0, folder)
+
+    target = os.path.join(folder, 'full.grib')
+    with open(target + '.part', 'wb') as f:
+        f.write(grib_data[:1000])
+    error = download_url(url + '/full.grib', target, args.retries, 10.0)
+    check('resume a part file with a range request', error is None and StandIn.requests['full.grib'] == ['bytes=1000-'])
+    check('the resumed file is complete', open(target, 'rb').read() == grib_data and not os.path.exists(target + '.part'))
+
+    error = download_url(url + '/full.grib', target, args.retries, 10.0)
+    check('skip a complete file', error is None and len(StandIn.requests['full.grib']) == 1)
+
+    target = os.path.join(folder, 'norange.grib')
+    with open(target + '.part', 'wb') as f:
+        f.write(grib_data[:1000])
+    error = download_url(url + '/norange.grib', target, args.retries, 10.0)
+    check('restart if the server ignores the range', error is None and open(target, 'rb').read() == grib_data)
+
+    target = os.path.join(folder, 'truncated.grib')
+    error = download_url(url + '/truncated.grib', target, args.retries, 10.0)
+    requests = StandIn.requests['truncated.grib']
+    check('resume after a truncated response', error is None and len(requests) == 2 and requests[1] is not None)
+    check('the truncated file is complete', is_grib(target) and open(target, 'rb').read() == grib_data)
+
+    target = os.path.join(folder, 'html.grib')
+    error = download_url(url + '/html.grib', target, args.retries, 10.0)
+    check('reject a body that is not grib', error is not None and not os.path.exists(target) and not os.path.exists(target + '.part'))
+
+    error = download_url(url + '/error.grib', os.path.join(folder, 'error.grib'), args.retries, 10.0)
+    check('give up after {} attempts'.format(args.retries), error is not None and len(StandIn.requests['error.grib']) == args.retries)
+
+    error = download_url(url + '/missing.grib', os.path.join(folder, 'missing.grib'), args.retries, 10.0)
+    check('do not retry a missing file', error is not None and len(StandIn.requests['missing.grib']) == 1)
+
+    target = os.path.join(folder, 'single_levels.grib')
+    with open(target + '.part', 'wb') as f:
+        f.write(grib_data[:1000])
+    error = retrieve_cds('reanalysis-era5-single-levels', {}, target, args.retries, url)
+    check('cds: resume a part file from the given endpoint', error is None and StandIn.requests['reanalysis-era5-single-levels'] == ['bytes=1000-'])
+    check('cds: the resumed file is complete', open(target, 'rb').read() == grib_data)
+
+    target = os.path.join(folder, 'pressure_levels.grib')
+    error = retrieve_cds('reanalysis-era5-pressure-levels', {}, target, args.retries, url)
+    check('cds: reject a body that is not grib after the retries', error is not None and not os.path.exists(target)
+          and len(StandIn.requests['reanalysis-era5-pressure-levels']) == args.retries)
+
+    error = retrieve_cds('reanalysis-era5-single-levels', {}, os.path.join(folder, 'no_config.grib'), args.retries)
+    check('cds: give up without a configuration', error is not None and 'configuration' in error)
+
+server.shutdown()
+
+print('{} of {} checks passed'.format(sum(results), len(results)))
+if not all(results):
+    sys.exit(1)
+
+exit(0)
@@ -5,9 +5,18 @@ from netCDF4 import Dataset
 import numpy as np
 import os
 import calendar
+from collections import deque
+from functools import partial
+import multiprocessing
 from tqdm import tqdm
 from wrf import getvar, destagger
+from file_catalog import get_catalog, query_files, select_times
+from output_backend import backend_extensions, backends, open_output
+from output_layout import access_patterns, get_dim_sizes, plan_layout, set_chunk_cache
+from window_aggregation import aggregate_window
+from wrf_diagnostics import compute_diagnostics, get_crop, get_tiles
 import sys
+from time import sleep
 
 def destagger_data(variable_data):
     # destagger the data that is available on a different grid
@@ -28,26 +37,15 @@ def destagger_data(variable_data):
     return data
 
 def get_files_dict_and_times(folder, domain, searchstring):
-    files = [os.path.join(folder, f) for f in os.listdir(folder) if (os.path.isfile(os.path.join(folder, f))  and domain in f and searchstring in f)]
-    files.sort()
+    files, out_times = query_files(folder, get_catalog(folder), domain, searchstring)
 
     if len(files) == 0:
         print('No ' + searchstring + '* files found')
         sys.exit()
 
     out_dict = {}
-    out_times = []
-
-    for file in files:
-        try:
-            # wrfout files
-            t_file = datetime.strptime(os.path.basename(file).split(domain)[-1], "_%Y-%m-%d_%H:%M:%S")
-        except:
-            # metem files
-            t_file = datetime.strptime(os.path.basename(file).split(domain)[-1], ".%Y-%m-%d_%H:%M:%S.nc")
+    for file, t_file in zip(files, out_times):
         out_dict[t_file.strftime("%Y-%m-%d_%H:%M:%S")] = file
-        out_times.append(t_file)
-    out_times = np.array(out_times)
 
     return out_dict, out_times
 
@@ -69,16 +67,15 @@ def get_samples_list(wrfout_times, met_em_dict, t_start, t_end, window_dt):
         if has_met_em_files:
             sample['met_em_file'] = met_em_dict[t_start.strftime("%Y-%m-%d_%H:%M:%S")]
 
-        idx_select = np.logical_and(wrfout_times <= t_start + dt_hour, wrfout_times > t_start)
+        # the times are sorted so the frames of the hour and of the windows are found by bisection
         sample['wrf_windows'] = []
-        times_sample = wrfout_times[idx_select]
+        times_sample = wrfout_times[select_times(wrfout_times, t_start, t_start + dt_hour)]
 
         t_window_start = t_start
         t_window_end = t_start + dt_window
         for i in range(num_time_windows):
-            idx_select = np.logical_and(times_sample > t_window_start, times_sample <= t_window_end)
             window = {
-                'times': times_sample[idx_select],
+                'times': times_sample[select_times(times_sample, t_window_start, t_window_end)],
                 't_end': t_window_end,
                 'period': t_window_start.strftime("%Y-%m-%d_%H:%M:%S") + 'to' + t_window_end.strftime("%Y-%m-%d_%H:%M:%S")
             }
@@ -91,14 +88,17 @@ def get_samples_list(wrfout_times, met_em_dict, t_start, t_end, window_dt):
 
     return samples_list
 
-def setup_wrf_vars(out_case_group, wrfout_dict, properties_wrf, property_map_wrf, compression, complevel, lbc_offset):
+def setup_wrf_vars(out_case_group, wrfout_dict, properties_wrf, property_map_wrf, compression, complevel, lbc_offset, max_layers, access_pattern, time_size):
     out_wrf_group = out_case_group.createGroup('wrf')
     ncfile = Dataset(wrfout_dict[list(wrfout_dict.keys())[0]])
     lat_dim_size = ncfile.dimensions['south_north'].size - 2 * lbc_offset
     lon_dim_size = ncfile.dimensions['west_east'].size - 2 * lbc_offset
     out_wrf_group.createDimension('lat', lat_dim_size)
     out_wrf_group.createDimension('lon', lon_dim_size)
-    out_wrf_group.createDimension('z', ncfile.dimensions['bottom_top'].size)
+    z_dim_size = ncfile.dimensions['bottom_top'].size
+    if max_layers > 0:
+        z_dim_size = min(max_layers, z_dim_size)
+    out_wrf_group.createDimension('z', z_dim_size)
     out_wrf_group.createDimension('z_cloud', 3)
     out_wrf_group.createDimension('time', None)
 
@@ -121,7 +121,7 @@ def setup_wrf_vars(out_case_group, wrfout_dict, properties_wrf, property_map_wrf
     out_ncfile_wrf_z = out_wrf_group.createVariable('z', np.float32, ('z', 'lat', 'lon'))
     out_ncfile_wrf_z.units = 'm'
     out_ncfile_wrf_z.long_name = 'model height - [MSL] (mass grid)'
-    alt = getvar(ncfile, 'z', meta=False)
+    alt = getvar(ncfile, 'z', meta=False)[:z_dim_size]
     if lbc_offset > 0:
         alt = alt[:, lbc_offset:-lbc_offset, lbc_offset:-lbc_offset]
     out_ncfile_wrf_z[:] = alt
@@ -145,21 +145,15 @@ def setup_wrf_vars(out_case_group, wrfout_dict, properties_wrf, property_map_wrf
         # destagger the data that is potentially available on a different grid
         data = destagger_data(variable_data)
 
-        if property_map_wrf[property]['static']:
-            if len(data.shape) == 2:
-                chunksizes = (lat_dim_size,lon_dim_size)
-            elif len(data.shape) == 3:
-                chunksizes = (1, lat_dim_size,lon_dim_size)
-            else:
-                print('Unsupported dimension for static data')
+        dims = property_map_wrf[property]['dim']
+        layout = plan_layout(dims, get_dim_sizes(out_wrf_group, dims, time_size), property_map_wrf[property]['type'], access_pattern, compression, complevel)
 
+        if property_map_wrf[property]['static']:
             var = out_wrf_group.createVariable(
                 property,
                 property_map_wrf[property]['type'],
-                property_map_wrf[property]['dim'],
-                chunksizes=chunksizes,
-                compression=compression,
-                complevel=complevel)
+                dims,
+                **layout)
 
             var.units = property_map_wrf[property]['unit']
             var.long_name = property_map_wrf[property]['description']
@@ -187,19 +181,19 @@ def setup_wrf_vars(out_case_group, wrfout_dict, properties_wrf, property_map_wrf
                 var = out_wrf_group.createVariable(
                     property + postfix,
                     property_map_wrf[property]['type'],
-                    property_map_wrf[property]['dim'],
-                    chunksizes=(1,1,lat_dim_size,lon_dim_size),
-                    compression=compression,
-                    complevel=complevel)
+                    dims,
+                    **layout)
                 var.units = property_map_wrf[property]['unit']
                 var.long_name = property_map_wrf[property]['description']
                 try:
                     var.projection = variable_data.projection.proj4()
                 except:
                     pass
+
+    ncfile.close()
     return out_ncfile_wrf_time
 
-def setup_era5_vars(out_case_group, met_em_dict, properties_met_em, property_map_met_em, compression, complevel, lbc_offset):
+def setup_era5_vars(out_case_group, met_em_dict, properties_met_em, property_map_met_em, compression, complevel, lbc_offset, access_pattern, time_size):
     out_era5_group = out_case_group.createGroup('era5')
     ncfile = Dataset(met_em_dict[list(met_em_dict.keys())[0]])
     lat_dim_size = ncfile.dimensions['south_north'].size - 2 * lbc_offset
@@ -259,22 +253,14 @@ def setup_era5_vars(out_case_group, met_em_dict, properties_met_em, property_map
         # destagger the data that is potentially available on a different grid
         data = destagger_data(variable_data)
 
-        if len(property_map_met_em[property]['dim']) == 2:
-            chunksizes = (9, 9)
-        elif len(property_map_met_em[property]['dim']) == 3:
-            chunksizes = (9, 9, 9)
-        elif len(property_map_met_em[property]['dim']) == 4:
-            chunksizes = (1, 9, 9, 9)
-        else:
-            print('Unsupported dimension for static data')
+        dims = property_map_met_em[property]['dim']
+        layout = plan_layout(dims, get_dim_sizes(out_era5_group, dims, time_size), property_map_met_em[property]['type'], access_pattern, compression, complevel)
 
         var = out_era5_group.createVariable(
             property,
             property_map_met_em[property]['type'],
-            property_map_met_em[property]['dim'],
-            chunksizes=chunksizes,
-            compression=compression,
-            complevel=complevel)
+            dims,
+            **layout)
 
         var.units = property_map_met_em[property]['unit']
         var.long_name = property_map_met_em[property]['description']
@@ -294,8 +280,203 @@ def setup_era5_vars(out_case_group, met_em_dict, properties_met_em, property_map
             # directly fill the static data
             var[:] = data.data
 
+    ncfile.close()
     return out_ncfile_era5_time
 
+def get_written_state(out_group):
+    # the time is written last for every entry, so only entries with a valid time are complete
+    times = out_group['time'][:]
+    valid = np.logical_not(np.ma.getmaskarray(times))
+    num_written = len(times) if valid.all() else int(np.argmin(valid))
+    last_time = int(times[num_written - 1]) if num_written > 0 else None
+    return num_written, last_time
+
+def get_output_mismatch(out_case_group, wrf_file, met_em_file, domain, window_dt, lbc_offset, max_layers):
+    # an existing output is only continued if it was written for the same domain, windows and grid, e.g. not for the
+    # other mode of the case or with other conversion arguments
+    mismatch = []
+    if 'wrf' in out_case_group.groups.keys():
+        out_wrf_group = out_case_group['wrf']
+        stored_domain = getattr(out_wrf_group['time'], 'domain', None)
+        stored_window_dt = getattr(out_wrf_group['time'], 'window_dt', None)
+        if stored_domain != domain:
+            mismatch.append('domain {} instead of {}'.format(stored_domain, domain))
+        if stored_window_dt is None or int(stored_window_dt) != window_dt:
+            mismatch.append('{} min windows instead of {} min'.format(stored_window_dt, window_dt))
+
+        with Dataset(wrf_file) as ncfile:
+            sizes = {
+                'lat': ncfile.dimensions['south_north'].size - 2 * lbc_offset,
+                'lon': ncfile.dimensions['west_east'].size - 2 * lbc_offset,
+                'z': min(max_layers, ncfile.dimensions['bottom_top'].size) if max_layers > 0 else ncfile.dimensions['bottom_top'].size,
+            }
+            lat = ncfile['XLAT'][0]
+            lon = ncfile['XLONG'][0]
+        for dim, size in sizes.items():
+            if out_wrf_group.dimensions[dim].size != size:
+                mismatch.append('{} {} instead of {}'.format(dim, out_wrf_group.dimensions[dim].size, size))
+
+        # the same grid size at another location
+        if len(mismatch) == 0:
+            if lbc_offset > 0:
+                lat = lat[lbc_offset:-lbc_offset, lbc_offset:-lbc_offset]
+                lon = lon[lbc_offset:-lbc_offset, lbc_offset:-lbc_offset]
+            corners = (slice(None, None, lat.shape[0] - 1), slice(None, None, lat.shape[1] - 1))
+            if not (np.allclose(out_wrf_group['lat'][corners], lat[corners], atol=1e-4) and
+                    np.allclose(out_wrf_group['lon'][corners], lon[corners], atol=1e-4)):
+                mismatch.append('another grid location')
+
+    if 'era5' in out_case_group.groups.keys() and met_em_file is not None:
+        with Dataset(met_em_file) as ncfile:
+            sizes = {
+                'lat': ncfile.dimensions['south_north'].size - 2 * lbc_offset,
+                'lon': ncfile.dimensions['west_east'].size - 2 * lbc_offset,
+            }
+        for dim, size in sizes.items():
+            if out_case_group['era5'].dimensions[dim].size != size:
+                mismatch.append('era5 {} {} instead of {}'.format(dim, out_case_group['era5'].dimensions[dim].size, size))
+    return mismatch
+
+def skip_written_tasks(out_case_group, tasks):
+    # skip all the windows and samples that are already fully written to the output
+    write_index = {}
+    for group in ['wrf', 'era5']:
+        write_index[group] = 0
+        if group in out_case_group.groups.keys():
+            write_index[group], last_time = get_written_state(out_case_group[group])
+            if write_index[group] > 0:
+                tasks = [task for task in tasks if task['group'] != group or calendar.timegm(task['time'].utctimetuple()) > last_time]
+    return tasks, write_index
+
+def get_run_state(folder):
+    # exec_wrf.sh copies the rsl files to the output folder once wrf.exe terminated, between the segments of a
+    # segmented run it leaves a marker until the job of the next segment starts
+    between_segments = os.path.isfile(os.path.join(folder, 'wrf_segment_done'))
+    rsl_file = os.path.join(folder, 'wrf_rsl.error.0000')
+    if not os.path.isfile(rsl_file):
+        return False, False, between_segments
+    with open(rsl_file, 'r') as f:
+        success = 'SUCCESS COMPLETE WRF' in f.read()
+    return True, success, False
+
+def get_follow_horizon(wrfout_times, complete):
+    # wrf only creates the next output file after the previous one is written completely,
+    # so all but the newest file are complete while wrf.exe is still running
+    times = np.sort(wrfout_times)
+    if complete:
+        return times[-1]
+    if len(times) < 2:
+        return None
+    return times[-2]
+
+def get_tasks(samples_list, wrfout_dict, tiles):
+    # flatten the samples into the era5 and wrf tasks in the order they are written to the output,
+    # every entry is split into one task per tile
+    tasks = []
+    for sample in samples_list:
+        entries = []
+        if 'met_em_file' in sample.keys():
+            entries.append({'group': 'era5', 'time': sample['timestamp'], 'files': [sample['met_em_file']]})
+
+        for window in sample['wrf_windows']:
+            entries.append({
+                'group': 'wrf',
+                'time': window['t_end'],
+                'files': [wrfout_dict[time.strftime("%Y-%m-%d_%H:%M:%S")] for time in window['times']],
+            })
+
+        for entry in entries:
+            for i, (crop, region) in enumerate(tiles[entry['group']]):
+                task = dict(entry)
+                task['crop'] = crop
+                task['region'] = region
+                task['last_tile'] = i == len(tiles[entry['group']]) - 1
+                tasks.append(task)
+    return tasks
+
+def reduce_task(task, properties_wrf, property_map_wrf, properties_met_em):
+    out = {}
+    if task['group'] == 'era5':
+        diagnostics = compute_diagnostics(task['files'][0], properties_met_em, task['crop'])
+        for property in properties_met_em:
+            out[property] = diagnostics[property]
+
+    else:
+        window_data = aggregate_window(task['files'], properties_wrf, property_map_wrf, task['crop'])
+        for property in properties_wrf:
+            for mode in property_map_wrf[property]['modes']:
+                postfix = ''
+                if mode == 'avg':
+                    postfix = ''
+                elif mode == 'max':
+                    postfix = '_max'
+
+                out[property + postfix] = window_data[property][mode]
+    return out
+
+def run_tasks(tasks, reduce, workers):
+    # yield the reduced data in the order of the tasks, with multiple workers at most two tasks per worker
+    # are in flight so that the results do not pile up in memory if writing is slower than reducing
+    if workers > 1:
+        # fork the workers, the conversion script itself can not be imported again by spawned processes
+        with multiprocessing.get_context('fork').Pool(workers) as pool:
+            pending = deque()
+            for task in tasks:
+                pending.append(pool.apply_async(reduce, (task,)))
+                if len(pending) >= 2 * workers:
+                    yield pending.popleft().get()
+            while len(pending) > 0:
+                yield pending.popleft().get()
+    else:
+        for task in tasks:
+            yield reduce(task)
+
+def write_task(task, reduce, outfile, case_name, backend):
+    # reduce and write an entry directly from a worker process into the entry that was assigned to the task
+    data = reduce(task)
+    out_group = open_output(outfile, 'a', backend)[case_name][task['group']]
+    for name in data.keys():
+        out_group[name][(task['index'], Ellipsis) + task['region']] = data[name]
+    out_group['time'][task['index']] = calendar.timegm(task['time'].utctimetuple())
+
+def write_tasks(out_ncfile, out_case_group, tasks, reduce, workers, parallel_write=None):
+    tasks, write_index = skip_written_tasks(out_case_group, tasks)
+    if len(tasks) == 0:
+        return
+
+    # assign the output entries in time order, all the tiles of an entry are written to the same entry
+    for task in tasks:
+        task['index'] = write_index[task['group']]
+        if task['last_tile']:
+            write_index[task['group']] += 1
+
+    if parallel_write is not None:
+        # the workers write disjoint entries concurrently, the entries are allocated in advance
+        # since the output can not be resized by multiple processes at the same time
+        for group in write_index.keys():
+            if group in out_case_group.groups.keys():
+                out_case_group[group].resize_dimension('time', write_index[group])
+
+        with tqdm(total=len(tasks)) as pbar:
+            for _ in run_tasks(tasks, parallel_write, workers):
+                pbar.update(1)
+        return
+
+    # the windows are reduced in parallel but written by this process only in time order
+    with tqdm(total=len(tasks)) as pbar:
+        for task, data in zip(tasks, run_tasks(tasks, reduce, workers)):
+            out_group = out_case_group[task['group']]
+            for name in data.keys():
+                out_group[name][(task['index'], Ellipsis) + task['region']] = data[name]
+
+            # the time marks the entry as complete and is only written after its last tile
+            if task['last_tile']:
+                out_group['time'][task['index']] = calendar.timegm(task['time'].utctimetuple())
+
+                # flush after every entry so an interrupted conversion can be resumed from the last written entry
+                out_ncfile.sync()
+            pbar.update(1)
+
 parser = argparse.ArgumentParser(description='Converting the wrf')
 parser.add_argument('-w', '--wrfout_folder', type=str, required=True, help='Folder with the wrfout files')
 parser.add_argument('-e', '--met_em_folder', type=str, help='Folder with the met_em files')
@@ -310,7 +491,15 @@ parser.add_argument('-pm', '--properties_met_em', type=str, nargs='+', default=[
 parser.add_argument('-ni', '--namelist_input', type=str, help='Path to namelist.input file')
 parser.add_argument('-nw', '--namelist_wps', type=str, help='Path to namelist.wps file')
 parser.add_argument('-to', '--time_offset', type=int, default=1, help='Conversion start time offset in hours')
-parser.add_argument('--lbc_offset', type=int, default=6, help='Conversion start time offset in hours')
+parser.add_argument('--access_pattern', type=str, default='frame', choices=access_patterns, help='Read pattern the chunks of the output variables are optimized for, time series chunks span one hour of wrf and one day of era5 output')
+parser.add_argument('--backend', type=str, default='netcdf', choices=backends, help='Output format, a single netcdf file or a zarr directory store with one object per chunk')
+parser.add_argument('--resume', action='store_true', help='Continue the conversion in an existing output file and only convert the missing windows')
+parser.add_argument('--workers', type=int, default=1, help='Number of worker processes that reduce the time windows in parallel')
+parser.add_argument('--follow', action='store_true', help='Poll the wrfout folder and convert the windows as soon as they are complete until wrf.exe terminated')
+parser.add_argument('--poll_interval', type=int, default=60, help='Time in seconds between polling the wrfout folder in follow mode')
+parser.add_argument('--follow_timeout', type=int, default=60, help='Stop following the run if no new wrfout file appeared within this time in minutes')
+parser.add_argument('--tiles', type=int, nargs=2, default=[1, 1], metavar=('NY', 'NX'), help='Number of tiles in south-north and west-east direction that are read, aggregated and written independently to limit the memory usage')
+parser.add_argument('--lbc_offset', type=int, default=6, help='Number of lateral boundary cells that are cropped from each side of the grid')
 args = parser.parse_args()
 
 property_map_wrf = {
@@ -394,7 +583,10 @@ else:
     compression = None
     complevel = 4
 
-# get the wrf files
+# get the wrf files, when following a run wait for its first output
+if args.follow:
+    while len(query_files(args.wrfout_folder, get_catalog(args.wrfout_folder), args.domain, 'wrfout')[0]) == 0:
+        sleep(args.poll_interval)
 wrfout_dict, wrfout_times = get_files_dict_and_times(args.wrfout_folder, args.domain, 'wrfout')
 
 t_start = min(wrfout_times)
@@ -420,124 +612,144 @@ if args.time_offset > 0:
 samples_list = get_samples_list(wrfout_times, met_em_dict, t_start, t_end, args.window_dt)
 
 # fix the file name appendix
-if not args.output_file.endswith('.nc'):
-    outfile = args.output_file + '.nc'
+if not args.output_file.endswith(backend_extensions[args.backend]):
+    outfile = args.output_file + backend_extensions[args.backend]
 else:
     outfile = args.output_file
 
-# create the output dataset file
-out_ncfile = Dataset(outfile, mode='w', format='NETCDF4')
-out_case_group = out_ncfile.createGroup(args.case_name)
-out_case_group.createDimension('str_dim', 1)
+# create the output dataset file or reopen it to continue an interrupted or incremental conversion
+if args.resume and os.path.exists(outfile):
+    out_ncfile = open_output(outfile, 'a', args.backend)
+    if args.case_name in out_ncfile.groups.keys():
+        mismatch = get_output_mismatch(out_ncfile[args.case_name], wrfout_dict[list(wrfout_dict.keys())[0]],
+                                       met_em_dict[list(met_em_dict.keys())[0]] if has_met_em_files else None,
+                                       args.domain, args.window_dt, args.lbc_offset, args.max_layers)
+        if len(mismatch) > 0:
+            print('The existing output {} was written for {}, starting a new file'.format(outfile, ', '.join(mismatch)))
+            out_ncfile.close()
+            out_ncfile = open_output(outfile, 'w', args.backend)
+else:
+    out_ncfile = open_output(outfile, 'w', args.backend)
+
+new_case = not args.case_name in out_ncfile.groups.keys()
+if new_case:
+    out_case_group = out_ncfile.createGroup(args.case_name)
+    out_case_group.createDimension('str_dim', 1)
+else:
+    out_case_group = out_ncfile[args.case_name]
 
 # create the dimensions and variables for the WRF data
-var_time_wrf = setup_wrf_vars(out_case_group, wrfout_dict, args.properties_wrf, property_map_wrf, compression, complevel, args.lbc_offset)
+if not 'wrf' in out_case_group.groups.keys():
+    setup_wrf_vars(out_case_group, wrfout_dict, args.properties_wrf, property_map_wrf, compression, complevel, args.lbc_offset, args.max_layers, args.access_pattern, 60 // args.window_dt)
+    # the windows the entries were written for, checked when the output is continued
+    out_case_group['wrf']['time'].domain = args.domain
+    out_case_group['wrf']['time'].window_dt = args.window_dt
 
 # create the dimensions for the ERA5 data
-if has_met_em_files:
-    var_time_era5 = setup_era5_vars(out_case_group, met_em_dict, args.properties_met_em, property_map_met_em, compression, complevel, args.lbc_offset)
+if has_met_em_files and not 'era5' in out_case_group.groups.keys():
+    setup_era5_vars(out_case_group, met_em_dict, args.properties_met_em, property_map_met_em, compression, complevel, args.lbc_offset, args.access_pattern, 24)
 
 # store some metadata for the case as string variables
-var = out_case_group.createVariable('domain', str, ('str_dim',))
-var.long_name = 'domain of the WRF run'
-var[:] = np.array([args.domain], dtype='object')
-
-if args.namelist_input:
-    with open(args.namelist_input,'r') as namelist_file:
-        var = out_case_group.createVariable('namelist.input', str, ('str_dim',))
-        var.long_name = 'namelist.input file for the WRF run'
-        var[:] = np.array([namelist_file.read()], dtype='object')
-
-if args.namelist_wps:
-    with open(args.namelist_wps,'r') as namelist_file:
-        var = out_case_group.createVariable('namelist.wps', str, ('str_dim',))
-        var.long_name = 'namelist.wps file for the WPS run'
-        var[:] = np.array([namelist_file.read()])
+if new_case:
+    var = out_case_group.createVariable('domain', str, ('str_dim',))
+    var.long_name = 'domain of the WRF run'
+    var[:] = np.array([args.domain], dtype='object')
+
+    if args.namelist_input:
+        with open(args.namelist_input,'r') as namelist_file:
+            var = out_case_group.createVariable('namelist.input', str, ('str_dim',))
+            var.long_name = 'namelist.input file for the WRF run'
+            var[:] = np.array([namelist_file.read()], dtype='object')
+
+    if args.namelist_wps:
+        with open(args.namelist_wps,'r') as namelist_file:
+            var = out_case_group.createVariable('namelist.wps', str, ('str_dim',))
+            var.long_name = 'namelist.wps file for the WPS run'
+            var[:] = np.array([namelist_file.read()])
 
 # start converting and filling the data group
-wrf_write_index = 0
-era5_write_index = 0
-with tqdm(total=len(samples_list)) as pbar:
-    for i_sample, sample in enumerate(samples_list):
-        # process the met_em file
-        if 'met_em_file' in sample.keys():
-            ncfile = Dataset(sample['met_em_file'])
-
-            for property in args.properties_met_em:
-                variable_data = getvar(ncfile, property, meta=True)
-
-                # destagger the data that is available on a different grid
-                data = destagger_data(variable_data)
-
-                if not property_map_met_em[property]['static']:
-                    if args.lbc_offset > 0:
-                        if len(data.shape) == 2:
-                            data = data[args.lbc_offset:-args.lbc_offset, args.lbc_offset:-args.lbc_offset]
-                        elif len(data.shape) == 3:
-                            data = data[:, args.lbc_offset:-args.lbc_offset, args.lbc_offset:-args.lbc_offset]
-                        elif len(data.shape) == 4:
-                            data = data[:, :, args.lbc_offset:-args.lbc_offset, args.lbc_offset:-args.lbc_offset]
-                    out_case_group['era5'][property][era5_write_index] = data
-
-            var_time_era5[era5_write_index] = calendar.timegm(sample['timestamp'].utctimetuple())
-            era5_write_index += 1
-
-        # process the wrfout files
-        for i_window, window in enumerate(sample['wrf_windows']):
-            nc_files = []
-            for time in window['times']:
-                nc_files.append(Dataset(wrfout_dict[time.strftime("%Y-%m-%d_%H:%M:%S")]))
-
-            for property in args.properties_wrf:
-                property_nc = property_map_wrf[property]['name']
-
-                if not property_map_wrf[property]['static']:
-                    # dynamic field, get all the data and then process it
-                    all_data = []
-                    for file in nc_files:
-                        variable_data = getvar(file, property_nc, meta=True)
-
-                        # destagger the data that is available on a different grid
-                        data = destagger_data(variable_data)
-
-                        all_data.append(data)
-
-                    for mode in property_map_wrf[property]['modes']:
-                        postfix = ''
-                        if mode == 'avg':
-                            postfix = ''
-                        elif mode == 'max':
-                            postfix = '_max'
-
-                        if len(all_data) > 1:
-                            if mode == 'avg':
-                                processed_data = np.mean(np.stack(all_data, axis=0), axis=0)
-                            elif mode == 'max':
-                                stacked_data = np.stack(all_data, axis=0)
-                                max_val = np.max(stacked_data, axis=0)
-                                min_val = np.min(stacked_data, axis=0)
-                                processed_data = np.where(np.abs(max_val) > np.abs(min_val), max_val, min_val)
-                            else:
-                                print("Unknown data aggregation mode")
-                                sys.exit(1)
-                        else:
-                            processed_data = all_data[0]
-
-                        if args.max_layers > 0 and len(data.shape) == 3:
-                            processed_data = processed_data[:args.max_layers]
-
-                        if args.lbc_offset > 0:
-                            if len(processed_data.shape) == 2:
-                                processed_data = processed_data[args.lbc_offset:-args.lbc_offset, args.lbc_offset:-args.lbc_offset]
-                            elif len(processed_data.shape) == 3:
-                                processed_data = processed_data[:, args.lbc_offset:-args.lbc_offset, args.lbc_offset:-args.lbc_offset]
-                            elif len(processed_data.shape) == 4:
-                                processed_data = processed_data[:, :, args.lbc_offset:-args.lbc_offset, args.lbc_offset:-args.lbc_offset]
-
-                        out_case_group['wrf'][property + postfix][wrf_write_index] = processed_data
-
-            var_time_wrf[wrf_write_index] = calendar.timegm(window['t_end'].utctimetuple())
-            wrf_write_index += 1
-        pbar.update(1)
-
-out_ncfile.close()
\ No newline at end of file
+properties_wrf_dynamic = [property for property in args.properties_wrf if not property_map_wrf[property]['static']]
+
+# only read the part of the grid that is retained in the output
+crop_wrf = get_crop(wrfout_dict[list(wrfout_dict.keys())[0]], args.lbc_offset, args.max_layers)
+tiles = {'wrf': get_tiles(crop_wrf, args.tiles[0], args.tiles[1])}
+if has_met_em_files:
+    crop_met_em = get_crop(met_em_dict[list(met_em_dict.keys())[0]], args.lbc_offset, 0)
+    tiles['era5'] = get_tiles(crop_met_em, args.tiles[0], args.tiles[1])
+
+properties_met_em_dynamic = [property for property in args.properties_met_em if not property_map_met_em[property]['static']]
+reduce = partial(
+    reduce_task,
+    properties_wrf=properties_wrf_dynamic,
+    property_map_wrf=property_map_wrf,
+    properties_met_em=properties_met_em_dynamic)
+
+# check that a reopened output contains all the requested variables
+if not new_case:
+    missing = [property for property in properties_wrf_dynamic if not property in out_case_group['wrf'].variables.keys()]
+    if has_met_em_files:
+        missing += [property for property in properties_met_em_dynamic if not property in out_case_group['era5'].variables.keys()]
+    if len(missing) > 0:
+        print('Properties missing in the existing output file:', missing)
+        sys.exit(1)
+
+# the chunk cache settings are not stored in the file and have to be set again when an output is reopened
+for group in ['wrf', 'era5']:
+    if group in out_case_group.groups.keys():
+        for var in out_case_group[group].variables.values():
+            set_chunk_cache(var)
+
+for group in ['wrf', 'era5']:
+    if group in out_case_group.groups.keys():
+        num_written, _ = get_written_state(out_case_group[group])
+        if num_written > 0:
+            print('Resuming the', group, 'data after', num_written, 'written entries')
+
+# with a chunked directory store the workers write their entries directly if every entry is stored in separate chunks
+# and not split into tiles that share chunks
+parallel_write = None
+if args.backend == 'zarr' and args.workers > 1 and args.tiles[0] * args.tiles[1] == 1:
+    time_chunks = []
+    for group in ['wrf', 'era5']:
+        if group in out_case_group.groups.keys():
+            time_chunks += [var.chunking()[0] for var in out_case_group[group].variables.values() if var.dimensions[0] == 'time']
+    if all(chunk == 1 for chunk in time_chunks):
+        parallel_write = partial(write_task, reduce=reduce, outfile=outfile, case_name=args.case_name, backend=args.backend)
+
+if args.follow:
+    # convert the windows while the simulation is running until wrf.exe terminated
+    num_files = 0
+    t_last_file = datetime.now()
+    finished = False
+    while not finished:
+        # check the state before listing the files so that the final listing contains all the output
+        finished, success, between_segments = get_run_state(args.wrfout_folder)
+        wrfout_dict, wrfout_times = get_files_dict_and_times(args.wrfout_folder, args.domain, 'wrfout')
+
+        # the job of the next segment may wait in the queue for longer than the timeout
+        if len(wrfout_times) > num_files or between_segments:
+            num_files = len(wrfout_times)
+            t_last_file = datetime.now()
+        elif not finished and datetime.now() - t_last_file > timedelta(minutes=args.follow_timeout):
+            print('No new wrfout files for', args.follow_timeout, 'minutes, stop following the run')
+            finished = True
+
+        horizon = get_follow_horizon(wrfout_times, success or between_segments)
+        if horizon is not None:
+            # include the hour that is currently simulated, its windows are converted as soon as they are complete
+            t_end = horizon.replace(minute=0, second=0, microsecond=0)
+            if t_end < horizon:
+                t_end += timedelta(hours=1)
+            if has_met_em_files:
+                t_end = min([t_end, max(met_em_times)])
+
+            samples_list = get_samples_list(wrfout_times, met_em_dict, t_start, t_end, args.window_dt)
+            tasks = [task for task in get_tasks(samples_list, wrfout_dict, tiles) if task['time'] <= horizon]
+            write_tasks(out_ncfile, out_case_group, tasks, reduce, args.workers, parallel_write)
+
+        if not finished:
+            sleep(args.poll_interval)
+else:
+    write_tasks(out_ncfile, out_case_group, get_tasks(samples_list, wrfout_dict, tiles), reduce, args.workers, parallel_write)
+
+out_ncfile.close()
@@ -0,0 +1,200 @@
+import hashlib
+import json
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+
+# the owner of a lock refreshes it while downloading, a lock that was not refreshed for this long belongs to a job
+# that was killed
+stale_lock_s = 1800
+lock_refresh_s = 60.0
+lock_poll_s = 10.0
+
+def get_key_hash(key):
+    # the request without the area, e.g. the variables, pressure levels and the time, identifies the content
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()[:16]
+
+def get_area_name(area):
+    if area is None:
+        return 'global'
+    return 'N{:.2f}_W{:.2f}_S{:.2f}_E{:.2f}'.format(*area)
+
+def expand_area(area, margin):
+    # a slightly larger area than requested so that the neighbouring cases of a sweep can use the same file
+    if area is None:
+        return None
+    north, west, south, east = area
+    return [min(north + margin, 90.0), west - margin, max(south - margin, -90.0), east + margin]
+
+def covers(entry_area, area):
+    if entry_area is None:
+        return True
+    if area is None:
+        return False
+    return entry_area[0] >= area[0] and entry_area[1] <= area[1] and entry_area[2] <= area[2] and entry_area[3] >= area[3]
+
+def find_entry(entry_dir, area):
+    # any complete file of this content whose area contains the requested area
+    if not os.path.isdir(entry_dir):
+        return None
+    for name in sorted(os.listdir(entry_dir)):
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(entry_dir, name), 'r') as f:
+                info = json.load(f)
+        except (OSError, ValueError):
+            continue
+        data_file = os.path.join(entry_dir, info['file'])
+        if covers(info['area'], area) and os.path.isfile(data_file):
+            return data_file
+    return None
+
+def read_lock(lock_file):
+    try:
+        with open(lock_file, 'r') as f:
+            return f.read()
+    except OSError:
+        return None
+
+def acquire_lock(lock_file):
+    # returns the token of the owner that is written into the lock or None if another job holds it
+    token = '{}:{}:{}'.format(socket.gethostname(), os.getpid(), uuid.uuid4().hex)
+    try:
+        fd = os.open(lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        # only the stale lock that was inspected is removed, not a new one of another job
+        owner = read_lock(lock_file)
+        try:
+            if time.time() - os.path.getmtime(lock_file) > stale_lock_s and read_lock(lock_file) == owner:
+                os.remove(lock_file)
+        except OSError:
+            pass
+        return None
+    except FileNotFoundError:
+        # the entry directory was removed by the eviction
+        return None
+    with os.fdopen(fd, 'w') as f:
+        f.write(token)
+    return token
+
+def release_lock(lock_file, token):
+    # a lock that was broken by another job is not removed
+    if read_lock(lock_file) == token:
+        try:
+            os.remove(lock_file)
+        except FileNotFoundError:
+            pass
+
+def refresh_lock(lock_file, token, stop):
+    # touch the lock while a long download, e.g. a queued cds request, is running so that it does not become stale
+    while not stop.wait(lock_refresh_s):
+        if read_lock(lock_file) != token:
+            return
+        try:
+            os.utime(lock_file)
+        except OSError:
+            return
+
+def link_file(source, filename):
+    # a hard link keeps the data of the case even if the cache entry is evicted later
+    if os.path.lexists(filename):
+        os.remove(filename)
+    try:
+        os.link(source, filename)
+    except OSError:
+        shutil.copyfile(source, filename)
+
+def get_cached_file(cache_dir, dataset, key, area, margin, fetch, filename):
+    # fetch(target, area) downloads the data of the area to target and returns an error message or None
+    entry_dir = os.path.join(cache_dir, dataset, get_key_hash(key))
+    lock_file = os.path.join(entry_dir, '.lock')
+
+    while True:
+        os.makedirs(entry_dir, exist_ok=True)
+        entry = find_entry(entry_dir, area)
+        if entry is not None:
+            try:
+                # the modification time of an entry is its last use, it decides which entries are evicted first
+                os.utime(entry)
+                link_file(entry, filename)
+                return None
+            except FileNotFoundError:
+                # the entry was evicted by another job in the meantime
+                continue
+
+        token = acquire_lock(lock_file)
+        if token is None:
+            # another job downloads this content, it may cover the requested area once it is done
+            time.sleep(lock_poll_s)
+            continue
+
+        stop = threading.Event()
+        refresh = threading.Thread(target=refresh_lock, args=(lock_file, token, stop), daemon=True)
+        refresh.start()
+        try:
+            if find_entry(entry_dir, area) is None:
+                fetch_area = expand_area(area, margin)
+                name = get_area_name(fetch_area)
+                error = fetch(os.path.join(entry_dir, name + '.grib'), fetch_area)
+                if error is not None:
+                    return error
+
+                # the sidecar is written last and atomically, an entry without it is never used
+                info = {'dataset': dataset, 'key': key, 'area': fetch_area, 'file': name + '.grib', 'created': time.time()}
+                with open(os.path.join(entry_dir, name + '.json.tmp'), 'w') as f:
+                    json.dump(info, f)
+                os.replace(os.path.join(entry_dir, name + '.json.tmp'), os.path.join(entry_dir, name + '.json'))
+        finally:
+            stop.set()
+            refresh.join()
+            release_lock(lock_file, token)
+
+def evict(cache_dir, max_bytes, max_age_s):
+    # remove the entries that were not used for longer than the maximum age and then the least recently used
+    # ones until the cache is smaller than the maximum size, entries that are currently downloaded are kept
+    # other files in the cache, e.g. a readme, are ignored
+    entries = []
+    entry_dirs = []
+    for dataset in os.listdir(cache_dir):
+        if not os.path.isdir(os.path.join(cache_dir, dataset)):
+            continue
+        for key_hash in os.listdir(os.path.join(cache_dir, dataset)):
+            entry_dir = os.path.join(cache_dir, dataset, key_hash)
+            if not os.path.isdir(entry_dir) or os.path.exists(os.path.join(entry_dir, '.lock')):
+                continue
+            entry_dirs.append(entry_dir)
+            for name in os.listdir(entry_dir):
+                if name.endswith('.grib'):
+                    try:
+                        stat = os.stat(os.path.join(entry_dir, name))
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry_dir, name[:-len('.grib')]))
+
+    entries.sort()
+    total = sum(entry[1] for entry in entries)
+    now = time.time()
+    removed = 0
+    for mtime, size, entry_dir, name in entries:
+        if now - mtime < max_age_s and total <= max_bytes:
+            break
+        # the sidecar first so that concurrent readers do not use the data file any more
+        for extension in ['.json', '.grib']:
+            try:
+                os.remove(os.path.join(entry_dir, name + extension))
+            except OSError:
+                pass
+        total -= size
+        removed += 1
+
+    # remove the directories of the keys that are empty now, rmdir fails if a job started to download into one
+    for entry_dir in entry_dirs:
+        try:
+            os.rmdir(entry_dir)
+        except OSError:
+            pass
+    return removed
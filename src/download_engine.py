@@ -0,0 +1,120 @@
+import http.client
+from multiprocessing.pool import ThreadPool
+import os
+import re
+import shutil
+import time
+import urllib.error
+import urllib.request
+
+# waiting time before the first retry, doubled for every further retry
+retry_backoff_s = 2.0
+chunk_size = 2**20
+
+def is_grib(filename):
+    # a complete grib file starts with the first message header and ends with the end marker of the last message
+    try:
+        with open(filename, 'rb') as f:
+            start = f.read(4)
+            f.seek(-4, os.SEEK_END)
+            end = f.read(4)
+    except OSError:
+        return False
+    return start == b'GRIB' and end == b'7777'
+
+def get_total_size(response, offset):
+    # the size of the full file, from the range of a partial response or the length of a full response
+    content_range = response.headers.get('Content-Range')
+    if content_range is not None:
+        match = re.match(r'bytes \d+-\d+/(\d+)', content_range)
+        if match is not None:
+            return int(match.group(1))
+    content_length = response.headers.get('Content-Length')
+    if content_length is not None:
+        return int(content_length) + offset
+    return None
+
+def download_url(url, filename, retries, timeout):
+    if is_grib(filename):
+        return None
+
+    # the data is downloaded to a part file first, an interrupted download continues where it stopped
+    part_filename = filename + '.part'
+    error = ''
+    for attempt in range(retries):
+        try:
+            offset = os.path.getsize(part_filename) if os.path.exists(part_filename) else 0
+            headers = {'Range': 'bytes={}-'.format(offset)} if offset > 0 else {}
+            with urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=timeout) as response:
+                if response.status != 206:
+                    # the server does not support ranges and sends the full file again
+                    offset = 0
+                total_size = get_total_size(response, offset)
+                with open(part_filename, 'ab' if offset > 0 else 'wb') as f:
+                    shutil.copyfileobj(response, f, chunk_size)
+
+            size = os.path.getsize(part_filename)
+            if total_size is not None and size != total_size:
+                error = 'incomplete download ({} of {} bytes)'.format(size, total_size)
+            elif not is_grib(part_filename):
+                error = 'the downloaded file is not a valid grib file'
+                os.remove(part_filename)
+            else:
+                os.replace(part_filename, filename)
+                return None
+
+        except urllib.error.HTTPError as e:
+            error = str(e)
+            if e.code == 416 and is_grib(part_filename):
+                # the part file was already complete
+                os.replace(part_filename, filename)
+                return None
+            elif e.code == 416:
+                os.remove(part_filename)
+            elif e.code == 404:
+                # the file does not exist (yet), retrying does not help
+                break
+        except (OSError, http.client.HTTPException) as e:
+            # e.g. a connection that was closed before the announced length was sent, the next attempt resumes
+            error = '{}: {}'.format(type(e).__name__, e)
+
+        if attempt + 1 < retries:
+            time.sleep(retry_backoff_s * 2**attempt)
+
+    return 'Failed to download {}: {}'.format(url, error)
+
+def retrieve_cds(dataset, request, filename, retries, url=None):
+    if is_grib(filename):
+        return None
+
+    import cdsapi
+
+    # the request is processed by the cds before the download, cdsapi resumes interrupted downloads itself, without
+    # an url the endpoint and the key are taken from the cdsapi configuration
+    part_filename = filename + '.part'
+    error = ''
+    for attempt in range(retries):
+        try:
+            client = cdsapi.Client(url=url, quiet=True)
+            client.retrieve(dataset, request, part_filename)
+            if is_grib(part_filename):
+                os.replace(part_filename, filename)
+                return None
+            error = 'the downloaded file is not a valid grib file'
+            os.remove(part_filename)
+        except Exception as e:
+            error = str(e)
+
+        if attempt + 1 < retries:
+            time.sleep(retry_backoff_s * 2**attempt)
+
+    return 'Failed to retrieve {} from {}: {}'.format(os.path.basename(filename), dataset, error)
+
+def run_downloads(tasks, workers):
+    # the downloads are mostly waiting for the network, a bounded thread pool limits the concurrent requests
+    if workers > 1:
+        with ThreadPool(workers) as pool:
+            errors = pool.map(lambda task: task(), tasks)
+    else:
+        errors = [task() for task in tasks]
+    return [error for error in errors if error is not None]
@@ -0,0 +1,97 @@
+from datetime import datetime
+import json
+from netCDF4 import Dataset
+import numpy as np
+import os
+import re
+
+# sidecar index that is stored in every catalogued folder
+catalog_filename = '.file_catalog.json'
+
+# wrfout_d01_2018-02-24_00:00:00 and met_em.d01.2018-02-24_00:00:00.nc
+filename_pattern = re.compile(r'^(.*?)[._](d\d\d)[._](\d{4}-\d\d-\d\d_\d\d:\d\d:\d\d)(\.nc)?$')
+time_format = '%Y-%m-%d_%H:%M:%S'
+
+def parse_filename(filename):
+    match = filename_pattern.match(filename)
+    if match is None:
+        return None
+    return {'prefix': match.group(1), 'domain': match.group(2), 'time': match.group(3)}
+
+def read_header(path):
+    # the header of a file that is still written can be incomplete, it is read again once the file changed
+    try:
+        with Dataset(path) as ncfile:
+            dims = {name: dim.size for name, dim in ncfile.dimensions.items()}
+            variables = list(ncfile.variables.keys())
+        return dims, variables
+    except (OSError, RuntimeError):
+        return None, None
+
+def load_catalog(folder):
+    try:
+        with open(os.path.join(folder, catalog_filename), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_catalog(folder, catalog):
+    # write to a temporary file first so that concurrent readers never see a partial catalog
+    path = os.path.join(folder, catalog_filename)
+    try:
+        with open(path + '.tmp', 'w') as f:
+            json.dump(catalog, f)
+        os.replace(path + '.tmp', path)
+    except OSError:
+        # the catalog is only a cache, a read only folder is simply scanned again the next time
+        pass
+
+def update_catalog(folder, catalog):
+    # only the entries of new or modified files are rebuilt, a single scandir provides the type, size and mtime
+    changed = False
+    found = set()
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if not entry.is_file() or entry.name == catalog_filename:
+                continue
+            info = parse_filename(entry.name)
+            if info is None:
+                continue
+
+            found.add(entry.name)
+            stat = entry.stat()
+            cached = catalog.get(entry.name)
+            if cached is not None and cached['size'] == stat.st_size and cached['mtime'] == stat.st_mtime and cached['dims'] is not None:
+                continue
+
+            info['size'] = stat.st_size
+            info['mtime'] = stat.st_mtime
+            info['dims'], info['variables'] = read_header(entry.path)
+            catalog[entry.name] = info
+            changed = True
+
+    for name in list(catalog.keys()):
+        if not name in found:
+            del catalog[name]
+            changed = True
+
+    return changed
+
+def get_catalog(folder):
+    catalog = load_catalog(folder)
+    if update_catalog(folder, catalog):
+        save_catalog(folder, catalog)
+    return catalog
+
+def query_files(folder, catalog, domain, searchstring):
+    # files of a domain sorted by their time
+    names = [name for name, info in catalog.items() if info['domain'] == domain and searchstring in info['prefix']]
+    names.sort(key=lambda name: catalog[name]['time'])
+    files = [os.path.join(folder, name) for name in names]
+    times = np.array([datetime.strptime(catalog[name]['time'], time_format) for name in names])
+    return files, times
+
+def select_times(times, t_start, t_end):
+    # slice of the sorted times within (t_start, t_end]
+    first, last = np.searchsorted(times, [t_start, t_end], side='right')
+    return slice(int(first), int(last))
@@ -0,0 +1,209 @@
+import argparse
+from datetime import datetime, timedelta
+from netCDF4 import Dataset
+import numpy as np
+import os
+
+# map projection of the generated domains, lambert conformal centered over the alps
+map_attributes = {
+    'MAP_PROJ': 1,
+    'MAP_PROJ_CHAR': 'Lambert Conformal',
+    'TRUELAT1': 46.0,
+    'TRUELAT2': 48.0,
+    'STAND_LON': 8.5,
+    'POLE_LAT': 90.0,
+    'POLE_LON': 0.0,
+}
+
+def get_lat_lon(nx, ny, dx, cen_lat, cen_lon):
+    # approximate regular grid around the center, good enough for the conversion and the projection metadata
+    y = (np.arange(ny) - 0.5 * (ny - 1)) * dx
+    x = (np.arange(nx) - 0.5 * (nx - 1)) * dx
+    lat = cen_lat + y[:, None] / 111177.0 * np.ones((1, nx))
+    lon = cen_lon + x[None, :] / (111177.0 * np.cos(np.deg2rad(lat)))
+    return lat.astype(np.float32), lon.astype(np.float32)
+
+def set_global_attributes(ncfile, args, title):
+    ncfile.TITLE = title
+    ncfile.DX = float(args.dx)
+    ncfile.DY = float(args.dx)
+    ncfile.CEN_LAT = args.lat
+    ncfile.CEN_LON = args.lon
+    ncfile.MOAD_CEN_LAT = args.lat
+    ncfile.GRID_ID = int(args.domain[1:])
+    for name, value in map_attributes.items():
+        setattr(ncfile, name, value)
+
+def create_variable(ncfile, name, dims, data, stagger, units, description, dtype=np.float32):
+    var = ncfile.createVariable(name, dtype, dims)
+    var.FieldType = 104
+    var.MemoryOrder = 'XYZ'[:len([dim for dim in dims if dim != 'Time'])]
+    var.description = description
+    var.units = units
+    var.stagger = stagger
+    var[:] = data
+    return var
+
+def create_coordinates(ncfile, args, lat, lon, lat_name, lon_name):
+    lat_u, lon_u = get_lat_lon(args.nx + 1, args.ny, args.dx, args.lat, args.lon)
+    lat_v, lon_v = get_lat_lon(args.nx, args.ny + 1, args.dx, args.lat, args.lon)
+    create_variable(ncfile, lat_name, ('Time', 'south_north', 'west_east'), lat[None], '', 'degree_north', 'LATITUDE, SOUTH IS NEGATIVE')
+    create_variable(ncfile, lon_name, ('Time', 'south_north', 'west_east'), lon[None], '', 'degree_east', 'LONGITUDE, WEST IS NEGATIVE')
+    create_variable(ncfile, 'XLAT_U', ('Time', 'south_north', 'west_east_stag'), lat_u[None], 'X', 'degree_north', 'LATITUDE, SOUTH IS NEGATIVE')
+    create_variable(ncfile, 'XLONG_U', ('Time', 'south_north', 'west_east_stag'), lon_u[None], 'X', 'degree_east', 'LONGITUDE, WEST IS NEGATIVE')
+    create_variable(ncfile, 'XLAT_V', ('Time', 'south_north_stag', 'west_east'), lat_v[None], 'Y', 'degree_north', 'LATITUDE, SOUTH IS NEGATIVE')
+    create_variable(ncfile, 'XLONG_V', ('Time', 'south_north_stag', 'west_east'), lon_v[None], 'Y', 'degree_east', 'LONGITUDE, WEST IS NEGATIVE')
+
+def create_times(ncfile, t):
+    ncfile.createDimension('DateStrLen', 19)
+    times = ncfile.createVariable('Times', 'S1', ('Time', 'DateStrLen'))
+    times[0] = np.array(list(t.strftime('%Y-%m-%d_%H:%M:%S')), dtype='S1')
+
+def get_terrain(args):
+    # smooth hills so that the height above ground and the column diagnostics vary over the domain
+    y = np.linspace(0.0, 2 * np.pi, args.ny)[:, None]
+    x = np.linspace(0.0, 2 * np.pi, args.nx)[None, :]
+    return (600.0 + 400.0 * np.sin(2 * x) * np.cos(3 * y)).astype(np.float32)
+
+def destagger_pad(data, axis):
+    # extend a mass grid field by one cell along the given axis to get a staggered field
+    return np.concatenate([data, np.take(data, [-1], axis=axis)], axis=axis)
+
+def write_wrfout(filename, args, t, step, rng, lat, lon, hgt):
+    nx, ny, nz = args.nx, args.ny, args.nz
+    m3 = ('Time', 'bottom_top', 'south_north', 'west_east')
+
+    # terrain following levels with an exponentially decreasing base state pressure
+    z_stag = hgt[None] + np.linspace(0.0, args.top, nz + 1)[:, None, None] * (1.0 - hgt[None] / (args.top * 1.5))
+    z_mass = 0.5 * (z_stag[1:] + z_stag[:-1])
+    pb = 101325.0 * np.exp(-z_mass / 8000.0)
+    theta = 285.0 + 0.004 * z_mass
+
+    # slowly evolving waves plus noise as perturbations
+    phase = 2 * np.pi * step / 120.0
+    wave = np.sin(np.linspace(0.0, 4 * np.pi, nx)[None, None, :] + phase) * np.cos(np.linspace(0.0, 2 * np.pi, ny)[None, :, None])
+
+    ncfile = Dataset(filename, mode='w', format='NETCDF4')
+    set_global_attributes(ncfile, args, ' OUTPUT FROM WRF V4.4 MODEL')
+    ncfile.SIMULATION_START_DATE = args.start.strftime('%Y-%m-%d_%H:%M:%S')
+    ncfile.createDimension('Time', None)
+    ncfile.createDimension('west_east', nx)
+    ncfile.createDimension('south_north', ny)
+    ncfile.createDimension('bottom_top', nz)
+    ncfile.createDimension('west_east_stag', nx + 1)
+    ncfile.createDimension('south_north_stag', ny + 1)
+    ncfile.createDimension('bottom_top_stag', nz + 1)
+    create_times(ncfile, t)
+    create_coordinates(ncfile, args, lat, lon, 'XLAT', 'XLONG')
+
+    create_variable(ncfile, 'HGT', ('Time', 'south_north', 'west_east'), hgt[None], '', 'm', 'Terrain Height')
+    create_variable(ncfile, 'U', ('Time', 'bottom_top', 'south_north', 'west_east_stag'),
+                    (5.0 + 0.002 * destagger_pad(z_mass, -1) + rng.normal(scale=0.5, size=(nz, ny, nx + 1)))[None], 'X', 'm s-1', 'x-wind component')
+    create_variable(ncfile, 'V', ('Time', 'bottom_top', 'south_north_stag', 'west_east'),
+                    (2.0 + 0.001 * destagger_pad(z_mass, -2) + rng.normal(scale=0.5, size=(nz, ny + 1, nx)))[None], 'Y', 'm s-1', 'y-wind component')
+    create_variable(ncfile, 'W', ('Time', 'bottom_top_stag', 'south_north', 'west_east'),
+                    (0.2 * wave + rng.normal(scale=0.05, size=(nz + 1, ny, nx)))[None], 'Z', 'm s-1', 'z-wind component')
+    create_variable(ncfile, 'PB', m3, pb[None], '', 'Pa', 'BASE STATE PRESSURE')
+    create_variable(ncfile, 'P', m3, (50.0 * wave + rng.normal(scale=5.0, size=(nz, ny, nx)))[None], '', 'Pa', 'perturbation pressure')
+    create_variable(ncfile, 'T', m3, (theta - 300.0 + 0.5 * wave + rng.normal(scale=0.1, size=(nz, ny, nx)))[None], '', 'K', 'perturbation potential temperature theta-t0')
+    create_variable(ncfile, 'PHB', ('Time', 'bottom_top_stag', 'south_north', 'west_east'), (9.81 * z_stag)[None], 'Z', 'm2 s-2', 'base-state geopotential')
+    create_variable(ncfile, 'PH', ('Time', 'bottom_top_stag', 'south_north', 'west_east'), rng.normal(scale=5.0, size=(1, nz + 1, ny, nx)), 'Z', 'm2 s-2', 'perturbation geopotential')
+
+    # moisture from a relative humidity between 30 and 90 percent so that the humidity diagnostics stay physical
+    tk = theta * (pb / 100000.0) ** 0.2857
+    es = 611.2 * np.exp(17.67 * (tk - 273.15) / (tk - 29.65))
+    qvapor = (0.6 + 0.3 * wave) * 0.622 * es / (pb - es)
+    create_variable(ncfile, 'QVAPOR', m3, qvapor[None], '', 'kg kg-1', 'Water vapor mixing ratio')
+    cloud = np.clip(wave, 0.0, None) * np.exp(-((z_mass - 3000.0) / 1500.0) ** 2)
+    for name, scale in [('QCLOUD', 1e-4), ('QRAIN', 5e-5), ('QICE', 2e-5), ('QSNOW', 2e-5), ('QGRAUP', 1e-5)]:
+        create_variable(ncfile, name, m3, (scale * cloud)[None], '', 'kg kg-1', name + ' mixing ratio')
+    create_variable(ncfile, 'CLDFRA', m3, np.clip(2.0 * cloud, 0.0, 1.0)[None], '', '', 'CLOUD FRACTION')
+    ncfile.close()
+
+def write_met_em(filename, args, t, rng, lat, lon, hgt):
+    nx, ny, nl = args.nx, args.ny, args.num_metgrid_levels
+    m3 = ('Time', 'num_metgrid_levels', 'south_north', 'west_east')
+    m2 = ('Time', 'south_north', 'west_east')
+
+    pres = np.concatenate([[101325.0], np.linspace(100000.0, 10000.0, nl - 1)])[:, None, None] * np.ones((nl, ny, nx))
+    ght = -8000.0 * np.log(pres / 101325.0)
+    ght[0] = hgt
+
+    ncfile = Dataset(filename, mode='w', format='NETCDF4')
+    set_global_attributes(ncfile, args, ' OUTPUT FROM METGRID V4.4')
+    ncfile.createDimension('Time', None)
+    ncfile.createDimension('west_east', nx)
+    ncfile.createDimension('south_north', ny)
+    ncfile.createDimension('num_metgrid_levels', nl)
+    ncfile.createDimension('west_east_stag', nx + 1)
+    ncfile.createDimension('south_north_stag', ny + 1)
+    ncfile.createDimension('z-dimension0012', 12)
+    ncfile.createDimension('z-dimension0016', 16)
+    ncfile.createDimension('z-dimension0021', 21)
+    create_times(ncfile, t)
+    create_coordinates(ncfile, args, lat, lon, 'XLAT_M', 'XLONG_M')
+
+    create_variable(ncfile, 'PRES', m3, pres[None], 'M', 'Pa', 'Pressure')
+    create_variable(ncfile, 'GHT', m3, ght[None], 'M', 'm', 'Height')
+    create_variable(ncfile, 'TT', m3, (288.0 - 0.0065 * ght + rng.normal(scale=0.5, size=(nl, ny, nx)))[None], 'M', 'K', 'Temperature')
+    create_variable(ncfile, 'RH', m3, rng.uniform(20.0, 95.0, (1, nl, ny, nx)), 'M', '%', 'Relative Humidity')
+    create_variable(ncfile, 'UU', ('Time', 'num_metgrid_levels', 'south_north', 'west_east_stag'), rng.normal(5.0, 2.0, (1, nl, ny, nx + 1)), 'U', 'm s-1', 'U')
+    create_variable(ncfile, 'VV', ('Time', 'num_metgrid_levels', 'south_north_stag', 'west_east'), rng.normal(2.0, 2.0, (1, nl, ny + 1, nx)), 'V', 'm s-1', 'V')
+
+    for name, units in [('PSFC', 'Pa'), ('PMSL', 'Pa'), ('SKINTEMP', 'K'), ('SST', 'K'), ('SNOW', 'kg m-2')]:
+        create_variable(ncfile, name, m2, rng.normal(1.0, 0.01, (1, ny, nx)) * (101325.0 if units == 'Pa' else 280.0 if units == 'K' else 1.0), 'M', units, name)
+    for layer in ['000007', '007028', '028100', '100289']:
+        create_variable(ncfile, 'SM' + layer, m2, rng.uniform(0.1, 0.4, (1, ny, nx)), 'M', 'm3 m-3', 'Soil moisture')
+        create_variable(ncfile, 'ST' + layer, m2, rng.uniform(270.0, 290.0, (1, ny, nx)), 'M', 'K', 'Soil temperature')
+
+    landmask = (hgt > 500.0).astype(np.float32)
+    for name in ['LANDMASK', 'LANDSEA', 'SEAICE']:
+        create_variable(ncfile, name, m2, (landmask if name != 'SEAICE' else 0.0 * landmask)[None], 'M', '0/1 Flag', name)
+    create_variable(ncfile, 'HGT_M', m2, hgt[None], 'M', 'meters MSL', 'Topography height')
+    create_variable(ncfile, 'SNOALB', m2, rng.uniform(40.0, 70.0, (1, ny, nx)), 'M', '%', 'Maximum snow albedo')
+    for name in ['LU_INDEX', 'SCB_DOM', 'SCT_DOM']:
+        create_variable(ncfile, name, m2, rng.integers(1, 16, (1, ny, nx)).astype(np.float32), 'M', 'category', name)
+    for name in ['LAI12M', 'GREENFRAC', 'ALBEDO12M']:
+        create_variable(ncfile, name, ('Time', 'z-dimension0012', 'south_north', 'west_east'), rng.uniform(0.0, 1.0, (1, 12, ny, nx)), 'M', '', name)
+    for name in ['SOILCTOP', 'SOILCBOT']:
+        create_variable(ncfile, name, ('Time', 'z-dimension0016', 'south_north', 'west_east'), rng.uniform(0.0, 1.0, (1, 16, ny, nx)), 'M', 'category', name)
+    create_variable(ncfile, 'LANDUSEF', ('Time', 'z-dimension0021', 'south_north', 'west_east'), rng.uniform(0.0, 1.0, (1, 21, ny, nx)), 'M', 'category', 'Landuse fraction')
+    ncfile.close()
+
+parser = argparse.ArgumentParser(description='Generate synthetic wrfout and met_em files to benchmark the conversion')
+parser.add_argument('-o', '--output_folder', type=str, required=True, help='Folder where the wrf and met_em subfolders are created')
+parser.add_argument('-d', '--domain', type=str, default='d01', help='Domain identifier of the generated files')
+parser.add_argument('--start', type=lambda s: datetime.strptime(s, '%Y-%m-%d_%H:%M:%S'), default=datetime(2018, 2, 24), help='Start time of the generated output, YYYY-MM-DD_hh:mm:ss')
+parser.add_argument('--hours', type=int, default=1, help='Number of simulated hours')
+parser.add_argument('--interval', type=int, default=60, help='History interval of the wrfout files in seconds')
+parser.add_argument('--nx', type=int, default=60, help='Number of mass grid cells in west-east direction')
+parser.add_argument('--ny', type=int, default=60, help='Number of mass grid cells in south-north direction')
+parser.add_argument('--nz', type=int, default=40, help='Number of vertical mass levels')
+parser.add_argument('--num_metgrid_levels', type=int, default=38, help='Number of vertical levels of the met_em files')
+parser.add_argument('--dx', type=float, default=1000.0, help='Grid spacing in m')
+parser.add_argument('--top', type=float, default=20000.0, help='Model top height in m')
+parser.add_argument('--lat', type=float, default=47.376, help='Latitude of the domain center in deg')
+parser.add_argument('--lon', type=float, default=8.541, help='Longitude of the domain center in deg')
+parser.add_argument('--seed', type=int, default=0, help='Seed of the random perturbations')
+args = parser.parse_args()
+
+wrf_folder = os.path.join(args.output_folder, 'wrf')
+met_em_folder = os.path.join(args.output_folder, 'met_em')
+os.makedirs(wrf_folder, exist_ok=True)
+os.makedirs(met_em_folder, exist_ok=True)
+
+rng = np.random.default_rng(args.seed)
+lat, lon = get_lat_lon(args.nx, args.ny, args.dx, args.lat, args.lon)
+hgt = get_terrain(args)
+
+num_steps = args.hours * 3600 // args.interval
+for step in range(num_steps + 1):
+    t = args.start + timedelta(seconds=step * args.interval)
+    write_wrfout(os.path.join(wrf_folder, 'wrfout_' + args.domain + '_' + t.strftime('%Y-%m-%d_%H:%M:%S')), args, t, step, rng, lat, lon, hgt)
+
+# the met_em files cover the simulated period hourly plus the following hour
+for hour in range(args.hours + 1):
+    t = args.start + timedelta(hours=hour)
+    write_met_em(os.path.join(met_em_folder, 'met_em.' + args.domain + '.' + t.strftime('%Y-%m-%d_%H:%M:%S') + '.nc'), args, t, rng, lat, lon, hgt)
+
+print('Generated', num_steps + 1, 'wrfout and', args.hours + 1, 'met_em files in', args.output_folder)
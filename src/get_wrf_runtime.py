@@ -1,39 +1,41 @@
 import argparse
-import numpy as np
-
-parser = argparse.ArgumentParser(description='Parse the logfile and compile the runtime')
-parser.add_argument('-f', '--file', required=True, help='Toplevel folder with all the cases')
+import json
+import sys
+from rsl_timing import analyze_run, get_rsl_files
+
+def print_summary(report):
+    print('=======================')
+    print('Parsed {0} rsl files'.format(len(report['files'])))
+    for domain, data in report['domains'].items():
+        print('Domain {0}: {1} steps, per step: {2:.3f}+-{3:.3f} s (max {4:.3f} s)'.format(
+            domain, data['steps'], data['step_mean_s'], data['step_std_s'], data['step_max_s']))
+        print('    compute {0:.3f} h, write {1:.3f} h, lateral boundary {2:.3f} h, other {3:.3f} h, I/O share {4:.1%}'.format(
+            data['compute_s'] / 3600, data['write_s'] / 3600, data['lbc_s'] / 3600, data['other_s'] / 3600, data['io_share']))
+        if len(data['per_hour']) > 1:
+            step_means = [hour['step_mean_s'] for hour in data['per_hour'] if hour['steps'] > 0]
+            if len(step_means) > 0:
+                print('    step cost per simulated hour: {0:.3f} s min, {1:.3f} s max'.format(min(step_means), max(step_means)))
+    print('============')
+    ranks = report['ranks']
+    if 'imbalance' in ranks.keys():
+        print('Ranks: {0}, compute per rank {1:.3f}-{2:.3f} h, imbalance {3:.1%} (slowest rank {4})'.format(
+            ranks['count'], ranks['compute_min_s'] / 3600, ranks['compute_max_s'] / 3600, ranks['imbalance'], ranks['slowest_rank']))
+    print('Total runtime: {0:.3f} h, I/O share {1:.1%}'.format(report['total']['runtime_h'], report['total']['io_share']))
+    print('=======================')
+
+parser = argparse.ArgumentParser(description='Parse the rsl logfiles of a wrf run and compile the runtime')
+parser.add_argument('-i', '-f', '--input', nargs='+', required=True, help='rsl files or folders containing them (e.g. the WRF or OUT folder of a run)')
+parser.add_argument('-j', '--json', type=str, help='Write the full report to this json file')
 args = parser.parse_args()
 
-file = open(args.file, 'rt')
-
-data = {}
-
-for line in file:
-    if 'Timing for main' in line:
-        data_string = line.split('domain')[-1]
-        domain = int(data_string.split(':')[0])
-        domain_key = str(domain)
-        time = float(data_string.split(':')[1].split('elapsed')[0])
-
-        if domain_key in data.keys():
-            data[domain_key].append(time)
-        else:
-            data[domain_key] = [time]
-
-for key in data.keys():
-    data[key] = np.array(data[key])
-
+files = get_rsl_files(args.input)
+if len(files) == 0:
+    print('No rsl files found in', ' '.join(args.input))
+    sys.exit(1)
 
-print('=======================')
-total_runtime = 0
-for key in data.keys():
-    runtime_h = data[key].sum() / 3600
-    steptime_s = data[key].mean()
-    stepstd_s = data[key].std()
-    total_runtime += runtime_h
-    print('Domain {0} total runtime: {1:2f} h (per step: {2:2f}+-{3:2f} s)'.format(key, runtime_h, steptime_s, stepstd_s))
-print('============')
-print('Total runtime: {0:2f} h'.format(total_runtime))
-print('=======================')
+report = analyze_run(files)
+print_summary(report)
 
+if args.json:
+    with open(args.json, 'w') as f:
+        json.dump(report, f, indent=2)
@@ -0,0 +1,257 @@
+import argparse
+import glob
+import numpy as np
+import os
+import re
+import sys
+import yaml
+from rsl_timing import analyze_run, get_rsl_files
+
+# wrf refuses to run if a patch is smaller than 10 cells in either direction
+min_patch_size = 10
+
+namelist_pattern = re.compile(r'^\s*(\w+)\s*=\s*(.*?)\s*$')
+
+def read_namelist(filename):
+    # the values of every entry as a list of strings, e.g. {'e_we': ['151', '175', '205']}
+    values = {}
+    with open(filename, 'rt') as f:
+        for line in f:
+            match = namelist_pattern.match(line)
+            if match is not None:
+                values[match.group(1)] = [value.strip() for value in match.group(2).split(',') if value.strip() != '']
+    return values
+
+def get_domains(namelist, num_domains):
+    # number of cells and time step of every domain, the nests run parent_time_step_ratio steps per parent step
+    time_step = float(namelist['time_step'][0])
+    if int(namelist.get('time_step_fract_num', ['0'])[0]) > 0:
+        time_step += float(namelist['time_step_fract_num'][0]) / float(namelist['time_step_fract_den'][0])
+
+    domains = []
+    for i in range(num_domains):
+        if i > 0:
+            time_step /= float(namelist['parent_time_step_ratio'][i])
+        domains.append({
+            'nx': int(namelist['e_we'][i]) - 1,
+            'ny': int(namelist['e_sn'][i]) - 1,
+            'nz': int(namelist['e_vert'][i]) - 1,
+            'time_step': time_step,
+        })
+    return domains
+
+def get_decompositions(cores, domains):
+    # all the decompositions of the cores into nproc_x * nproc_y for which every patch of every domain is large enough
+    decompositions = []
+    for nproc_x in range(1, cores + 1):
+        if cores % nproc_x != 0:
+            continue
+        nproc_y = cores // nproc_x
+        if all(domain['nx'] // nproc_x >= min_patch_size and domain['ny'] // nproc_y >= min_patch_size for domain in domains):
+            decompositions.append((nproc_x, nproc_y))
+    return decompositions
+
+def get_default_decomposition(cores):
+    # wrf chooses the factors closest to a square with nproc_x <= nproc_y if the decomposition is not set
+    nproc_x = max(n for n in range(1, int(np.sqrt(cores)) + 1) if cores % n == 0)
+    return nproc_x, cores // nproc_x
+
+def get_features(domain, nproc_x, nproc_y):
+    # the cost of a step is modelled as the computation of the cells of a patch, the halo exchange along the
+    # patch boundary and a constant latency, e.g. for the communication and the nest feedback
+    cells = domain['nx'] * domain['ny'] * domain['nz'] / (nproc_x * nproc_y)
+    halo = domain['nz'] * (domain['nx'] / nproc_x + domain['ny'] / nproc_y)
+    return [cells, halo, 1.0]
+
+def get_history(paths, mode):
+    # previous runs of the same mode, a path is either a run directory or a directory containing the cases
+    run_directories = []
+    for path in paths:
+        if os.path.isfile(os.path.join(path, 'WRF', 'namelist.input')):
+            run_directories.append(path)
+        else:
+            run_directories += sorted(glob.glob(os.path.join(path, '*', mode)))
+
+    runs = []
+    for run_directory in run_directories:
+        files = get_rsl_files([os.path.join(run_directory, 'OUT')])
+        namelist_file = os.path.join(run_directory, 'WRF', 'namelist.input')
+        if len(files) == 0 or not os.path.isfile(namelist_file):
+            continue
+
+        namelist = read_namelist(namelist_file)
+        report = analyze_run(files)
+        cores = len(files)
+        nproc_x, nproc_y = int(namelist.get('nproc_x', ['-1'])[0]), int(namelist.get('nproc_y', ['-1'])[0])
+        if nproc_x * nproc_y != cores:
+            nproc_x, nproc_y = get_default_decomposition(cores)
+
+        domains = get_domains(namelist, int(namelist['max_dom'][0]))
+        run_hours = float(namelist['run_hours'][0])
+        steps = []
+        for key, data in report['domains'].items():
+            if int(key) <= len(domains) and data['steps'] > 0:
+                steps.append((get_features(domains[int(key) - 1], nproc_x, nproc_y), data['step_mean_s']))
+        if len(steps) == 0:
+            continue
+
+        io_s = sum(data['write_s'] + data['lbc_s'] + data['other_s'] for data in report['domains'].values())
+        cells = sum(domain['nx'] * domain['ny'] * domain['nz'] for domain in domains)
+        runs.append({'directory': run_directory, 'cores': cores, 'steps': steps, 'io_s_per_cell_hour': io_s / cells / max(run_hours, 1.0)})
+    return runs
+
+def fit_model(runs):
+    features = np.array([feature for run in runs for feature, _ in run['steps']])
+    times = np.array([time for run in runs for _, time in run['steps']])
+
+    # the halo and latency terms can only be separated from the computation if the runs used different core counts
+    if len(set(run['cores'] for run in runs)) < 2 or len(times) < 3:
+        print('WARNING: all previous runs used the same number of cores, the scaling assumes no communication costs', file=sys.stderr)
+        coefficients = np.array([np.sum(features[:, 0] * times) / np.sum(features[:, 0]**2), 0.0, 0.0])
+    else:
+        coefficients = np.linalg.lstsq(features, times, rcond=None)[0]
+        coefficients = np.maximum(coefficients, 0.0)
+    return coefficients
+
+def predict_walltime(domains, nproc_x, nproc_y, coefficients, io_s_per_cell_hour, hours):
+    step_cost = sum(3600.0 / domain['time_step'] * np.dot(coefficients, get_features(domain, nproc_x, nproc_y)) for domain in domains)
+    io_cost = io_s_per_cell_hour * sum(domain['nx'] * domain['ny'] * domain['nz'] for domain in domains)
+    return hours * (step_cost + io_cost)
+
+def get_best_decomposition(cores, domains):
+    # with the same number of cores the decomposition with the shortest patch boundary exchanges the least halo data
+    decompositions = get_decompositions(cores, domains)
+    if len(decompositions) == 0:
+        return None
+    return min(decompositions, key=lambda decomposition: sum(get_features(domain, *decomposition)[1] for domain in domains))
+
+def inject_decomposition(filename, nproc_x, nproc_y):
+    # replace or add nproc_x and nproc_y in the domains section of a generated namelist
+    with open(filename, 'rt') as f:
+        lines = [line for line in f if not namelist_pattern.match(line) or namelist_pattern.match(line).group(1) not in ['nproc_x', 'nproc_y']]
+
+    out_lines = []
+    for line in lines:
+        out_lines.append(line)
+        if line.strip().lower() == '&domains':
+            out_lines.append(' nproc_x                             = {},\n'.format(nproc_x))
+            out_lines.append(' nproc_y                             = {},\n'.format(nproc_y))
+
+    with open(filename, 'wt') as f:
+        f.writelines(out_lines)
+
+parser = argparse.ArgumentParser(description='Recommend the number of cores, the MPI decomposition and the walltime of a wrf run')
+parser.add_argument('-i', '--namelist', type=str, help='Namelist with the domains, the default namelist of the mode if not set')
+parser.add_argument('-y', '--yaml-config', type=str, help='YAML config file, provides the number of domains for the default namelists')
+parser.add_argument('-c', '--configs', type=str, default='default_files', help='Path to the configuration files folder')
+parser.add_argument('-l', '--les', action='store_true', help='Advise for the LES instead of the MESO mode')
+parser.add_argument('-t', '--dt', type=float, help='Simulation interval in hours, run_hours of the namelist if not set')
+parser.add_argument('--history', type=str, nargs='+', default=[], help='Previous run directories or the output directories containing the cases')
+parser.add_argument('-n', '--cores', type=int, help='Only choose the decomposition for this number of cores')
+parser.add_argument('--max-cores', type=int, default=512, help='Maximum number of cores that are considered')
+parser.add_argument('--max-walltime', type=float, default=120.0, help='Maximum walltime of a job in hours')
+parser.add_argument('--min-efficiency', type=float, default=0.7, help='Minimum parallel efficiency relative to the smallest considered core count')
+parser.add_argument('--max-scaling', type=float, default=4.0, help='Maximum factor between the recommended cores and the core counts of the previous runs')
+parser.add_argument('--safety', type=float, default=1.25, help='Factor applied to the predicted walltime')
+parser.add_argument('--inject', type=str, help='Write nproc_x and nproc_y into this namelist')
+parser.add_argument('--shell', action='store_true', help='Only print the recommendation as shell variables')
+args = parser.parse_args()
+
+mode = 'LES' if args.les else 'MESO'
+
+namelist_file = args.namelist
+if namelist_file is None:
+    namelist_file = os.path.join(args.configs, 'namelist_les.input' if args.les else 'namelist_meso.input')
+namelist = read_namelist(namelist_file)
+
+# the default namelists contain placeholders for the number of domains and the run time
+if namelist['max_dom'][0].isdigit():
+    num_domains = int(namelist['max_dom'][0])
+elif args.yaml_config:
+    with open(args.yaml_config, 'rt') as fh:
+        config = yaml.safe_load(fh)
+    num_domains = config[mode]['num_domains']
+else:
+    print('The number of domains is not set in', namelist_file, 'the yaml config (-y) is required')
+    sys.exit(1)
+domains = get_domains(namelist, num_domains)
+
+if args.cores:
+    # the number of cores is given, e.g. by the job allocation, only the decomposition is chosen
+    decomposition = get_best_decomposition(args.cores, domains)
+    if decomposition is None:
+        print('No valid decomposition of', args.cores, 'cores, the patches would be smaller than', min_patch_size, 'cells')
+        sys.exit(1)
+    if args.inject:
+        inject_decomposition(args.inject, *decomposition)
+    if args.shell:
+        print('n_cores={} nproc_x={} nproc_y={}'.format(args.cores, *decomposition))
+    else:
+        print('Decomposition for {} cores: nproc_x = {}, nproc_y = {}'.format(args.cores, *decomposition))
+    sys.exit(0)
+
+if args.dt is not None:
+    hours = args.dt
+elif namelist['run_hours'][0].isdigit():
+    hours = float(namelist['run_hours'][0])
+else:
+    print('The run time is not set in', namelist_file, 'the simulation interval (-t) is required')
+    sys.exit(1)
+
+runs = get_history(args.history, mode)
+if len(runs) == 0:
+    print('No previous', mode, 'runs with rsl logs found in', ' '.join(args.history))
+    sys.exit(1)
+
+coefficients = fit_model(runs)
+io_s_per_cell_hour = np.mean([run['io_s_per_cell_hour'] for run in runs])
+
+# the fitted model is not trusted far beyond the core counts it was fitted to
+min_cores = max(1, int(min(run['cores'] for run in runs) / args.max_scaling))
+max_cores = min(args.max_cores, int(args.max_scaling * max(run['cores'] for run in runs)))
+
+candidates = []
+for cores in range(min_cores, max_cores + 1):
+    decomposition = get_best_decomposition(cores, domains)
+    if decomposition is None:
+        continue
+    walltime_h = predict_walltime(domains, *decomposition, coefficients, io_s_per_cell_hour, hours) / 3600
+    candidates.append({'cores': cores, 'nproc_x': decomposition[0], 'nproc_y': decomposition[1],
+                       'walltime_h': walltime_h, 'core_hours': cores * walltime_h})
+
+if len(candidates) == 0:
+    print('No valid decomposition between', min_cores, 'and', max_cores, 'cores')
+    sys.exit(1)
+
+# the parallel efficiency relative to the smallest considered core count, the core hours never decrease with more cores
+min_core_hours = min(candidate['core_hours'] for candidate in candidates)
+for candidate in candidates:
+    candidate['efficiency'] = min_core_hours / candidate['core_hours']
+
+# the fastest core count that finishes within the walltime and keeps the efficiency, if more cores are needed to
+# finish in time the most efficient one that does
+feasible = [candidate for candidate in candidates if candidate['walltime_h'] * args.safety <= args.max_walltime]
+efficient = [candidate for candidate in feasible if candidate['efficiency'] >= args.min_efficiency]
+if len(efficient) > 0:
+    best = min(efficient, key=lambda candidate: candidate['walltime_h'])
+elif len(feasible) > 0:
+    best = max(feasible, key=lambda candidate: candidate['efficiency'])
+else:
+    print('WARNING: no core count finishes within', args.max_walltime, 'h, using the fastest one', file=sys.stderr)
+    best = min(candidates, key=lambda candidate: candidate['walltime_h'])
+runtime = int(np.ceil(best['walltime_h'] * args.safety))
+
+if args.inject:
+    inject_decomposition(args.inject, best['nproc_x'], best['nproc_y'])
+
+if args.shell:
+    print('n_cores={} nproc_x={} nproc_y={} runtime={}'.format(best['cores'], best['nproc_x'], best['nproc_y'], runtime))
+    sys.exit(0)
+
+print('Fitted step cost from {} previous runs: {:.3e} s per cell, {:.3e} s per halo cell, {:.3e} s latency'.format(len(runs), *coefficients))
+print('{:>8}{:>10}{:>10}{:>14}{:>14}{:>12}'.format('cores', 'nproc_x', 'nproc_y', 'walltime h', 'core hours', 'efficiency'))
+for candidate in candidates:
+    if candidate['cores'] == best['cores'] or candidate['cores'] & (candidate['cores'] - 1) == 0 or candidate['cores'] % 16 == 0:
+        print('{:>8}{:>10}{:>10}{:>14.2f}{:>14.1f}{:>12.2f}'.format(
+            candidate['cores'], candidate['nproc_x'], candidate['nproc_y'], candidate['walltime_h'], candidate['core_hours'], candidate['efficiency']))
+print('Recommended: {} cores (nproc_x = {}, nproc_y = {}), walltime {} h'.format(best['cores'], best['nproc_x'], best['nproc_y'], runtime))
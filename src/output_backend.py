@@ -0,0 +1,189 @@
+from netCDF4 import Dataset, default_fillvals
+import numpy as np
+import sys
+
+# output backends, the zarr backend writes one object per chunk into a directory store
+backends = ['netcdf', 'zarr']
+backend_extensions = {'netcdf': '.nc', 'zarr': '.zarr'}
+
+def open_output(filename, mode, backend):
+    if backend == 'netcdf':
+        if mode == 'w':
+            return Dataset(filename, mode='w', format='NETCDF4')
+        return Dataset(filename, mode=mode)
+    elif backend == 'zarr':
+        return ZarrOutput(filename, mode)
+    else:
+        print('Unknown output backend:', backend)
+        sys.exit(1)
+
+def get_fill_value(dtype):
+    # same fill values as netcdf so that unwritten entries are masked the same way for both backends
+    dtype = np.dtype(dtype)
+    if dtype.kind in 'OSU':
+        return None
+    return default_fillvals[dtype.str[1:]]
+
+class ZarrDimension:
+    def __init__(self, group, name, size):
+        self._group = group
+        self.name = name
+        self._size = size
+
+    def isunlimited(self):
+        return self._size is None
+
+    @property
+    def size(self):
+        if self._size is not None:
+            return self._size
+        # the size of an unlimited dimension is given by the variables that were written along it
+        sizes = [var.shape[var.dimensions.index(self.name)] for var in self._group.variables.values() if self.name in var.dimensions]
+        return max(sizes, default=0)
+
+    def __len__(self):
+        return self.size
+
+class ZarrVariable:
+    # subset of the netCDF4.Variable interface that is used by the conversion
+    def __init__(self, array):
+        object.__setattr__(self, '_array', array)
+        object.__setattr__(self, 'dimensions', tuple(array.attrs['_ARRAY_DIMENSIONS']))
+
+    def __setattr__(self, name, value):
+        # all public attributes are stored as attributes of the array like netcdf attributes
+        if isinstance(value, np.generic):
+            value = value.item()
+        self._array.attrs[name] = value
+
+    def __getattr__(self, name):
+        try:
+            return self._array.attrs[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    @property
+    def shape(self):
+        return self._array.shape
+
+    @property
+    def dtype(self):
+        return self._array.dtype
+
+    def chunking(self):
+        return list(self._array.chunks)
+
+    def get_var_chunk_cache(self):
+        return 0, 0, 0.0
+
+    def set_var_chunk_cache(self, size=None, nelems=None, preemption=None):
+        # every chunk is a separate object, there is no chunk cache to tune
+        pass
+
+    def __getitem__(self, key):
+        data = self._array[key]
+        fill_value = self._array.fill_value
+        if fill_value is None or self._array.dtype.kind in 'OSU':
+            return data
+        return np.ma.masked_equal(data, fill_value)
+
+    def __setitem__(self, key, value):
+        # grow the unlimited dimension when writing past its end like netcdf
+        index = key[0] if isinstance(key, tuple) else key
+        if self.dimensions[0] == 'time' and isinstance(index, (int, np.integer)) and index >= self._array.shape[0]:
+            self._array.resize((index + 1,) + self._array.shape[1:])
+
+        if self._array.dtype.kind == 'O':
+            value = np.asarray(value).astype(str).astype(object)
+        else:
+            value = np.ma.filled(value, self._array.fill_value)
+        self._array[key] = value
+
+class ZarrGroup:
+    # subset of the netCDF4.Group interface that is used by the conversion
+    def __init__(self, group):
+        self._group = group
+        self.groups = {name: ZarrGroup(subgroup) for name, subgroup in group.groups()}
+        self.variables = {name: ZarrVariable(array) for name, array in group.arrays()}
+        self.dimensions = {}
+        for name, size in group.attrs.get('_dimensions', {}).items():
+            self.dimensions[name] = ZarrDimension(self, name, size)
+
+    def __getitem__(self, path):
+        item = self
+        for name in path.split('/'):
+            item = item.groups[name] if name in item.groups.keys() else item.variables[name]
+        return item
+
+    def createGroup(self, name):
+        self.groups[name] = ZarrGroup(self._group.create_group(name))
+        return self.groups[name]
+
+    def createDimension(self, name, size):
+        self.dimensions[name] = ZarrDimension(self, name, size)
+        self._group.attrs['_dimensions'] = {dim.name: dim._size for dim in self.dimensions.values()}
+        return self.dimensions[name]
+
+    def createVariable(self, name, datatype, dimensions, chunksizes=None, compression=None, complevel=4, shuffle=False):
+        import numcodecs
+
+        if datatype is str:
+            dtype = np.dtype(object)
+            object_codec = numcodecs.VLenUTF8()
+        else:
+            dtype = np.dtype(datatype)
+            object_codec = None
+
+        dimensions = tuple([dimensions]) if isinstance(dimensions, str) else tuple(dimensions)
+        shape = tuple(0 if self.dimensions[dim].isunlimited() else self.dimensions[dim].size for dim in dimensions)
+        if chunksizes is None:
+            chunksizes = tuple(1 if self.dimensions[dim].isunlimited() else max(1, self.dimensions[dim].size) for dim in dimensions)
+
+        compressor = None
+        filters = None
+        if compression == 'zlib':
+            compressor = numcodecs.Zlib(level=complevel)
+            if shuffle:
+                filters = [numcodecs.Shuffle(elementsize=dtype.itemsize)]
+
+        array = self._group.create_dataset(
+            name,
+            shape=shape,
+            chunks=chunksizes,
+            dtype=dtype,
+            compressor=compressor,
+            filters=filters,
+            object_codec=object_codec,
+            fill_value=get_fill_value(dtype))
+        # the dimension names are stored the same way as xarray does so that the store can be opened lazily by xarray
+        array.attrs['_ARRAY_DIMENSIONS'] = list(dimensions)
+
+        self.variables[name] = ZarrVariable(array)
+        return self.variables[name]
+
+    def resize_dimension(self, name, size):
+        # grow an unlimited dimension in advance so that multiple processes can write disjoint entries
+        for var in self.variables.values():
+            if name in var.dimensions and var.shape[var.dimensions.index(name)] < size:
+                var._array.resize(tuple(size if dim == name else length for dim, length in zip(var.dimensions, var.shape)))
+
+class ZarrOutput(ZarrGroup):
+    def __init__(self, filename, mode):
+        try:
+            import zarr
+        except ImportError:
+            print('The zarr output backend requires the zarr package')
+            sys.exit(1)
+
+        self.filename = filename
+        self._store = zarr.DirectoryStore(filename)
+        super().__init__(zarr.open_group(self._store, mode='w' if mode == 'w' else 'a'))
+
+    def sync(self):
+        # every chunk is written to its own file immediately
+        pass
+
+    def close(self):
+        # consolidate the metadata of all groups into one object so that readers only need a single request
+        import zarr
+        zarr.consolidate_metadata(self._store)
@@ -0,0 +1,91 @@
+import numpy as np
+
+# access patterns the chunks of the output variables are optimized for
+#   frame:      full fields of single time entries, e.g. loading whole samples for training
+#   column:     vertical profiles of single time entries
+#   timeseries: time series at single grid points
+access_patterns = ['frame', 'column', 'timeseries']
+
+# chunks of about 1 MiB keep the chunk index small and are still fast to decompress
+target_chunk_bytes = 2**20
+
+horizontal_dims = ['lat', 'lon']
+
+# order in which the dimension groups are grown to fill a chunk, all other dimensions are kept at one entry
+pattern_priority = {
+    'frame': ['horizontal', 'levels'],
+    'column': ['levels', 'horizontal'],
+    'timeseries': ['time', 'horizontal', 'levels'],
+}
+
+def get_dim_sizes(group, dims, time_size):
+    # the time dimension is unlimited, size the chunks for the expected number of entries instead
+    sizes = {}
+    for dim in dims:
+        if group.dimensions[dim].isunlimited():
+            sizes[dim] = time_size
+        else:
+            sizes[dim] = group.dimensions[dim].size
+    return sizes
+
+def get_dim_groups(dims):
+    groups = {'time': [], 'horizontal': [], 'levels': []}
+    for dim in dims:
+        if dim == 'time':
+            groups['time'].append(dim)
+        elif dim in horizontal_dims:
+            groups['horizontal'].append(dim)
+        else:
+            groups['levels'].append(dim)
+    return groups
+
+def grow_dims(chunks, sizes, dims, max_elements):
+    # grow the dimensions as evenly as possible, i.e. square horizontal tiles, until the chunk is full
+    other = int(np.prod([chunks[dim] for dim in chunks.keys() if not dim in dims]))
+    budget = max(1, max_elements // other)
+    open_dims = sorted(dims, key=lambda dim: sizes[dim])
+    while len(open_dims) > 0:
+        # the smallest dimensions are saturated first so that the remaining budget goes to the larger ones
+        edge = max(1, int(budget ** (1.0 / len(open_dims))))
+        dim = open_dims.pop(0)
+        chunks[dim] = min(sizes[dim], edge)
+        budget = max(1, budget // chunks[dim])
+    return all(chunks[dim] == sizes[dim] for dim in dims)
+
+def plan_layout(dims, sizes, dtype, pattern, compression, complevel, target_bytes=target_chunk_bytes):
+    if not pattern in pattern_priority.keys():
+        print('Unknown access pattern:', pattern)
+        exit(1)
+
+    max_elements = max(1, target_bytes // np.dtype(dtype).itemsize)
+    dim_groups = get_dim_groups(dims)
+
+    chunks = {dim: 1 for dim in dims}
+    for group in pattern_priority[pattern]:
+        if len(dim_groups[group]) == 0:
+            continue
+        if not grow_dims(chunks, sizes, dim_groups[group], max_elements):
+            break
+
+    # shuffling the bytes only helps the compression of multi-byte types
+    return {
+        'chunksizes': tuple(chunks[dim] for dim in dims),
+        'compression': compression,
+        'complevel': complevel,
+        'shuffle': compression is not None and np.dtype(dtype).itemsize > 1,
+    }
+
+def set_chunk_cache(var):
+    # keep all the chunks touched by writing one time entry in the cache, otherwise chunks spanning
+    # multiple time entries are decompressed and compressed again for every entry
+    chunking = var.chunking()
+    if chunking == 'contiguous' or not 'time' in var.dimensions:
+        return
+
+    num_chunks = 1
+    for dim, size, chunk in zip(var.dimensions, var.shape, chunking):
+        if dim != 'time':
+            num_chunks *= int(np.ceil(size / chunk))
+    chunk_bytes = int(np.prod(chunking)) * var.dtype.itemsize
+    size, nelems, preemption = var.get_var_chunk_cache()
+    var.set_var_chunk_cache(size=max(size, num_chunks * chunk_bytes), nelems=max(nelems, 2 * num_chunks + 1))
@@ -0,0 +1,115 @@
+import glob
+import hashlib
+import json
+from multiprocessing.pool import ThreadPool
+import os
+import queue
+import time
+
+# a stage is a dict with
+#   name:    unique name of the stage
+#   run:     function without arguments that returns None on success or an error message
+#   key:     string with everything besides the inputs the result depends on, e.g. the command line
+#   deps:    names of the stages that have to finish before
+#   inputs:  files or glob patterns read by the stage
+#   outputs: files or glob patterns written by the stage, each pattern has to match at least one file
+
+def expand(patterns):
+    files = []
+    for pattern in patterns:
+        files += sorted(glob.glob(pattern))
+    return files
+
+def get_signature(stage):
+    # the stage is up to date if neither its key nor any of its inputs changed since it last succeeded
+    inputs = []
+    for filename in expand(stage.get('inputs', [])):
+        stat = os.stat(filename)
+        inputs.append([filename, stat.st_size, stat.st_mtime_ns])
+    return hashlib.sha1(json.dumps([stage.get('key', ''), inputs]).encode()).hexdigest()
+
+def has_outputs(stage):
+    return all(len(glob.glob(pattern)) > 0 for pattern in stage.get('outputs', []))
+
+def load_state(state_file):
+    if not os.path.exists(state_file):
+        return {}
+    with open(state_file, 'r') as f:
+        return json.load(f)
+
+def save_state(state_file, state):
+    with open(state_file + '.tmp', 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(state_file + '.tmp', state_file)
+
+def run_stage(stage):
+    t_start = time.perf_counter()
+    try:
+        error = stage['run']()
+    except Exception as e:
+        error = '{}: {}'.format(type(e).__name__, e)
+    return stage['name'], error, time.perf_counter() - t_start
+
+def run_pipeline(stages, state_file, workers=1, verbose=False):
+    # runs every stage as soon as its dependencies succeeded, independent stages run concurrently, stages that are up
+    # to date are skipped and a failed stage blocks only the stages depending on it, so that the next run resumes
+    # at the failed stage
+    stages = {stage['name']: stage for stage in stages}
+    for stage in stages.values():
+        for dep in stage.get('deps', []):
+            if dep not in stages.keys():
+                raise ValueError('Unknown dependency {} of the stage {}'.format(dep, stage['name']))
+
+    state = load_state(state_file)
+    status = {}
+    signatures = {}
+    finished = queue.Queue()
+    with ThreadPool(max(workers, 1)) as pool:
+        while len(status) < len(stages):
+            # schedule until no further stage becomes ready, skipped stages make their dependents ready at once
+            scheduled = True
+            while scheduled:
+                scheduled = False
+                for name, stage in stages.items():
+                    if name in status.keys():
+                        continue
+                    deps = [status.get(dep) for dep in stage.get('deps', [])]
+                    if any(dep in ['failed', 'blocked'] for dep in deps):
+                        status[name] = 'blocked'
+                        scheduled = True
+                        print('Skipping {}, a dependency failed'.format(name))
+                    elif all(dep in ['done', 'skipped'] for dep in deps):
+                        scheduled = True
+                        signatures[name] = get_signature(stage)
+                        if state.get(name) == signatures[name] and has_outputs(stage):
+                            status[name] = 'skipped'
+                            if verbose:
+                                print('{} is up to date'.format(name))
+                        else:
+                            status[name] = 'running'
+                            if verbose:
+                                print('Starting', name)
+                            # the state of a stage that runs again is only valid after it succeeded again
+                            state.pop(name, None)
+                            pool.apply_async(run_stage, (stage,), callback=finished.put)
+
+            if 'running' not in status.values():
+                if len(status) < len(stages):
+                    raise ValueError('Cyclic dependencies between the stages ' + ', '.join(set(stages.keys()) - set(status.keys())))
+                break
+
+            name, error, t_wall = finished.get()
+            if error is None and not has_outputs(stages[name]):
+                error = 'missing outputs ' + ', '.join(pattern for pattern in stages[name].get('outputs', []) if len(glob.glob(pattern)) == 0)
+            if error is None:
+                status[name] = 'done'
+                state[name] = signatures[name]
+                if verbose:
+                    print('Finished {} in {:.1f} s'.format(name, t_wall))
+            else:
+                status[name] = 'failed'
+                print('ERROR: {} failed: {}'.format(name, error))
+            save_state(state_file, state)
+
+    save_state(state_file, state)
+    return status
@@ -0,0 +1,171 @@
+import argparse
+import hashlib
+from multiprocessing import Pool
+import numpy as np
+import os
+import rasterio
+from rasterio.windows import Window
+import sys
+import time
+from data_cache import acquire_lock, lock_poll_s, release_lock
+from projection import get_projection, get_extent_limits
+
+# signed big endian integers of the wps binary format by word size
+word_types = {1: '>i1', 2: '>i2', 4: '>i4'}
+
+def get_dtm_info(geotiff):
+    with rasterio.open(geotiff) as src:
+        if src.crs is None or not src.crs.is_geographic:
+            print('The geotiff needs to be on a regular latitude longitude grid:', geotiff)
+            sys.exit(1)
+        transform = src.transform
+        width, height = src.width, src.height
+    stat = os.stat(geotiff)
+    # a replaced dtm file gets a new identity and therefore new tiles
+    identity = '{}:{}:{}'.format(os.path.realpath(geotiff), stat.st_size, int(stat.st_mtime))
+    return {
+        'name': os.path.splitext(os.path.basename(geotiff))[0] + '_' + hashlib.sha1(identity.encode()).hexdigest()[:12],
+        'lon0': transform.c,
+        'lat0': transform.f,
+        'dx': transform.a,
+        'dy': -transform.e,
+        'width': width,
+        'height': height,
+    }
+
+def get_tile_range(dtm, limits, tile_size):
+    # the tiles are aligned to the pixels of the dtm so that the same tile is used by all cases that contain it
+    col_min = max(int(np.floor((limits['lon_min'] - dtm['lon0']) / dtm['dx'])), 0)
+    col_max = min(int(np.ceil((limits['lon_max'] - dtm['lon0']) / dtm['dx'])), dtm['width'])
+    row_min = max(int(np.floor((dtm['lat0'] - limits['lat_max']) / dtm['dy'])), 0)
+    row_max = min(int(np.ceil((dtm['lat0'] - limits['lat_min']) / dtm['dy'])), dtm['height'])
+    if col_min >= col_max or row_min >= row_max:
+        return None
+    return col_min // tile_size, (col_max - 1) // tile_size, row_min // tile_size, (row_max - 1) // tile_size
+
+def write_tile(geotiff, col, row, tile_size, border, scale, missing, wordsize, filename):
+    # windowed read of the tile and its halo, only the blocks of the geotiff within the window are decompressed and
+    # outside of the dtm the halo is filled with the missing value
+    size = tile_size + 2 * border
+    with rasterio.open(geotiff) as src:
+        data = src.read(1, window=Window(col * tile_size - border, row * tile_size - border, size, size),
+                        boundless=True, masked=True, out_dtype='float64')
+        data = data * src.scales[0] + src.offsets[0]
+
+    # the wps tiles are ordered from south to north and store the values divided by the scale factor
+    info = np.iinfo(word_types[wordsize])
+    values = np.clip(np.round(np.ma.filled(data, missing)[::-1] / scale), info.min, info.max)
+    with open(filename + '.tmp', 'wb') as f:
+        f.write(values.astype(word_types[wordsize]).tobytes())
+    os.replace(filename + '.tmp', filename)
+
+def get_cached_tile(cache_dir, geotiff, col, row, tile_size, border, scale, missing, wordsize):
+    # the data file is renamed into place when complete, an entry with a data file is complete
+    entry_dir = os.path.join(cache_dir, '{}_{}'.format(col, row))
+    data_file = os.path.join(entry_dir, 'data')
+    os.makedirs(entry_dir, exist_ok=True)
+    lock_file = os.path.join(entry_dir, '.lock')
+    while not os.path.exists(data_file):
+        token = acquire_lock(lock_file)
+        if token is None:
+            # another case converts this tile
+            time.sleep(lock_poll_s)
+            continue
+        try:
+            if not os.path.exists(data_file):
+                write_tile(geotiff, col, row, tile_size, border, scale, missing, wordsize, data_file)
+        except (OSError, rasterio.errors.RasterioError) as e:
+            return 'Failed to convert tile {}_{}: {}'.format(col, row, e)
+        finally:
+            release_lock(lock_file, token)
+    return None
+
+def write_index(filename, dtm, tile_range, tile_size, border, scale, missing, wordsize, units, description):
+    col_start, _, _, row_end = tile_range
+    index = {}
+    index['type'] = 'continuous'
+    index['signed'] = 'yes'
+    index['units'] = '"{}"'.format(units)
+    index['description'] = '"{}"'.format(description)
+    index['wordsize'] = str(wordsize)
+    index['scale_factor'] = repr(scale)
+    index['missing_value'] = repr(missing)
+    index['endian'] = 'big'
+    # the first point is the south west corner of the assembled tiles, the rows are ordered from south to north
+    index['projection'] = 'regular_ll'
+    index['dx'] = '{:.15f}'.format(dtm['dx'])
+    index['dy'] = '{:.15f}'.format(dtm['dy'])
+    index['known_x'] = '1.0'
+    index['known_y'] = '1.0'
+    index['known_lat'] = '{:.12f}'.format(dtm['lat0'] - dtm['dy'] * ((row_end + 1) * tile_size - 0.5))
+    index['known_lon'] = '{:.12f}'.format(dtm['lon0'] + dtm['dx'] * (col_start * tile_size + 0.5))
+    index['tile_x'] = str(tile_size)
+    index['tile_y'] = str(tile_size)
+    index['tile_z'] = '1'
+    index['tile_bdr'] = str(border)
+    index['row_order'] = 'bottom_top'
+    with open(filename, 'w') as f:
+        for key, value in index.items():
+            f.write('{} = {}\n'.format(key, value))
+
+parser = argparse.ArgumentParser(description='Prepare the WPS topography tiles of a case from a cache of converted DTM tiles')
+parser.add_argument('--lat', type=float, required=True, help='Latitude of the center of the domain [deg]')
+parser.add_argument('--lon', type=float, required=True, help='Longitude of the center of the domain [deg]')
+parser.add_argument('--extent', type=float, required=True, help='Extent of the grid [km]')
+parser.add_argument('-t', '--geotiff', required=True, help='Path to the input geotiff')
+parser.add_argument('-o', '--output', required=True, help='Output folder of the WPS tiles, e.g. topo_ensembledtm_1s')
+parser.add_argument('--cache', required=True, help='Folder of the tile cache shared between the cases')
+parser.add_argument('--tile-size', type=int, default=1500, help='Size of the tiles in pixels')
+parser.add_argument('-b', '--border', type=int, default=30, help='Size of the halo of the tiles in pixels')
+parser.add_argument('-s', '--scale', type=float, default=1.0, help='Scale factor of the stored integer values')
+parser.add_argument('-m', '--missing', type=float, default=0.0, help='Value of the missing data')
+parser.add_argument('--wordsize', type=int, default=2, choices=sorted(word_types.keys()), help='Bytes per stored value')
+parser.add_argument('-u', '--units', type=str, default='meter MSL', help='Units of the data')
+parser.add_argument('-d', '--description', type=str, default='Topography height', help='Description of the data')
+parser.add_argument('-w', '--workers', type=int, default=1, help='Number of tiles that are converted in parallel')
+args = parser.parse_args()
+
+# check if the pole is contained within the extent as it is currently not supported
+projection, projection_params = get_projection(args.lat, args.lon, args.extent)
+center_x, center_y = projection(args.lon, args.lat)
+pos_pole = projection(args.lon, 90 if args.lat > 0 else -90)
+if np.sqrt((center_x - pos_pole[0])**2 + (center_y - pos_pole[1])**2) / 1000 < 0.5 * args.extent:
+    print('The poles are contained within the domain, which is currently not supported')
+    sys.exit(1)
+
+dtm = get_dtm_info(args.geotiff)
+limits = get_extent_limits(args.lat, args.lon, args.extent, projection)
+tile_range = get_tile_range(dtm, limits, args.tile_size)
+if tile_range is None:
+    print('The domain is not contained in', args.geotiff)
+    sys.exit(1)
+col_start, col_end, row_start, row_end = tile_range
+
+cache_dir = os.path.join(args.cache, dtm['name'], '{}_{}_{}_{}'.format(args.tile_size, args.border, args.wordsize, args.scale))
+tiles = [(col, row) for row in range(row_start, row_end + 1) for col in range(col_start, col_end + 1)]
+tile_args = (args.tile_size, args.border, args.scale, args.missing, args.wordsize)
+if args.workers > 1:
+    with Pool(args.workers) as pool:
+        errors = pool.starmap(get_cached_tile, [(cache_dir, args.geotiff, col, row) + tile_args for col, row in tiles])
+else:
+    errors = [get_cached_tile(cache_dir, args.geotiff, col, row, *tile_args) for col, row in tiles]
+
+errors = [error for error in errors if error is not None]
+if len(errors) > 0:
+    print('\n'.join(errors))
+    sys.exit(1)
+
+# link the cached tiles with the names of their position within the domain of the case
+os.makedirs(args.output, exist_ok=True)
+for col, row in tiles:
+    x = (col - col_start) * args.tile_size + 1
+    y = (row_end - row) * args.tile_size + 1
+    name = '{:05d}-{:05d}.{:05d}-{:05d}'.format(x, x + args.tile_size - 1, y, y + args.tile_size - 1)
+    if os.path.lexists(os.path.join(args.output, name)):
+        os.remove(os.path.join(args.output, name))
+    os.symlink(os.path.join(os.path.abspath(cache_dir), '{}_{}'.format(col, row), 'data'), os.path.join(args.output, name))
+
+write_index(os.path.join(args.output, 'index'), dtm, tile_range, args.tile_size, args.border, args.scale, args.missing,
+            args.wordsize, args.units, args.description)
+
+exit(0)
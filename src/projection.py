@@ -67,4 +67,82 @@ def get_extent_limits(center_lat, center_lon, extent, projection):
             limits['lon_max'] = max(limits['lon_max'], lon)
             limits['lat_max'] = max(limits['lat_max'], lat)
 
-    return limits
\ No newline at end of file
+    return limits
+
+# wrf uses a sphere for all map projections
+earth_radius_wrf = 6370000.0
+
+def get_wrf_projection(map_proj, ref_lat, stand_lon, truelat1, truelat2):
+    if map_proj == 'mercator':
+        proj_string = '+proj=merc +lat_ts={0} +lon_0={1} +R={2}'.format(truelat1, stand_lon, earth_radius_wrf)
+    elif map_proj == 'polar':
+        proj_string = '+proj=stere +lat_0={0} +lat_ts={1} +lon_0={2} +R={3}'.format(
+            90 if truelat1 > 0 else -90, truelat1, stand_lon, earth_radius_wrf)
+    elif map_proj == 'lambert':
+        proj_string = '+proj=lcc +lat_0={0} +lat_1={1} +lat_2={2} +lon_0={3} +R={4}'.format(
+            ref_lat, truelat1, truelat2, stand_lon, earth_radius_wrf)
+    else:
+        raise ValueError('Unsupported map projection: ' + str(map_proj))
+    return pyproj.Proj(proj_string)
+
+def get_mapfac(lat, map_proj, truelat1, truelat2):
+    # map factor of the conformal projections as a function of the latitude only, same definitions as in wrf
+    phi = np.radians(lat)
+    phi1 = np.radians(truelat1)
+    hemisphere = 1.0 if truelat1 > 0 else -1.0
+    if map_proj == 'mercator':
+        return np.cos(phi1) / np.cos(phi)
+    elif map_proj == 'polar':
+        return (1.0 + hemisphere * np.sin(phi1)) / (1.0 + hemisphere * np.sin(phi))
+
+    # cone factor of the lambert projection, tangent cone if the true latitudes are (almost) the same
+    if np.abs(truelat1 - truelat2) > 0.1:
+        phi2 = np.radians(truelat2)
+        cone = (np.log10(np.cos(phi1)) - np.log10(np.cos(phi2))) / \
+            (np.log10(np.tan(0.25 * np.pi - 0.5 * np.abs(phi1))) - np.log10(np.tan(0.25 * np.pi - 0.5 * np.abs(phi2))))
+    else:
+        cone = np.sin(np.abs(phi1))
+    return np.cos(phi1) / np.cos(phi) * \
+        (np.tan(0.25 * np.pi - 0.5 * hemisphere * phi) / np.tan(0.25 * np.pi - 0.5 * hemisphere * phi1))**cone
+
+def get_grid_lats(projection, ref_lat, ref_lon, dx, domains):
+    # latitudes of the staggered corner points of every domain, they contain the mass and the u/v points
+    center_x, center_y = projection(ref_lon, ref_lat)
+    lats = []
+    origins = []
+    for i, domain in enumerate(domains):
+        if i == 0:
+            resolution = dx
+            origin_x = center_x - 0.5 * (domain['e_we'] - 1) * resolution
+            origin_y = center_y - 0.5 * (domain['e_sn'] - 1) * resolution
+        else:
+            parent_x, parent_y, parent_resolution = origins[domain['parent_id'] - 1]
+            resolution = parent_resolution / domain['parent_grid_ratio']
+            origin_x = parent_x + (domain['i_parent_start'] - 1) * parent_resolution
+            origin_y = parent_y + (domain['j_parent_start'] - 1) * parent_resolution
+        origins.append((origin_x, origin_y, resolution))
+
+        x, y = np.meshgrid(origin_x + resolution * np.arange(domain['e_we']), origin_y + resolution * np.arange(domain['e_sn']))
+        lats.append(projection(x, y, inverse=True)[1])
+    return lats
+
+def get_max_mapfac_deviation(map_proj, ref_lat, ref_lon, stand_lon, truelat1, truelat2, dx, domains):
+    projection = get_wrf_projection(map_proj, ref_lat, stand_lon, truelat1, truelat2)
+    lats = get_grid_lats(projection, ref_lat, ref_lon, dx, domains)
+    return max(np.max(np.abs(get_mapfac(lat, map_proj, truelat1, truelat2) - 1.0)) for lat in lats)
+
+def tune_truelats(map_proj, ref_lat, ref_lon, stand_lon, truelat1, truelat2, dx, domains):
+    # the map factor only depends on the latitude, the true latitudes are chosen such that the largest deviation over the
+    # latitude range of the domains is minimal
+    projection = get_wrf_projection(map_proj, ref_lat, stand_lon, truelat1, truelat2)
+    lats = np.concatenate([lat.ravel() for lat in get_grid_lats(projection, ref_lat, ref_lon, dx, domains)])
+    lat_range = np.linspace(np.min(lats), np.max(lats), 201)
+
+    candidates = np.linspace(np.min(lats), np.max(lats), 41)
+    if map_proj == 'lambert':
+        pairs = [(lat1, lat2) for lat1 in candidates for lat2 in candidates if lat1 <= lat2 and lat1 * lat2 > 0]
+    else:
+        pairs = [(lat1, lat1) for lat1 in candidates if lat1 != 0]
+    deviations = [np.max(np.abs(get_mapfac(lat_range, map_proj, lat1, lat2) - 1.0)) for lat1, lat2 in pairs]
+    lat1, lat2 = pairs[int(np.argmin(deviations))]
+    return float(np.round(lat1, 2)), float(np.round(lat2, 2))
@@ -0,0 +1,128 @@
+import argparse
+import datetime
+import glob
+from netCDF4 import Dataset
+import numpy as np
+import os
+import re
+import shutil
+import sys
+
+# wrfrst_d01_2018-02-24_12:00:00
+restart_pattern = re.compile(r'^wrfrst_d(\d\d)_(\d{4}-\d\d-\d\d_\d\d:\d\d:\d\d)$')
+namelist_pattern = re.compile(r'^(\s*)(\w+)(\s*=\s*)(.*?)\s*$')
+time_format = '%Y-%m-%d_%H:%M:%S'
+
+def read_namelist(filename):
+    values = {}
+    with open(filename, 'rt') as f:
+        for line in f:
+            match = namelist_pattern.match(line)
+            if match is not None:
+                values[match.group(2)] = [value.strip() for value in match.group(4).split(',') if value.strip() != '']
+    return values
+
+def get_time(namelist, prefix):
+    fields = [int(namelist.get(prefix + '_' + name, ['0'])[0]) for name in ['year', 'month', 'day', 'hour', 'minute', 'second']]
+    return datetime.datetime(*fields)
+
+def is_complete(filename, time):
+    # a restart file that was cut off by the end of the job can not be opened or lacks its time
+    try:
+        with Dataset(filename) as dataset:
+            return b''.join(np.asarray(dataset['Times'][0])).decode() == time.strftime(time_format)
+    except (OSError, IndexError, KeyError, UnicodeDecodeError):
+        return False
+
+def get_latest_restart(wrf_dir, num_domains, start_time, end_time):
+    # the latest time after the start for which the restart files of all domains are complete
+    times = {}
+    for filename in glob.glob(os.path.join(wrf_dir, 'wrfrst_d*')):
+        match = restart_pattern.match(os.path.basename(filename))
+        if match is None:
+            continue
+        time = datetime.datetime.strptime(match.group(2), time_format)
+        if start_time < time <= end_time:
+            times.setdefault(time, {})[int(match.group(1))] = filename
+
+    for time in sorted(times.keys(), reverse=True):
+        files = times[time]
+        if all(domain in files.keys() and is_complete(files[domain], time) for domain in range(1, num_domains + 1)):
+            return time
+    return None
+
+def write_segment(template, filename, start_time, run_hours, restart):
+    # the start of all domains moves to the restart time, the end stays the end of the whole run and the restart
+    # interval equals the segment so that the restart files are written at its end
+    values = {
+        'start_year': str(start_time.year),
+        'start_month': str(start_time.month).zfill(2),
+        'start_day': str(start_time.day).zfill(2),
+        'start_hour': str(start_time.hour).zfill(2),
+        'start_minute': str(start_time.minute).zfill(2),
+        'start_second': str(start_time.second).zfill(2),
+    }
+    with open(template, 'rt') as f:
+        lines = f.readlines()
+
+    out_lines = []
+    for line in lines:
+        match = namelist_pattern.match(line)
+        if match is not None:
+            key = match.group(2)
+            num_values = len([value for value in match.group(4).split(',') if value.strip() != ''])
+            if key in values.keys():
+                line = match.group(1) + key + match.group(3) + ',  '.join([values[key]] * num_values) + ',\n'
+            elif key in ['run_days', 'run_minutes', 'run_seconds']:
+                line = match.group(1) + key + match.group(3) + '0,\n'
+            elif key == 'run_hours':
+                line = match.group(1) + key + match.group(3) + '{},\n'.format(run_hours)
+            elif key == 'restart':
+                line = match.group(1) + key + match.group(3) + ('.true.,\n' if restart else '.false.,\n')
+            elif key == 'restart_interval':
+                line = match.group(1) + key + match.group(3) + '{},\n'.format(run_hours * 60)
+        out_lines.append(line)
+
+    with open(filename, 'wt') as f:
+        f.writelines(out_lines)
+
+parser = argparse.ArgumentParser(description='Set up the namelist of the next restart segment of a wrf run')
+parser.add_argument('-i', '--namelist', type=str, default='namelist.input', help='Namelist of the run, rewritten for the segment')
+parser.add_argument('-s', '--segment-hours', type=int, required=True, help='Simulated hours per segment')
+parser.add_argument('--shell', action='store_true', help='Only print the segment as shell variables')
+args = parser.parse_args()
+
+if args.segment_hours <= 0:
+    print('The segment needs to be at least one hour')
+    sys.exit(1)
+
+# the namelist of the whole run is kept next to the segment namelist, exec_wrf.sh restores it after each segment
+full_namelist = args.namelist + '.full'
+if not os.path.exists(full_namelist):
+    shutil.copy2(args.namelist, full_namelist)
+namelist = read_namelist(full_namelist)
+
+num_domains = int(namelist['max_dom'][0])
+start_time = get_time(namelist, 'start')
+end_time = get_time(namelist, 'end')
+restart_time = get_latest_restart(os.path.dirname(os.path.abspath(args.namelist)), num_domains, start_time, end_time)
+
+segment_start = start_time if restart_time is None else restart_time
+remaining_hours = int(np.ceil((end_time - segment_start).total_seconds() / 3600))
+run_hours = min(args.segment_hours, remaining_hours)
+complete = remaining_hours <= 0
+last = remaining_hours <= args.segment_hours
+
+if not complete:
+    write_segment(full_namelist, args.namelist, segment_start, run_hours, restart_time is not None)
+
+if args.shell:
+    print('complete={} restart={} last={} segment_start={} run_hours={}'.format(
+        str(complete).lower(), str(restart_time is not None).lower(), str(last).lower(), segment_start.strftime(time_format), run_hours))
+elif complete:
+    print('The run until {} is complete'.format(end_time.strftime(time_format)))
+else:
+    print('Segment from {} over {} h{}, {} h remaining afterwards'.format(
+        segment_start.strftime(time_format), run_hours, ' (restart)' if restart_time is not None else '', remaining_hours - run_hours))
+
+exit(0)
@@ -0,0 +1,140 @@
+import glob
+import numpy as np
+import os
+import re
+
+# Timing for main: time 2018-02-24_00:00:10 on domain   1:    0.12345 elapsed seconds
+# Timing for Writing wrfout_d01_2018-02-24_00:00:00 for domain        1:    0.45678 elapsed seconds
+# Timing for processing lateral boundary for domain        1:    0.01234 elapsed seconds
+timing_pattern = re.compile(r'Timing for (.*?)\s+(?:on|for) domain\s+(\d+):\s+([\d.]+) elapsed seconds')
+date_pattern = re.compile(r'(\d{4}-\d\d-\d\d_\d\d):\d\d:\d\d')
+rsl_pattern = re.compile(r'^(?:wrf_)?rsl\.(error|out)\.(\d+)$')
+
+categories = ['compute', 'write', 'lbc', 'other']
+
+def get_category(label):
+    if label.startswith('main'):
+        return 'compute'
+    elif label.startswith('Writing'):
+        return 'write'
+    elif label.startswith('processing lateral boundary'):
+        return 'lbc'
+    return 'other'
+
+def get_rsl_files(paths):
+    # rsl.error contains everything of rsl.out, so the out file of a rank is only used if its error file is missing,
+    # the copies made by exec_wrf.sh in OUT (wrf_rsl.*) are used if the run directory was cleaned up
+    files = {}
+    for path in paths:
+        candidates = [path] if os.path.isfile(path) else sorted(glob.glob(os.path.join(path, '*rsl.*')))
+        for file in candidates:
+            match = rsl_pattern.match(os.path.basename(file))
+            if match is None:
+                continue
+            rank = int(match.group(2))
+            if rank not in files.keys() or (match.group(1) == 'error' and files[rank][0] == 'out'):
+                files[rank] = (match.group(1), file)
+    return {rank: file for rank, (_, file) in sorted(files.items())}
+
+def new_stats():
+    return {'count': 0, 'sum': 0.0, 'sum_sq': 0.0, 'max': 0.0}
+
+def add_sample(stats, value):
+    stats['count'] += 1
+    stats['sum'] += value
+    stats['sum_sq'] += value * value
+    stats['max'] = max(stats['max'], value)
+
+def parse_rank(file, track_hours):
+    # the file is streamed line by line, only the sums per domain and category are kept
+    domains = {}
+    with open(file, 'rt', errors='replace') as f:
+        for line in f:
+            if not line.startswith('Timing for'):
+                continue
+            match = timing_pattern.match(line)
+            if match is None:
+                continue
+
+            label, domain, seconds = match.group(1), match.group(2), float(match.group(3))
+            category = get_category(label)
+            if not domain in domains.keys():
+                domains[domain] = {'stats': {name: new_stats() for name in categories}, 'hours': {}, 'hour': None}
+            data = domains[domain]
+            add_sample(data['stats'][category], seconds)
+
+            if track_hours:
+                # the lines without a date (e.g. the lateral boundaries) belong to the hour of the last step of the domain
+                date = date_pattern.search(label)
+                if date is not None:
+                    data['hour'] = date.group(1)
+                if data['hour'] is not None:
+                    if not data['hour'] in data['hours'].keys():
+                        data['hours'][data['hour']] = {name: new_stats() for name in categories}
+                    add_sample(data['hours'][data['hour']][category], seconds)
+    return domains
+
+def get_domain_report(data):
+    stats = data['stats']
+    total = sum(stats[category]['sum'] for category in categories)
+    steps = stats['compute']
+    step_mean = steps['sum'] / steps['count'] if steps['count'] > 0 else 0.0
+    step_std = np.sqrt(max(steps['sum_sq'] / steps['count'] - step_mean**2, 0.0)) if steps['count'] > 0 else 0.0
+
+    per_hour = []
+    for hour, hour_stats in sorted(data['hours'].items()):
+        count = hour_stats['compute']['count']
+        per_hour.append({
+            'hour': hour,
+            'steps': count,
+            'step_mean_s': hour_stats['compute']['sum'] / count if count > 0 else 0.0,
+            'step_max_s': hour_stats['compute']['max'],
+            'write_s': hour_stats['write']['sum'],
+            'lbc_s': hour_stats['lbc']['sum'],
+        })
+
+    return {
+        'steps': steps['count'],
+        'compute_s': steps['sum'],
+        'write_s': stats['write']['sum'],
+        'lbc_s': stats['lbc']['sum'],
+        'other_s': stats['other']['sum'],
+        'io_share': (stats['write']['sum'] + stats['lbc']['sum'] + stats['other']['sum']) / total if total > 0 else 0.0,
+        'step_mean_s': step_mean,
+        'step_std_s': step_std,
+        'step_max_s': steps['max'],
+        'per_hour': per_hour,
+    }
+
+def get_rank_report(ranks):
+    # the time a rank spends in the steps includes waiting for the slowest neighbour, the spread of the
+    # step times between the ranks is therefore a lower bound of the load imbalance
+    compute = {rank: sum(data['stats']['compute']['sum'] for data in domains.values()) for rank, domains in ranks.items()}
+    values = np.array(list(compute.values()))
+    if len(values) == 0 or values.mean() == 0:
+        return {'count': len(values)}
+    return {
+        'count': len(values),
+        'compute_min_s': float(values.min()),
+        'compute_mean_s': float(values.mean()),
+        'compute_max_s': float(values.max()),
+        'imbalance': float(values.max() / values.mean() - 1.0),
+        'slowest_rank': int(max(compute, key=compute.get)),
+        'fastest_rank': int(min(compute, key=compute.get)),
+    }
+
+def analyze_run(files):
+    # only the first rank is binned per simulated hour, all ranks run the same steps
+    reference_rank = min(files.keys())
+    ranks = {rank: parse_rank(file, rank == reference_rank) for rank, file in files.items()}
+
+    domains = {domain: get_domain_report(data) for domain, data in sorted(ranks[reference_rank].items(), key=lambda item: int(item[0]))}
+    total = sum(data['compute_s'] + data['write_s'] + data['lbc_s'] + data['other_s'] for data in domains.values())
+    io = sum(data['write_s'] + data['lbc_s'] + data['other_s'] for data in domains.values())
+
+    return {
+        'files': list(files.values()),
+        'domains': domains,
+        'ranks': get_rank_report(ranks),
+        'total': {'runtime_h': total / 3600, 'io_share': io / total if total > 0 else 0.0},
+    }
@@ -0,0 +1,249 @@
+import argparse
+import csv
+import numpy as np
+from multiprocessing.pool import ThreadPool
+import os
+import subprocess
+import sys
+import threading
+
+# the chain of every case, each stage starts after the previous stage of the same case succeeded
+stages = [
+    ('setup', 'MESO', 'setup_case.sh'),
+    ('wrf', 'MESO', 'exec_wrf.sh'),
+    ('setup', 'LES', 'setup_case.sh'),
+    ('wrf', 'LES', 'exec_wrf.sh'),
+    ('post', 'LES', 'run_postprocessing.sh'),
+]
+
+repository_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def read_cases(filename, default_dt):
+    # one case per row with the columns date, lat, lon and optionally dt, identical cases are only run once
+    cases = {}
+    with open(filename, 'r', newline='') as f:
+        for row in csv.DictReader(f):
+            row = {key.strip(): value.strip() for key, value in row.items() if key is not None}
+            dt = row.get('dt') or default_dt
+            if dt is None:
+                print('No simulation interval for the case', row)
+                sys.exit(1)
+            # same case name as in the shell scripts
+            name = '{}-lat{}-lon{}'.format(row['date'], row['lat'], row['lon'])
+            if name not in cases.keys():
+                cases[name] = {'name': name, 'date': row['date'], 'lat': row['lat'], 'lon': row['lon'], 'dt': dt}
+    return list(cases.values())
+
+def split_cases(cases):
+    # the first case of every location sets up the geo data and the geogrid output, the other cases at the same
+    # location start their setup afterwards and take them from the caches instead of repeating the work
+    leads = {}
+    follows = []
+    for case in cases:
+        location = (case['lat'], case['lon'])
+        if location in leads.keys():
+            follows.append(case)
+        else:
+            leads[location] = case
+    return list(leads.values()), follows
+
+def get_options(case, stage, mode, cores):
+    options = ['-y', args.yaml_config, '-d', case['date'], '-o', case['lon'], '-a', case['lat'], '-t', case['dt'], '-n', str(cores)]
+    if mode == 'LES':
+        options.append('-l')
+    if stage == 'post':
+        options.append('-e')
+    if stage == 'wrf' and advice[mode] is not None:
+        options.append('-p')
+    if stage == 'wrf' and args.segment_hours is not None:
+        options += ['-s', str(args.segment_hours)]
+    if args.verbose:
+        options.append('-v')
+    return options
+
+def get_advice(mode, dt):
+    # the fastest number of cores of the previous runs that keeps the parallel efficiency and fits the run time of a job
+    # a segmented run only has to fit one segment into the run time of a job
+    if args.segment_hours is not None:
+        dt = min(dt, args.segment_hours)
+    command = ['python3', os.path.join('src', 'mpi_advisor.py'), '-y', args.yaml_config, '-t', str(dt),
+               '--max-walltime', str(resources[mode][1]), '--shell']
+    if mode == 'LES':
+        command.append('-l')
+    if args.history:
+        command += ['--history'] + args.history
+    result = subprocess.run(command, cwd=repository_directory, capture_output=True, text=True)
+    if result.returncode != 0:
+        print('Failed to get a recommendation from the previous runs for', mode)
+        print(result.stdout + result.stderr)
+        sys.exit(1)
+    values = dict(item.split('=') for item in result.stdout.split())
+    return int(values['n_cores']), int(values['runtime'])
+
+def get_repeats(stage, cases):
+    # a segmented wrf run is repeated until the longest case is complete, each run continues from the restart files of
+    # the previous one and the cases that are already complete exit at once
+    if stage != 'wrf' or args.segment_hours is None:
+        return 1
+    return int(np.ceil(max(float(case['dt']) for case in cases) / args.segment_hours))
+
+def get_resources(stage, mode):
+    if stage == 'setup':
+        return ['-n', '1', '--cpus-per-task={}'.format(args.setup_cpus), '--time=24:00:00', '--mem-per-cpu=8192']
+    elif stage == 'post':
+        return ['-n', '1', '--cpus-per-task={}'.format(args.post_cpus), '--time=48:00:00', '--mem-per-cpu=12800']
+    cores, runtime = resources[mode]
+    return ['-n', str(cores), '--cpus-per-task=1', '--time={}:00:00'.format(runtime), '--mem-per-cpu=4096']
+
+def submit_slurm(group, cases, lead_jobs):
+    # one job array per stage, the element i of a stage depends on the element i of the previous stage (aftercorr)
+    cases_file = os.path.join(args.sweep_directory, group + '_cases.txt')
+    with open(cases_file, 'w') as f:
+        for case in cases:
+            f.write(' '.join([case['date'], case['lat'], case['lon'], case['dt']]) + '\n')
+
+    jobs = {}
+    previous = None
+    for stage, mode, script in stages:
+        if mode == 'LES' and not args.les:
+            continue
+        if stage == 'post' and not args.post:
+            continue
+
+        job_name = '{}_{}_{}'.format(group, stage, mode)
+        job_file = os.path.join(args.sweep_directory, job_name + '.sh')
+        options = get_options({'date': '$date', 'lat': '$lat', 'lon': '$lon', 'dt': '$dt'}, stage, mode, -1)
+        with open(job_file, 'w') as f:
+            f.write('#!/bin/bash\n')
+            f.write('read date lat lon dt <<< $(sed -n "$((SLURM_ARRAY_TASK_ID + 1))p" {})\n'.format(os.path.abspath(cases_file)))
+            f.write('cd {}\n'.format(repository_directory))
+            f.write('bash {} {}\n'.format(script, ' '.join(options)))
+
+        repeats = get_repeats(stage, cases)
+        for repeat in range(repeats):
+            array_name = job_name if repeats == 1 else '{}_{}'.format(job_name, repeat)
+            dependencies = []
+            if previous is not None:
+                dependencies.append('aftercorr:' + previous)
+            if stage == 'setup' and (stage, mode) in lead_jobs.keys():
+                dependencies.append('afterany:' + lead_jobs[(stage, mode)])
+
+            command = ['sbatch', '--parsable', '--job-name=' + array_name, '--array=0-{}%{}'.format(len(cases) - 1, args.max_running),
+                       '--output=' + os.path.join(os.path.abspath(args.sweep_directory), 'logs', array_name + '_%a.out')]
+            command += get_resources(stage, mode)
+            if len(dependencies) > 0:
+                command.append('--dependency=' + ','.join(dependencies))
+            command.append(job_file)
+
+            print(' '.join(command))
+            if args.dry_run:
+                jobid = '<{}>'.format(array_name)
+            else:
+                result = subprocess.run(command, capture_output=True, text=True)
+                if result.returncode != 0:
+                    print('Failed to submit {}: {}'.format(array_name, result.stderr.strip()))
+                    sys.exit(1)
+                jobid = result.stdout.strip().split(';')[0]
+            jobs[(stage, mode)] = jobid
+            previous = jobid
+    return jobs
+
+def run_case(case):
+    error = run_chain(case)
+    # the cases at the location of a failed lead do not wait for stages that never run
+    if case['lead']:
+        for mode in ['MESO', 'LES']:
+            setup_events[(case['lat'], case['lon'], mode)].set()
+    return error
+
+def run_chain(case):
+    for stage, mode, script in stages:
+        if mode == 'LES' and not args.les:
+            continue
+        if stage == 'post' and not args.post:
+            continue
+
+        location_event = setup_events[(case['lat'], case['lon'], mode)]
+        if stage == 'setup' and not case['lead']:
+            location_event.wait()
+
+        cores = resources[mode][0] if stage == 'wrf' else args.setup_cpus if stage == 'setup' else args.post_cpus
+        log_file = os.path.join(args.sweep_directory, 'logs', '{}_{}_{}.log'.format(case['name'], stage, mode))
+        with open(log_file, 'w') as f:
+            for _ in range(get_repeats(stage, [case])):
+                result = subprocess.run(['bash', script] + get_options(case, stage, mode, cores), cwd=repository_directory,
+                                        stdout=f, stderr=subprocess.STDOUT)
+                if result.returncode != 0:
+                    break
+
+        if stage == 'setup' and case['lead']:
+            location_event.set()
+        if result.returncode != 0:
+            return '{}: {} {} failed, see {}'.format(case['name'], stage, mode, log_file)
+    return None
+
+parser = argparse.ArgumentParser(description='Run the MESO, LES and postprocessing chain for a table of cases')
+parser.add_argument('-y', '--yaml-config', required=True, help='YAML config file, relative to the repository')
+parser.add_argument('-i', '--input', required=True, help='CSV table with the columns date, lat, lon and optionally dt')
+parser.add_argument('-t', '--dt', type=str, help='Simulation interval in hours of the cases without a dt column')
+parser.add_argument('-s', '--sweep-directory', type=str, default='sweep', help='Folder for the job scripts and the logs')
+parser.add_argument('-e', '--executor', choices=['slurm', 'local'], default='slurm', help='Submit job arrays to slurm or run the cases locally')
+parser.add_argument('--max-running', type=int, default=50, help='Maximum number of concurrently running jobs of every stage')
+parser.add_argument('-w', '--workers', type=int, default=2, help='Number of cases run concurrently by the local executor')
+parser.add_argument('--meso-cores', type=int, default=20, help='Number of cores of the MESO wrf run')
+parser.add_argument('--les-cores', type=int, default=64, help='Number of cores of the LES wrf run')
+parser.add_argument('--meso-runtime', type=int, default=120, help='Requested run time of the MESO wrf run in hours')
+parser.add_argument('--les-runtime', type=int, default=120, help='Requested run time of the LES wrf run in hours')
+parser.add_argument('--segment-hours', type=int, help='Split the wrf runs into chained jobs simulating this many hours each')
+parser.add_argument('--setup-cpus', type=int, default=1, help='Number of cores of the setup jobs')
+parser.add_argument('--post-cpus', type=int, default=8, help='Number of cores of the postprocessing jobs')
+parser.add_argument('-A', '--advise', action='store_true', help='Choose the cores and the run time of the wrf runs from the previous runs')
+parser.add_argument('--history', type=str, nargs='+', default=[], help='Previous runs for the advice, see mpi_advisor.py')
+parser.add_argument('--no-les', dest='les', action='store_false', help='Only run the MESO stage')
+parser.add_argument('--no-post', dest='post', action='store_false', help='Do not run the postprocessing')
+parser.add_argument('--dry-run', action='store_true', help='Only print the slurm commands')
+parser.add_argument('-v', '--verbose', action='store_true', help='Enable verbose outputs of the stages')
+args = parser.parse_args()
+
+cases = read_cases(args.input, args.dt)
+if len(cases) == 0:
+    print('No cases in', args.input)
+    sys.exit(1)
+leads, follows = split_cases(cases)
+print('{} cases at {} locations'.format(len(cases), len(leads)))
+
+resources = {'MESO': (args.meso_cores, args.meso_runtime), 'LES': (args.les_cores, args.les_runtime)}
+advice = {'MESO': None, 'LES': None}
+if args.advise:
+    max_dt = max(float(case['dt']) for case in cases)
+    for mode in ['MESO', 'LES'] if args.les else ['MESO']:
+        advice[mode] = get_advice(mode, max_dt)
+        resources[mode] = advice[mode]
+        print('{}: {} cores, {} hours'.format(mode, *resources[mode]))
+
+os.makedirs(os.path.join(args.sweep_directory, 'logs'), exist_ok=True)
+
+if args.executor == 'slurm':
+    lead_jobs = submit_slurm('lead', leads, {})
+    if len(follows) > 0:
+        submit_slurm('follow', follows, lead_jobs)
+    exit(0)
+
+# the local executor runs the chains of the cases in a bounded pool, the leads are started first so that a waiting
+# case never blocks the lead it waits for
+for case in leads:
+    case['lead'] = True
+for case in follows:
+    case['lead'] = False
+setup_events = {(case['lat'], case['lon'], mode): threading.Event() for case in leads for mode in ['MESO', 'LES']}
+
+with ThreadPool(args.workers) as pool:
+    errors = list(pool.imap(run_case, leads + follows, chunksize=1))
+
+errors = [error for error in errors if error is not None]
+print('{} of {} cases completed'.format(len(cases) - len(errors), len(cases)))
+if len(errors) > 0:
+    print('\n'.join(errors))
+    sys.exit(1)
+
+exit(0)
@@ -1,10 +1,57 @@
 import argparse
 import datetime
 import glob
+from multiprocessing.pool import ThreadPool
 import os
 import shutil
+import subprocess
 import yaml
 
+def replace_symlink(source, link):
+    # the links of a previous, interrupted run are replaced
+    if os.path.lexists(link):
+        os.remove(link)
+    os.symlink(source, link)
+
+def write_itag(filename, wrfout_file, time_string):
+    f_itag = open(filename, 'wt')
+    f_itag.write("&model_inputs\n")
+    f_itag.write("fileName='" + wrfout_file + "'\n")
+    f_itag.write("IOFORM='netcdf'\n")
+    f_itag.write("grib='grib2'\n")
+    f_itag.write("DateStr='" + time_string + "'\n")
+    f_itag.write("MODELNAME='NCAR'\n")
+    f_itag.write("fileNameFlat='postxconfig-NT.txt'\n")
+    f_itag.write("/\n")
+    f_itag.write("&nampgb\n")
+    f_itag.write("numx=1\n")
+    f_itag.write("/\n")
+    f_itag.close()
+
+def run_upp(time, upp_dir, shared_files, tmp_dir, data_dir, domain):
+    # every timestep runs in its own directory with links to the shared parameter and coefficient files
+    # so that the concurrent runs do not overwrite each others itag and output files
+    time_string = time.strftime("%Y-%m-%d_%H:%M:%S")
+    work_dir = os.path.join(upp_dir, 'run_' + time_string)
+    os.makedirs(work_dir, exist_ok=True)
+    for file in shared_files:
+        if not os.path.lexists(os.path.join(work_dir, file)):
+            os.symlink(os.path.join(upp_dir, file), os.path.join(work_dir, file))
+
+    filename = 'wrfout_' + domain + '_' + time_string
+    write_itag(os.path.join(work_dir, 'itag'), os.path.join(tmp_dir, filename), time_string)
+
+    with open(os.path.join(upp_dir, 'upp.' + time_string + '.out'), 'wt') as log:
+        subprocess.call(['./upp.x'], cwd=work_dir, stdout=log, stderr=subprocess.STDOUT)
+
+    # move output files to the DATA folder, the work directory is kept for inspection if upp failed
+    upp_out_files = glob.glob(os.path.join(work_dir, 'WRFPRS.GrbF*'))
+    if len(upp_out_files) == 0:
+        return time_string
+    shutil.move(upp_out_files[0], os.path.join(data_dir, 'WRF_' + time_string + '.grb'))
+    shutil.rmtree(work_dir)
+    return None
+
 parser = argparse.ArgumentParser(description='Run UPP to convert the wrfout to grib files')
 parser.add_argument('-y', '--yaml-config', required=True, help='YAML config file')
 parser.add_argument('-d', '--date', required=True, help='Start date of the simulation')
@@ -14,6 +61,7 @@ parser.add_argument('--domain', type=str, default='d03', help='Domain indentifie
 parser.add_argument('--dt', type=int, required=True, help='Simulation interval in hours')
 parser.add_argument('--offset', type=int, default=0, help='Simulation start offset in hours')
 parser.add_argument('-i', '--increment', type=int, required=True, help='Increment between wrfout in minutes')
+parser.add_argument('-w', '--workers', type=int, default=1, help='Number of upp instances that run concurrently')
 args = parser.parse_args()
 
 # load the default configurations
@@ -26,13 +74,13 @@ for folder in ['UPP', 'DATA', 'TMP']:
 
 # setting up symlinks to the UPP files
 upp_dir = os.path.join(args.run_directory, 'UPP')
-os.symlink(config['UPP']['exe_path'], os.path.join(upp_dir, 'upp.x'))
+replace_symlink(config['UPP']['exe_path'], os.path.join(upp_dir, 'upp.x'))
 shutil.copyfile(os.path.join(args.configs, 'wrf_cntrl.parm'), os.path.join(upp_dir, 'postxconfig-NT.txt'))
 
 base_dir_upp = config['UPP']['base_dir']
 files_list = ['post_avblflds.xml', 'params_grib2_tbl_new', 'nam_micro_lookup.dat', 'hires_micro_lookup.dat']
 for file in files_list:
-    os.symlink(os.path.join(base_dir_upp, 'parm', file), os.path.join(upp_dir, file))
+    replace_symlink(os.path.join(base_dir_upp, 'parm', file), os.path.join(upp_dir, file))
 
 # link coefficients for crtm2 (simulated synthetic satellites), not sure if they are really required
 crtm_dir = os.path.join(base_dir_upp, 'crtm', 'fix')
@@ -48,7 +96,7 @@ files_dict = {
     'CloudCoeff.bin': os.path.join('CloudCoeff', 'Big_Endian'),
 }
 for file in files_dict.keys():
-    os.symlink(os.path.join(crtm_dir, files_dict[file], file), os.path.join(upp_dir, file))
+    replace_symlink(os.path.join(crtm_dir, files_dict[file], file), os.path.join(upp_dir, file))
 
 files_list = [
     'imgr_g11', 'imgr_g12', 'imgr_g13', 'imgr_g15',
@@ -61,50 +109,36 @@ for coeff, odps in zip(['TauCoeff', 'SpcCoeff'], [True, False]):
     for file in files_list:
         filename = file + '.' + coeff + '.bin'
         if odps:
-            os.symlink(os.path.join(crtm_dir, coeff, 'ODPS', 'Big_Endian', filename), os.path.join(upp_dir, filename))
+            replace_symlink(os.path.join(crtm_dir, coeff, 'ODPS', 'Big_Endian', filename), os.path.join(upp_dir, filename))
         else:
-            os.symlink(os.path.join(crtm_dir, coeff, 'Big_Endian', filename), os.path.join(upp_dir, filename))
+            replace_symlink(os.path.join(crtm_dir, coeff, 'Big_Endian', filename), os.path.join(upp_dir, filename))
 
 time = datetime.datetime.strptime(args.date, '%Y-%m-%d')
 time = time + datetime.timedelta(hours=args.offset)
 end_time = time + datetime.timedelta(hours=args.dt-args.offset)
 
-current_directory = os.getcwd()
-os.chdir(upp_dir)
 tmp_dir = os.path.join(args.run_directory, 'TMP')
 data_dir = os.path.join(args.run_directory, 'DATA')
+# the logs and work directories of a previous run are not shared
+shared_files = [file for file in os.listdir(upp_dir) if not file.startswith('run_') and not file.endswith('.out') and file != 'itag']
 
+times = []
 while time <= end_time:
-    # fill in the itag file
-    filename = 'wrfout_' + args.domain + '_' + time.strftime("%Y-%m-%d_%H:%M:%S")
-    f_itag = open(os.path.join(upp_dir, 'itag'), 'wt')
-    f_itag.write("&model_inputs\n")
-    f_itag.write("fileName='" + os.path.join(tmp_dir, filename) + "'\n")
-    f_itag.write("IOFORM='netcdf'\n")
-    f_itag.write("grib='grib2'\n")
-    f_itag.write("DateStr='" + time.strftime("%Y-%m-%d_%H:%M:%S") + "'\n")
-    f_itag.write("MODELNAME='NCAR'\n")
-    f_itag.write("fileNameFlat='postxconfig-NT.txt'\n")
-    f_itag.write("/\n")
-    f_itag.write("&nampgb\n")
-    f_itag.write("numx=1\n")
-    f_itag.write("/\n")
-    f_itag.close()
-
-    # run UPP
-    try:
-        command_string = './upp.x > upp.' + time.strftime("%Y-%m-%d_%H:%M:%S") + '.out 2>&1'
-        os.system(command_string)
-
-        # move output files to the DATA folder
-        upp_out_file = glob.glob(os.path.join(upp_dir, 'WRFPRS.GrbF*'))[0]
-        shutil.move(upp_out_file, os.path.join(data_dir, 'WRF_' + time.strftime("%Y-%m-%d_%H:%M:%S") + '.grb'))
-    except:
-        exit(1)
-
-    time += datetime.timedelta(minutes=5)
-
-os.chdir(current_directory)
+    times.append(time)
+    time += datetime.timedelta(minutes=args.increment)
+
+# upp.x is serial, the timesteps are independent and run as separate processes
+upp_args = (upp_dir, shared_files, tmp_dir, data_dir, args.domain)
+if args.workers > 1:
+    with ThreadPool(args.workers) as pool:
+        failed = pool.starmap(run_upp, [(time,) + upp_args for time in times])
+else:
+    failed = [run_upp(time, *upp_args) for time in times]
+
+failed = [time_string for time_string in failed if time_string is not None]
+if len(failed) > 0:
+    print('UPP failed for', ', '.join(failed))
+    exit(1)
 
 # link the correct Vtable
 wps_dir = os.path.join(args.run_directory, 'WPS')
@@ -0,0 +1,275 @@
+import argparse
+from functools import partial
+import glob
+import os
+import shutil
+import subprocess
+import sys
+import yaml
+from pipeline import run_pipeline
+
+# grid extents in km
+grid_extent = 1800
+grid_extent_hr = 120
+
+def run_command(command, cwd=None, log=None, append=False):
+    # the output is written to the log if given, otherwise it goes to the output of the pipeline
+    if log is None:
+        result = subprocess.run(command, cwd=cwd)
+    else:
+        with open(log, 'a' if append else 'w') as f:
+            result = subprocess.run(command, cwd=cwd, stdout=f, stderr=subprocess.STDOUT)
+    if result.returncode != 0:
+        return '{} exited with {}'.format(' '.join(command), result.returncode)
+    return None
+
+def telemetry(stage, cores=1):
+    # every stage appends its wall time, cpu time, peak memory and io to the telemetry of the case
+    return ['python3', os.path.join(current_directory, 'src', 'stage_telemetry.py'), 'run', '-c', case_directory, '-m', mode,
+            '-s', stage, '-n', str(cores), '--']
+
+def check_log(log, success, lines):
+    with open(log, 'r', errors='replace') as f:
+        tail = f.readlines()[-lines:]
+    if not any(success in line for line in tail):
+        return 'no "{}" in {}'.format(success, log)
+    return None
+
+def link_geo_data():
+    # the static data is linked into the folder of the case, the topography tiles are added by the topo stages
+    os.makedirs(geo_data_location, exist_ok=True)
+    for geo_dir in glob.glob(os.path.join(config['WPS']['geog_data_path'], '*', '')):
+        link = os.path.join(geo_data_location, os.path.basename(os.path.dirname(geo_dir)))
+        if not os.path.lexists(link):
+            os.symlink(geo_dir, link)
+    return None
+
+def run_geogrid():
+    # the geogrid output of a previous case with the same domains is linked by setup_wps.py
+    # only links into the entry of the current key are a hit
+    geo_em_files = [os.path.join(tmp_dir, 'geo_em.d{:02d}.nc'.format(i + 1)) for i in range(num_domains)]
+    cache_entry = os.path.realpath(os.path.join(geo_em_cache_location, geo_em_key()))
+    if all(os.path.islink(file) and os.path.dirname(os.path.realpath(file)) == cache_entry for file in geo_em_files):
+        print('Using the cached geogrid files', cache_entry)
+        return None
+
+    log = os.path.join(wps_dir, 'log.geogrid')
+    error = run_command(telemetry('geogrid') + ['./geogrid.exe'], cwd=wps_dir, log=log, append=True)
+    shutil.copy(log, out_dir)
+    if error is None:
+        error = check_log(log, 'Successful completion of geogrid', 3)
+    if error is not None:
+        return error
+
+    # check if the mapfrac is close to 1.0
+    error = run_command(['python3', os.path.join(current_directory, 'src', 'check_mapfac.py'), '-i', tmp_dir])
+    if error is not None:
+        return 'MAPFAC deviation from 1.0 too large'
+
+    # store the checked files in the cache, the rename fails if another case stored them in the meantime
+    cache_entry = os.path.join(geo_em_cache_location, geo_em_key())
+    tmp_entry = '{}.{}'.format(cache_entry, os.getpid())
+    os.makedirs(tmp_entry, exist_ok=True)
+    for file in geo_em_files:
+        shutil.copy(file, tmp_entry)
+    try:
+        os.rename(tmp_entry, cache_entry)
+    except OSError:
+        shutil.rmtree(tmp_entry)
+    return None
+
+def geo_em_key():
+    with open(os.path.join(wps_dir, 'geo_em_key'), 'r') as f:
+        return f.read().strip()
+
+def link_wrfout():
+    for file in glob.glob(os.path.join(case_directory, 'MESO', 'OUT', 'wrfout*')):
+        link = os.path.join(tmp_dir, os.path.basename(file))
+        if not os.path.lexists(link):
+            os.symlink(file, link)
+    return None
+
+def run_ungrib():
+    for file in glob.glob(os.path.join(wps_dir, 'GRIBFILE.*')):
+        os.remove(file)
+    error = run_command(['./link_grib.csh', '../DATA/'], cwd=wps_dir)
+    if error is not None:
+        return error
+    log = os.path.join(wps_dir, 'log.ungrib')
+    error = run_command(telemetry('ungrib') + ['./ungrib.exe'], cwd=wps_dir, log=log, append=True)
+    shutil.copy(log, out_dir)
+    return error or check_log(log, 'Successful completion of ', 100)
+
+def run_metgrid():
+    log = os.path.join(wps_dir, 'log.metgrid')
+    error = run_command(telemetry('metgrid') + ['./metgrid.exe'], cwd=wps_dir, log=log)
+    shutil.copy(log, out_dir)
+    return error or check_log(log, 'Successful completion of ', 100)
+
+def run_real():
+    for file in glob.glob(os.path.join(tmp_dir, 'met_em*')):
+        link = os.path.join(wrf_dir, os.path.basename(file))
+        if os.path.lexists(link):
+            os.remove(link)
+        os.symlink(file, link)
+
+    error = run_command(telemetry('real') + ['mpirun', '-np', '1', './real.exe'], cwd=wrf_dir)
+    for file in ['rsl.error.0000', 'rsl.out.0000']:
+        if os.path.exists(os.path.join(wrf_dir, file)):
+            shutil.copy(os.path.join(wrf_dir, file), os.path.join(out_dir, 'real_' + file))
+    return error or check_log(os.path.join(wrf_dir, 'rsl.error.0000'), 'SUCCESS COMPLETE REAL_EM INIT', 20)
+
+def script(name, arguments):
+    return ['python3', os.path.join(current_directory, 'src', name)] + arguments
+
+def command_stage(name, command, cwd=None, **stage):
+    # a stage running a single command, the command is part of the key so that changed arguments rerun the stage
+    return dict(name=name, run=partial(run_command, command, cwd), key=' '.join(command), **stage)
+
+parser = argparse.ArgumentParser(description='Set up a WRF case as a pipeline of stages that are skipped when up to date')
+parser.add_argument('-y', '--yaml-config', required=True, help='YAML config file')
+parser.add_argument('-d', '--date', required=True, help='Start date of the simulation')
+parser.add_argument('--lat', type=str, required=True, help='Latitude of the center of the domain [deg]')
+parser.add_argument('--lon', type=str, required=True, help='Longitude of the center of the domain [deg]')
+parser.add_argument('-t', '--dt', type=int, required=True, help='Total simulation interval in hours')
+parser.add_argument('-n', '--cores', type=int, default=-1, help='Number of cores of the parallel stages, all available cores if not positive')
+parser.add_argument('-l', '--les', action='store_true', help='Set up the LES instead of the MESO mode')
+parser.add_argument('-w', '--workers', type=int, default=4, help='Number of stages that run concurrently')
+parser.add_argument('-v', '--verbose', action='store_true', help='Enable verbose outputs')
+args = parser.parse_args()
+
+current_directory = os.getcwd()
+yaml_file = os.path.join(current_directory, args.yaml_config)
+with open(yaml_file, 'rt') as fh:
+    config = yaml.safe_load(fh)
+
+# same case name and folders as in the other scripts
+case_name = '{}-lat{}-lon{}'.format(args.date, args.lat, args.lon)
+case_directory = os.path.join(config['out']['out_directory'], case_name)
+mode = 'LES' if args.les else 'MESO'
+num_domains = config[mode]['num_domains']
+time_offset = config['LES']['time_offset_h'] if args.les else 0
+namelist_wps = 'namelist_les.wps' if args.les else 'namelist_meso.wps'
+namelist_input = 'namelist_les.input' if args.les else 'namelist_meso.input'
+run_directory = os.path.join(case_directory, mode)
+wps_dir = os.path.join(run_directory, 'WPS')
+wrf_dir = os.path.join(run_directory, 'WRF')
+tmp_dir = os.path.join(run_directory, 'TMP')
+out_dir = os.path.join(run_directory, 'OUT')
+configs = os.path.join(current_directory, 'default_files')
+
+# the tiles and timesteps are converted concurrently on all the available cores if the number of cores is not set
+n_workers = args.cores if args.cores > 0 else len(os.sched_getaffinity(0))
+
+if 'TMPDIR' in os.environ.keys() and os.environ['TMPDIR'] != '':
+    geo_data_location = os.path.join(os.environ['TMPDIR'], case_name)
+else:
+    geo_data_location = os.path.join(config['WPS']['out_geog_data_path'], case_name)
+geo_cache_location = config['WPS'].get('geo_cache_path') or os.path.join(config['WPS']['out_geog_data_path'], 'tile_cache')
+geo_em_cache_location = config['WPS'].get('geo_em_cache_path') or os.path.join(config['WPS']['out_geog_data_path'], 'geo_em_cache')
+
+use_upp = args.les and config['LES'].get('use_upp', False)
+if args.les:
+    num_metgrid_levels = 60
+elif config['WPS']['use_era5_data']:
+    num_metgrid_levels = 38
+else:
+    num_metgrid_levels = 34
+
+common = ['-d', args.date, '--lat', args.lat, '--lon', args.lon, '--dt', str(args.dt)]
+topo = [('1s', 'high_res_topo_file', grid_extent_hr, '30', '1-arc-second'), ('15s', 'low_res_topo_file', grid_extent, '10', '15-arc-second')]
+
+stages = [{'name': 'geo_data', 'run': link_geo_data, 'key': config['WPS']['geog_data_path'], 'outputs': [geo_data_location]}]
+for resolution, topo_file, extent, border, description in topo:
+    stages.append(command_stage(
+        'topo_' + resolution,
+        telemetry('convert_geotiff', n_workers) + script('prepare_topo.py', [
+            '--lat', args.lat, '--lon', args.lon, '--extent', str(extent), '-t', config['WPS'][topo_file],
+            '-o', os.path.join(geo_data_location, 'topo_ensembledtm_' + resolution), '--cache', geo_cache_location, '-b', border,
+            '-w', str(n_workers), '-u', 'meter MSL', '-d', 'Ensemble DTM {} topography height'.format(description)]),
+        deps=['geo_data'], inputs=[config['WPS'][topo_file]],
+        outputs=[os.path.join(geo_data_location, 'topo_ensembledtm_' + resolution, 'index')]))
+
+stages.append(command_stage(
+    'setup_wps',
+    script('setup_wps.py', ['-y', yaml_file, '-c', 'default_files', '-r', run_directory, '-g', geo_data_location,
+                            '--extent', str(grid_extent), '--namelist', namelist_wps, '--num-domains', str(num_domains),
+                            '--offset', str(time_offset), '--geo-em-cache', geo_em_cache_location] + common),
+    inputs=[yaml_file, os.path.join(configs, namelist_wps), os.path.join(configs, 'GEOGRID.TBL'), os.path.join(configs, 'METGRID.TBL')],
+    outputs=[os.path.join(wps_dir, 'namelist.wps'), os.path.join(wps_dir, 'geo_em_key')]))
+
+stages.append({
+    'name': 'geogrid', 'run': run_geogrid, 'deps': ['setup_wps', 'topo_1s', 'topo_15s'],
+    'inputs': [os.path.join(wps_dir, 'namelist.wps'), os.path.join(wps_dir, 'GEOGRID.TBL'), os.path.join(geo_data_location, 'topo_*', 'index')],
+    'outputs': [os.path.join(tmp_dir, 'geo_em.d{:02d}.nc'.format(i + 1)) for i in range(num_domains)],
+})
+
+if not args.les:
+    # the download runs concurrently to the preparation of the geo data and geogrid
+    stages.append(command_stage(
+        'download',
+        telemetry('download') + script('download_meteo_data.py', ['-y', yaml_file, '-c', configs, '-r', run_directory,
+                                                                  '--extent', str(grid_extent)] + common),
+        deps=['setup_wps'], inputs=[yaml_file], outputs=[os.path.join(run_directory, 'DATA', '*'), os.path.join(wps_dir, 'Vtable')]))
+    met_deps = ['ungrib']
+elif use_upp:
+    stages.append({'name': 'link_wrfout', 'run': link_wrfout, 'deps': ['setup_wps'], 'outputs': [os.path.join(tmp_dir, 'wrfout*')]})
+    stages.append(command_stage(
+        'upp',
+        telemetry('upp', n_workers) + script('run_upp.py', ['-y', yaml_file, '-c', configs, '-r', run_directory, '-i', '5',
+                                                            '-d', args.date, '--dt', str(args.dt), '--offset', str(time_offset),
+                                                            '-w', str(n_workers)]),
+        deps=['link_wrfout'], inputs=[os.path.join(tmp_dir, 'wrfout*')],
+        outputs=[os.path.join(run_directory, 'DATA', '*'), os.path.join(wps_dir, 'Vtable')]))
+    met_deps = ['ungrib']
+else:
+    # the LES input is written directly from the MESO wrfout
+    stages.append({'name': 'link_wrfout', 'run': link_wrfout, 'deps': ['setup_wps'], 'outputs': [os.path.join(tmp_dir, 'wrfout*')]})
+    stages.append(command_stage(
+        'intermediate',
+        telemetry('intermediate', n_workers) + script('write_intermediate.py', [
+            '-d', args.date, '-i', tmp_dir, '-o', wps_dir, '--dt', str(args.dt), '--increment', '5', '--offset', str(time_offset),
+            '-w', str(n_workers)]),
+        deps=['link_wrfout'], inputs=[os.path.join(tmp_dir, 'wrfout*')], outputs=[os.path.join(wps_dir, 'FILE:*')]))
+    met_deps = ['intermediate']
+
+if met_deps == ['ungrib']:
+    stages.append({
+        'name': 'ungrib', 'run': run_ungrib, 'deps': ['download'] if not args.les else ['upp'],
+        'inputs': [os.path.join(run_directory, 'DATA', '*'), os.path.join(wps_dir, 'Vtable'), os.path.join(wps_dir, 'namelist.wps')],
+        'outputs': [os.path.join(wps_dir, 'FILE:*')],
+    })
+
+stages.append({
+    'name': 'metgrid', 'run': run_metgrid, 'deps': ['geogrid'] + met_deps,
+    'inputs': [os.path.join(tmp_dir, 'geo_em.d*'), os.path.join(wps_dir, 'FILE:*'), os.path.join(wps_dir, 'namelist.wps'),
+               os.path.join(wps_dir, 'METGRID.TBL')],
+    'outputs': [os.path.join(tmp_dir, 'met_em.d01.*')],
+})
+
+# the wrf folder does not depend on the wps stages
+stages.append(command_stage(
+    'setup_wrf',
+    script('setup_wrf.py', ['-y', yaml_file, '-c', configs, '-r', run_directory, '--namelist', namelist_input,
+                            '--num-metgrid-levels', str(num_metgrid_levels), '--num-domains', str(num_domains),
+                            '--offset', str(time_offset)] + common),
+    inputs=[yaml_file, os.path.join(configs, namelist_input)], outputs=[os.path.join(wrf_dir, 'namelist.input')]))
+
+stages.append({
+    'name': 'real', 'run': run_real, 'deps': ['metgrid', 'setup_wrf'],
+    'inputs': [os.path.join(tmp_dir, 'met_em*'), os.path.join(wrf_dir, 'namelist.input')],
+    'outputs': [os.path.join(wrf_dir, 'wrfinput_d01'), os.path.join(wrf_dir, 'wrfbdy_d01')],
+})
+
+os.makedirs(out_dir, exist_ok=True)
+status = run_pipeline(stages, os.path.join(run_directory, 'pipeline_state.json'), args.workers, args.verbose)
+
+failed = [name for name, state in status.items() if state in ['failed', 'blocked']]
+if len(failed) > 0:
+    print('ERROR: Failed to set up the case, the stages {} are run again when the setup is restarted'.format(', '.join(failed)))
+    sys.exit(1)
+
+print('===============================================')
+print('Finished setting up case')
+print('===============================================')
+exit(0)
@@ -1,10 +1,38 @@
 import argparse
 import datetime
+import glob
+import hashlib
 import os
-from projection import get_projection
+from projection import get_projection, get_max_mapfac_deviation, tune_truelats
+import re
 import shutil
+import sys
 import yaml
 
+namelist_pattern = re.compile(r'^\s*(\w+)\s*=\s*(.*?)\s*$')
+
+def render_namelist(lines, value_dict):
+    rendered = []
+    for line in lines:
+        for key in value_dict:
+            line = line.replace(key, value_dict[key])
+        rendered.append(line)
+    return rendered
+
+def get_geogrid(lines, num_domains):
+    # the grid of the domains from the rendered &geogrid section
+    values = {}
+    for line in lines:
+        match = namelist_pattern.match(line)
+        if match is not None:
+            values[match.group(1)] = [value.strip().strip("'") for value in match.group(2).split(',') if value.strip() != '']
+    domains = []
+    for i in range(num_domains):
+        domains.append({key: int(values[key][i]) for key in ['parent_id', 'parent_grid_ratio', 'i_parent_start', 'j_parent_start', 'e_we', 'e_sn']})
+    params = {key: float(values[key][0]) for key in ['dx', 'ref_lat', 'ref_lon', 'truelat1', 'truelat2', 'stand_lon']}
+    params['map_proj'] = values['map_proj'][0]
+    return params, domains
+
 parser = argparse.ArgumentParser(description='Setting up the WPS environment')
 parser.add_argument('-y', '--yaml-config', required=True, help='YAML config file')
 parser.add_argument('-d', '--date', required=True, help='Start date of the simulation')
@@ -19,6 +47,8 @@ parser.add_argument('-g', '--geo-data-location', required=True, help='Path to th
 parser.add_argument('--namelist', required=True, help='Input namelist file')
 parser.add_argument('--num-domains', type=int, required=True, help='Number of domains')
 parser.add_argument('--post', action='store_true', help='Configure WPS for the postprocessing')
+parser.add_argument('--geo-em-cache', type=str, help='Folder of the geogrid output cache shared between the cases')
+parser.add_argument('--mapfac-limit', type=float, default=0.01, help='Maximum allowed deviation of the mapfac from 1.0')
 
 args = parser.parse_args()
 
@@ -26,8 +56,8 @@ args = parser.parse_args()
 with open(args.yaml_config, 'rt') as fh:
     config = yaml.safe_load(fh)
 
-# generate the output folder structure
-os.makedirs(args.run_directory, exist_ok=False)
+# generate the output folder structure, an existing run directory is reused when the setup is resumed
+os.makedirs(args.run_directory, exist_ok=True)
 for folder in ['WPS', 'DATA', 'OUT', 'TMP']:
     os.makedirs(os.path.join(args.run_directory, folder), exist_ok=True)
 
@@ -35,14 +65,16 @@ for folder in ['WPS', 'DATA', 'OUT', 'TMP']:
 wps_dir = os.path.join(args.run_directory, 'WPS')
 files_list = ['ungrib.exe', 'geogrid.exe', 'metgrid.exe', 'link_grib.csh']
 for file in files_list:
+    if os.path.lexists(os.path.join(wps_dir, file)):
+        os.remove(os.path.join(wps_dir, file))
     os.symlink(os.path.join(config['WPS']['path'], file), os.path.join(wps_dir, file))
 
 shutil.copyfile(os.path.join(args.configs, 'GEOGRID.TBL'), os.path.join(wps_dir, 'GEOGRID.TBL'))
 shutil.copyfile(os.path.join(args.configs, 'METGRID.TBL'), os.path.join(wps_dir, 'METGRID.TBL'))
 
 # setting up namelists file
-f_namelists_default = open(os.path.join(args.configs, args.namelist), 'rt')
-f_namelists_out = open(os.path.join(wps_dir, 'namelist.wps'), 'wt')
+with open(os.path.join(args.configs, args.namelist), 'rt') as f:
+    namelist_default = f.readlines()
 
 start_time = datetime.datetime.strptime(args.date, '%Y-%m-%d')
 start_time = start_time + datetime.timedelta(hours=args.offset)
@@ -73,10 +105,62 @@ value_dict = {
 if args.post:
     value_dict['interval_seconds = 300'] = 'interval_seconds = 3600'
 
-for line in f_namelists_default:
-    for key in value_dict:
-        line = line.replace(key, value_dict[key])
-    f_namelists_out.write(line)
+namelist = render_namelist(namelist_default, value_dict)
+
+# the map factors of the grid follow analytically from the projection, domains with a too large deviation are rejected
+# before geogrid runs, unless other true latitudes bring the deviation below the limit
+params, domains = get_geogrid(namelist, args.num_domains)
+grid = (params['map_proj'], params['ref_lat'], params['ref_lon'], params['stand_lon'])
+deviation = get_max_mapfac_deviation(*grid, params['truelat1'], params['truelat2'], params['dx'], domains)
+if deviation >= args.mapfac_limit:
+    truelat1, truelat2 = tune_truelats(*grid, params['truelat1'], params['truelat2'], params['dx'], domains)
+    tuned_deviation = get_max_mapfac_deviation(*grid, truelat1, truelat2, params['dx'], domains)
+    if tuned_deviation >= args.mapfac_limit:
+        print('Predicted maximum MAPFAC deviation from 1.0: {:5f}, the domain is too large for the map projection'.format(
+            min(deviation, tuned_deviation)))
+        sys.exit(1)
+    print('Predicted maximum MAPFAC deviation from 1.0: {:5f}, changed the true latitudes from {}, {} to {}, {} ({:5f})'.format(
+        deviation, params['truelat1'], params['truelat2'], truelat1, truelat2, tuned_deviation))
+    value_dict['TRUELAT1'] = str(truelat1)
+    value_dict['TRUELAT2'] = str(truelat2)
+    namelist = render_namelist(namelist_default, value_dict)
+
+with open(os.path.join(wps_dir, 'namelist.wps'), 'wt') as f:
+    f.writelines(namelist)
+
+# the geogrid output only depends on the domains, the static data and the geogrid table, not on the dates of the case
+if args.geo_em_cache is not None:
+    identity = []
+    section = None
+    with open(os.path.join(wps_dir, 'namelist.wps'), 'rt') as f:
+        for line in f:
+            if line.strip().startswith('&'):
+                section = line.strip()
+            elif section == '&geogrid' and 'geog_data_path' not in line:
+                identity.append(line.strip())
+            elif section == '&share' and 'max_dom' in line:
+                identity.append(line.strip())
+    with open(os.path.join(wps_dir, 'GEOGRID.TBL'), 'rt') as f:
+        identity.append(f.read())
+    identity.append(os.path.realpath(config['WPS']['geog_data_path']))
+    for topo_file in [config['WPS']['high_res_topo_file'], config['WPS']['low_res_topo_file']]:
+        stat = os.stat(topo_file)
+        identity.append('{}:{}:{}'.format(os.path.realpath(topo_file), stat.st_size, int(stat.st_mtime)))
+    key = hashlib.sha1('\n'.join(identity).encode()).hexdigest()
+
+    with open(os.path.join(wps_dir, 'geo_em_key'), 'wt') as f:
+        f.write(key + '\n')
+
+    # links of an earlier key are removed, otherwise geogrid would be skipped or write its output into that entry
+    for file in glob.glob(os.path.join(args.run_directory, 'TMP', 'geo_em.d*')):
+        if os.path.islink(file):
+            os.remove(file)
 
-f_namelists_default.close()
-f_namelists_out.close()
+    # link the geogrid output of a previous case with the same key, geogrid is then skipped
+    cache_entry = os.path.join(args.geo_em_cache, key)
+    if os.path.isdir(cache_entry):
+        for file in sorted(os.listdir(cache_entry)):
+            if file.startswith('geo_em.d'):
+                if os.path.lexists(os.path.join(args.run_directory, 'TMP', file)):
+                    os.remove(os.path.join(args.run_directory, 'TMP', file))
+                os.symlink(os.path.join(os.path.abspath(cache_entry), file), os.path.join(args.run_directory, 'TMP', file))
@@ -33,6 +33,8 @@ wrf_dir = os.path.join(args.run_directory, 'WRF')
 files_list = ['real.exe', 'wrf.exe',
 ]
 for file in files_list:
+    if os.path.lexists(os.path.join(wrf_dir, file)):
+        os.remove(os.path.join(wrf_dir, file))
     os.symlink(os.path.join(config['WRF']['run_dir_path'], file), os.path.join(wrf_dir, file))
 
 files_list = [
@@ -47,6 +49,11 @@ for file in files_list:
     else:
         shutil.copyfile(os.path.join(config['WRF']['run_dir_path'], file), os.path.join(wrf_dir, file))
 
+# the restart files and the segment logs of a previous run do not belong to the new namelist
+for pattern in ['wrfrst_d*', 'segment_rsl.*', 'namelist.input.full']:
+    for filepath in glob.glob(os.path.join(wrf_dir, pattern)):
+        os.remove(filepath)
+
 # setting up namelists file
 f_namelists_default = open(os.path.join(args.configs, args.namelist), 'rt')
 f_namelists_out = open(os.path.join(wrf_dir, 'namelist.input'), 'wt')
@@ -0,0 +1,185 @@
+import argparse
+from datetime import datetime
+import glob
+import json
+import numpy as np
+import os
+import socket
+import subprocess
+import sys
+import time
+
+# every stage of a case appends one record to this file in the case directory
+telemetry_filename = 'telemetry.jsonl'
+
+def run_stage(command):
+    # the stage inherits stdin, stdout and stderr so that the redirections of the calling script still apply
+    start = datetime.now().isoformat(timespec='seconds')
+    t_start = time.perf_counter()
+    try:
+        process = subprocess.Popen(command)
+    except OSError as e:
+        print('Failed to start', command[0], e)
+        return 127, start, time.perf_counter() - t_start, None
+    _, status, rusage = os.wait4(process.pid, 0)
+    return os.waitstatus_to_exitcode(status), start, time.perf_counter() - t_start, rusage
+
+def get_record(args, exit_code, start, t_wall, rusage):
+    # the resource usage covers the stage and all the processes it waited for, e.g. the ranks started by mpirun
+    # on the local node, the peak memory is the one of the largest single process and the bytes read/written
+    # are the blocks that actually hit the file system (ru_inblock and ru_oublock count 512 byte blocks)
+    record = {
+        'case': os.path.basename(os.path.normpath(args.case_directory)),
+        'mode': args.mode,
+        'stage': args.stage,
+        'start': start,
+        'host': socket.gethostname(),
+        'cores': args.cores,
+        'exit_code': exit_code,
+        'wall_s': t_wall,
+        'cpu_user_s': None,
+        'cpu_system_s': None,
+        'peak_rss_mb': None,
+        'read_bytes': None,
+        'written_bytes': None,
+        'command': ' '.join(args.command),
+    }
+    if rusage is not None:
+        # ru_maxrss is given in kilobytes on linux
+        record['cpu_user_s'] = rusage.ru_utime
+        record['cpu_system_s'] = rusage.ru_stime
+        record['peak_rss_mb'] = rusage.ru_maxrss / 1024.0
+        record['read_bytes'] = rusage.ru_inblock * 512
+        record['written_bytes'] = rusage.ru_oublock * 512
+    return record
+
+def append_record(case_directory, record):
+    # the record is written with a single call to a file opened in append mode so that concurrently running
+    # stages of the same case do not interleave their lines
+    os.makedirs(case_directory, exist_ok=True)
+    with open(os.path.join(case_directory, telemetry_filename), 'a') as f:
+        f.write(json.dumps(record) + '\n')
+
+def get_telemetry_files(paths):
+    # a path is either a telemetry file, a case directory or a directory containing case directories
+    files = []
+    for path in paths:
+        if os.path.isfile(path):
+            files.append(path)
+        elif os.path.isfile(os.path.join(path, telemetry_filename)):
+            files.append(os.path.join(path, telemetry_filename))
+        else:
+            files += sorted(glob.glob(os.path.join(path, '*', telemetry_filename)))
+    return files
+
+def load_records(files):
+    records = []
+    for file in files:
+        with open(file, 'r') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # a line can be incomplete if a stage was killed while appending
+                    continue
+    return records
+
+def summarize(records):
+    # stages that run several times per case (e.g. the two geo patches) are summed per case first
+    # so that the statistics are per case, failed runs are only counted
+    per_case = {}
+    failures = {}
+    for record in records:
+        key = (record['mode'], record['stage'])
+        if record['exit_code'] != 0:
+            failures[key] = failures.get(key, 0) + 1
+            continue
+        stage = per_case.setdefault(key, {})
+        case = stage.setdefault(record['case'], {'wall_s': 0.0, 'cpu_s': 0.0, 'core_s': 0.0, 'peak_rss_mb': 0.0,
+                                                 'read_bytes': 0, 'written_bytes': 0})
+        case['wall_s'] += record['wall_s']
+        case['cpu_s'] += record['cpu_user_s'] + record['cpu_system_s']
+        case['core_s'] += record['wall_s'] * record['cores']
+        case['peak_rss_mb'] = max(case['peak_rss_mb'], record['peak_rss_mb'])
+        case['read_bytes'] += record['read_bytes']
+        case['written_bytes'] += record['written_bytes']
+
+    total_core_s = sum(case['core_s'] for stage in per_case.values() for case in stage.values())
+
+    summary = []
+    for key in set(per_case.keys()) | set(failures.keys()):
+        cases = list(per_case.get(key, {}).values())
+        wall = np.array([case['wall_s'] for case in cases])
+        core_s = sum(case['core_s'] for case in cases)
+        summary.append({
+            'mode': key[0],
+            'stage': key[1],
+            'cases': len(cases),
+            'failures': failures.get(key, 0),
+            'wall_h': wall.sum() / 3600.0,
+            'core_h': core_s / 3600.0,
+            'core_share': core_s / total_core_s if total_core_s > 0 else 0.0,
+            'wall_median_s': float(np.median(wall)) if len(cases) > 0 else 0.0,
+            'wall_p95_s': float(np.percentile(wall, 95)) if len(cases) > 0 else 0.0,
+            # fraction of the reserved cores that was actually busy
+            'cpu_efficiency': sum(case['cpu_s'] for case in cases) / core_s if core_s > 0 else 0.0,
+            'peak_rss_mb': max([case['peak_rss_mb'] for case in cases], default=0.0),
+            'read_gb': sum(case['read_bytes'] for case in cases) / 1e9,
+            'written_gb': sum(case['written_bytes'] for case in cases) / 1e9,
+        })
+
+    # the stages that use the most core hours first
+    summary.sort(key=lambda stage: stage['core_h'], reverse=True)
+    return summary
+
+def print_summary(summary):
+    columns = ['mode', 'stage', 'cases', 'failures', 'wall_h', 'core_h', 'core_share', 'wall_median_s', 'wall_p95_s',
+               'cpu_efficiency', 'peak_rss_mb', 'read_gb', 'written_gb']
+    print('{:<6}{:<18}'.format(*columns[:2]) + ''.join('{:>15}'.format(column) for column in columns[2:]))
+    for stage in summary:
+        line = '{:<6}{:<18}{:>15}{:>15}'.format(stage['mode'], stage['stage'], stage['cases'], stage['failures'])
+        line += '{:>15.2f}{:>15.2f}{:>15.1%}{:>15.1f}{:>15.1f}{:>15.1%}{:>15.0f}{:>15.2f}{:>15.2f}'.format(
+            stage['wall_h'], stage['core_h'], stage['core_share'], stage['wall_median_s'], stage['wall_p95_s'],
+            stage['cpu_efficiency'], stage['peak_rss_mb'], stage['read_gb'], stage['written_gb'])
+        print(line)
+
+parser = argparse.ArgumentParser(description='Record the resource usage of the pipeline stages and summarize it across cases')
+subparsers = parser.add_subparsers(dest='action', required=True)
+
+parser_run = subparsers.add_parser('run', help='Run a stage and append its record to the telemetry of the case')
+parser_run.add_argument('-c', '--case_directory', type=str, required=True, help='Case directory the record is appended to')
+parser_run.add_argument('-s', '--stage', type=str, required=True, help='Name of the stage')
+parser_run.add_argument('-m', '--mode', type=str, default='MESO', help='Simulation mode of the stage (MESO, LES or POST)')
+parser_run.add_argument('-n', '--cores', type=int, default=1, help='Number of cores reserved for the stage')
+parser_run.add_argument('command', nargs=argparse.REMAINDER, help='Command of the stage, separated by --')
+
+parser_summary = subparsers.add_parser('summary', help='Aggregate the telemetry of many cases per stage')
+parser_summary.add_argument('paths', type=str, nargs='+', help='Telemetry files, case directories or directories containing the cases')
+parser_summary.add_argument('-j', '--json', type=str, help='Additionally write the summary to this json file')
+args = parser.parse_args()
+
+if args.action == 'run':
+    if len(args.command) > 0 and args.command[0] == '--':
+        args.command = args.command[1:]
+    if len(args.command) == 0:
+        print('No command given for stage', args.stage)
+        sys.exit(1)
+
+    exit_code, start, t_wall, rusage = run_stage(args.command)
+    append_record(args.case_directory, get_record(args, exit_code, start, t_wall, rusage))
+
+    # the calling script checks the exit code of the stage, a stage killed by a signal returns 128 + signal like bash
+    sys.exit(exit_code if exit_code >= 0 else 128 - exit_code)
+else:
+    files = get_telemetry_files(args.paths)
+    if len(files) == 0:
+        print('No telemetry found in', ' '.join(args.paths))
+        sys.exit(1)
+
+    summary = summarize(load_records(files))
+    print('Summary of', len(files), 'cases')
+    print_summary(summary)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2)
@@ -0,0 +1,56 @@
+import numpy as np
+import sys
+from wrf_diagnostics import compute_diagnostics
+
+def init_accumulator(modes):
+    return {'modes': modes, 'count': 0}
+
+def update_accumulator(accumulator, data):
+    if accumulator['count'] == 0:
+        # the first mode takes over the frame, the others need their own copy as they are updated in place
+        for i, mode in enumerate(accumulator['modes']):
+            accumulator[mode] = data if i == 0 else data.copy()
+
+    else:
+        for mode in accumulator['modes']:
+            if mode == 'avg':
+                # running sum, divided by the number of frames when the window is finalized
+                np.add(accumulator['avg'], data, out=accumulator['avg'])
+            elif mode == 'max':
+                # running signed value with the largest magnitude, on ties the negative value is kept
+                # to give the same result as comparing the max and min over all frames
+                extreme = accumulator['max']
+                abs_data = np.abs(data)
+                abs_extreme = np.abs(extreme)
+                replace = np.logical_or(abs_data > abs_extreme, np.logical_and(abs_data == abs_extreme, data < extreme))
+                np.copyto(extreme, data, where=replace)
+            else:
+                print("Unknown data aggregation mode")
+                sys.exit(1)
+
+    accumulator['count'] += 1
+
+def finalize_accumulator(accumulator, mode):
+    if mode == 'avg':
+        return accumulator['avg'] / accumulator['count']
+    return accumulator[mode]
+
+def aggregate_window(files, properties, property_map, crop=None):
+    # stream over the frames of a window, only one frame and the accumulators are kept in memory
+    names = [property_map[property]['name'] for property in properties]
+    accumulators = {property: init_accumulator(property_map[property]['modes']) for property in properties}
+
+    for file in files:
+        diagnostics = compute_diagnostics(file, names, crop)
+        for property in properties:
+            update_accumulator(accumulators[property], diagnostics[property_map[property]['name']])
+        # release the frame before the next one is read
+        del diagnostics
+
+    out = {}
+    for property in properties:
+        out[property] = {}
+        for mode in property_map[property]['modes']:
+            out[property][mode] = finalize_accumulator(accumulators[property], mode)
+
+    return out
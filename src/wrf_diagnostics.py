@@ -0,0 +1,139 @@
+from netCDF4 import Dataset
+import numpy as np
+from wrf import Constants, cloudfrac, default_fill, destagger, pw, rh, tk
+
+def get_cloudfrac(fields):
+    # same default thresholds as wrf.getvar(ncfile, 'cloudfrac') using the height above ground
+    relh = rh(fields['QVAPOR'], fields['full_p'], fields['tk'], meta=False)
+    missing = default_fill(np.float64)
+    cfrac = cloudfrac(fields['height_agl'], relh, 1, 300.0, 2000.0, 6000.0, missing=missing, meta=False)
+    return np.ma.filled(np.ma.masked_values(cfrac, missing), np.nan)
+
+# derived fields with the fields they are computed from, every name that is not listed here is read from the file
+# column diagnostics integrate over the full column and can not be computed from a subset of the layers
+diagnostic_map = {
+    'full_p': {'inputs': ['P', 'PB'], 'function': lambda f: f['P'] + f['PB']},
+    'full_t': {'inputs': ['T'], 'function': lambda f: f['T'] + Constants.T_BASE},
+    'geopt': {'inputs': ['PH', 'PHB'], 'function': lambda f: f['PH'] + f['PHB']},
+    'pressure': {'inputs': ['full_p'], 'function': lambda f: f['full_p'] * 0.01},
+    'tk': {'inputs': ['full_p', 'full_t'], 'function': lambda f: tk(f['full_p'], f['full_t'], meta=False)},
+    'rh': {'inputs': ['QVAPOR', 'full_p', 'tk'], 'function': lambda f: rh(np.maximum(f['QVAPOR'], 0.0), f['full_p'], f['tk'], meta=False)},
+    'pw': {'inputs': ['QVAPOR', 'full_p', 'tk', 'geopt'], 'function': lambda f: pw(f['full_p'], f['tk'], f['QVAPOR'], f['geopt'] / Constants.G, meta=False), 'column': True},
+    'ua': {'inputs': ['U'], 'function': lambda f: destagger(f['U'], -1)},
+    'va': {'inputs': ['V'], 'function': lambda f: destagger(f['V'], -2)},
+    'wa': {'inputs': ['W'], 'function': lambda f: destagger(f['W'], -3)},
+    'z': {'inputs': ['geopt'], 'function': lambda f: destagger(f['geopt'], -3) / Constants.G},
+    'height_agl': {'inputs': ['z', 'HGT'], 'function': lambda f: f['z'] - f['HGT']},
+    'ter': {'inputs': ['HGT'], 'function': lambda f: f['HGT']},
+    'cloudfrac': {'inputs': ['height_agl', 'QVAPOR', 'full_p', 'tk'], 'function': get_cloudfrac, 'column': True},
+}
+
+# axis to destagger for the stagger attribute of the raw netcdf variables
+stagger_axis = {
+    'X': -1,
+    'U': -1,
+    'Y': -2,
+    'V': -2,
+    'Z': -3,
+    'W': -3,
+}
+
+def get_crop(filename, lbc_offset, max_layers):
+    # hyperslab of the mass grid that is retained in the output
+    with Dataset(filename) as ncfile:
+        crop = {
+            'south_north': slice(lbc_offset, ncfile.dimensions['south_north'].size - lbc_offset),
+            'west_east': slice(lbc_offset, ncfile.dimensions['west_east'].size - lbc_offset),
+        }
+        if max_layers > 0 and 'bottom_top' in ncfile.dimensions:
+            crop['bottom_top'] = slice(0, min(max_layers, ncfile.dimensions['bottom_top'].size))
+    return crop
+
+def get_tiles(crop, num_tiles_y, num_tiles_x):
+    # split the horizontal hyperslab into tiles together with their region in the cropped output grid,
+    # the staggered fields of every tile are read with the extra cell that is required to destagger it
+    tiles = []
+    rows = np.array_split(np.arange(crop['south_north'].start, crop['south_north'].stop), num_tiles_y)
+    cols = np.array_split(np.arange(crop['west_east'].start, crop['west_east'].stop), num_tiles_x)
+    for row in rows:
+        for col in cols:
+            tile = dict(crop)
+            tile['south_north'] = slice(int(row[0]), int(row[-1]) + 1)
+            tile['west_east'] = slice(int(col[0]), int(col[-1]) + 1)
+            region = (
+                slice(tile['south_north'].start - crop['south_north'].start, tile['south_north'].stop - crop['south_north'].start),
+                slice(tile['west_east'].start - crop['west_east'].start, tile['west_east'].stop - crop['west_east'].start),
+            )
+            tiles.append((tile, region))
+    return tiles
+
+def get_raw_inputs(name):
+    if name not in diagnostic_map:
+        return {name}
+    raw_inputs = set()
+    for input_name in diagnostic_map[name]['inputs']:
+        raw_inputs |= get_raw_inputs(input_name)
+    return raw_inputs
+
+def read_field(ncfile, name, crop=None):
+    variable = ncfile.variables[name]
+    index = []
+    for dim in variable.dimensions:
+        if dim == 'Time':
+            index.append(0)
+        elif crop is not None and dim in crop:
+            index.append(crop[dim])
+        elif crop is not None and dim.endswith('_stag') and dim[:-5] in crop:
+            # one extra staggered cell is required to destagger the cropped region
+            index.append(slice(crop[dim[:-5]].start, crop[dim[:-5]].stop + 1))
+        else:
+            index.append(slice(None))
+    return variable[tuple(index)]
+
+def compute_diagnostics(filename, names, crop=None):
+    # read every raw field once and derive all the requested diagnostics from the shared arrays
+    fields = {}
+
+    # the raw fields of column diagnostics are read over all the layers and the layers are cropped
+    # from the other diagnostics afterwards, all the other fields are only read on the cropped layers
+    full_column = set()
+    if crop is not None and 'bottom_top' in crop:
+        for name in names:
+            if diagnostic_map.get(name, {}).get('column', False):
+                full_column |= get_raw_inputs(name)
+        for name in names:
+            if get_raw_inputs(name) & full_column:
+                full_column |= get_raw_inputs(name)
+
+    with Dataset(filename) as ncfile:
+        ncfile.set_auto_mask(False)
+
+        def get(name):
+            if name not in fields:
+                if name in diagnostic_map:
+                    for input_name in diagnostic_map[name]['inputs']:
+                        get(input_name)
+                    fields[name] = diagnostic_map[name]['function'](fields)
+                elif name in full_column:
+                    fields[name] = read_field(ncfile, name, {k: v for k, v in crop.items() if k != 'bottom_top'})
+                else:
+                    fields[name] = read_field(ncfile, name, crop)
+            return fields[name]
+
+        out = {}
+        for name in names:
+            data = get(name)
+            if name not in diagnostic_map:
+                # destagger the raw data that is available on a different grid
+                stagger = getattr(ncfile.variables[name], 'stagger', '')
+                if stagger in stagger_axis:
+                    data = destagger(data, stagger_axis[stagger])
+
+            if not diagnostic_map.get(name, {}).get('column', False) and get_raw_inputs(name) & full_column:
+                vertical = any('bottom_top' in ncfile.variables[raw].dimensions or 'bottom_top_stag' in ncfile.variables[raw].dimensions
+                               for raw in get_raw_inputs(name))
+                if vertical:
+                    data = data[..., crop['bottom_top'], :, :]
+            out[name] = data
+
+    return out
@@ -0,0 +1,203 @@
+import argparse
+import datetime
+from multiprocessing import Pool
+from netCDF4 import Dataset
+import numpy as np
+import os
+import struct
+import sys
+
+# the same fields that ungrib extracts with Vtable.WRF from the grib files written by upp
+field_info = {
+    'HGT': ('m', 'Height'),
+    'PRESSURE': ('Pa', 'Pressure'),
+    'TT': ('K', 'Temperature'),
+    'SPECHUMD': ('kg kg-1', 'Specific Humidity'),
+    'UU': ('m s-1', 'U'),
+    'VV': ('m s-1', 'V'),
+    'WW': ('m s-1', 'W'),
+    'QC': ('kg kg-1', 'Cloud water mixing ratio'),
+    'QR': ('kg kg-1', 'Rain water mixing ratio'),
+    'QI': ('kg kg-1', 'Ice mixing ratio'),
+    'QS': ('kg kg-1', 'Snow water mixing ratio'),
+    'QG': ('kg kg-1', 'Graupel mixing ratio'),
+    'RH': ('%', 'Relative Humidity'),
+    'PSFC': ('Pa', 'Surface Pressure'),
+    'PMSL': ('Pa', 'Sea-level Pressure'),
+    'SNOW': ('kg m-2', 'Water equivalent snow depth'),
+    'SNOWH': ('m', 'Physical Snow Depth'),
+    'SKINTEMP': ('K', 'Skin temperature'),
+    'SEAICE': ('proprtn', 'Ice flag'),
+    'CANWAT': ('kg m-2', 'Plant Canopy Surface Water'),
+    'LANDSEA': ('proprtn', 'Land/Sea flag (1=land, 0 or 2=sea)'),
+    'SOILHGT': ('m', 'Terrain field of source analysis'),
+    'SM': ('fraction', 'Soil Moisture'),
+    'ST': ('K', 'Soil Temperature'),
+}
+
+# 3d fields on the model levels, the moisture species depend on the microphysics scheme
+hydrometeors = {'QC': 'QCLOUD', 'QR': 'QRAIN', 'QI': 'QICE', 'QS': 'QSNOW', 'QG': 'QGRAUP'}
+surface_fields = {'SNOW': 'SNOW', 'SNOWH': 'SNOWH', 'SKINTEMP': 'TSK', 'SEAICE': 'SEAICE', 'CANWAT': 'CANWAT', 'LANDSEA': 'LANDMASK'}
+
+# level of the surface fields in the intermediate format
+surface_level = 200100.0
+sea_level = 201300.0
+
+earth_radius_km = 6370.0
+gravity = 9.81
+
+def get_time_string(time, interval):
+    # ungrib names the files with the precision required by the interval, metgrid expects the same names
+    if interval % 3600 == 0:
+        return time.strftime('%Y-%m-%d_%H')
+    elif interval % 60 == 0:
+        return time.strftime('%Y-%m-%d_%H:%M')
+    return time.strftime('%Y-%m-%d_%H:%M:%S')
+
+def write_record(f, data):
+    # fortran sequential unformatted record, big endian with the length before and after the data
+    f.write(struct.pack('>i', len(data)))
+    f.write(data)
+    f.write(struct.pack('>i', len(data)))
+
+def get_projection(ncfile):
+    # projection header of the intermediate format (version 5) from the wrf map projection
+    map_proj = ncfile.getncattr('MAP_PROJ')
+    start_lat = float(ncfile['XLAT'][0, 0, 0])
+    start_lon = float(ncfile['XLONG'][0, 0, 0])
+    dx = ncfile.getncattr('DX') / 1000.0
+    dy = ncfile.getncattr('DY') / 1000.0
+
+    if map_proj == 1:
+        return 3, struct.pack('>8s8f', b'SWCORNER', start_lat, start_lon, dx, dy, ncfile.getncattr('STAND_LON'),
+                              ncfile.getncattr('TRUELAT1'), ncfile.getncattr('TRUELAT2'), earth_radius_km)
+    elif map_proj == 2:
+        return 5, struct.pack('>8s7f', b'SWCORNER', start_lat, start_lon, dx, dy, ncfile.getncattr('STAND_LON'),
+                              ncfile.getncattr('TRUELAT1'), earth_radius_km)
+    elif map_proj == 3:
+        return 1, struct.pack('>8s6f', b'SWCORNER', start_lat, start_lon, dx, dy, ncfile.getncattr('TRUELAT1'), earth_radius_km)
+    else:
+        print('Unsupported map projection:', map_proj)
+        sys.exit(1)
+
+def write_field(f, hdate, field, level, slab, projection):
+    # the soil fields share the units and description of their prefix
+    units, description = field_info.get(field, field_info.get(field[:2]))
+    iproj, projection_record = projection
+    ny, nx = slab.shape
+    write_record(f, struct.pack('>i', 5))
+    write_record(f, struct.pack('>24sf32s9s25s46sfiii', hdate.ljust(24).encode(), 0.0, b'WRF'.ljust(32), field.ljust(9).encode(),
+                                units.ljust(25).encode(), description.ljust(46).encode(), level, nx, ny, iproj))
+    write_record(f, projection_record)
+    # the winds are relative to the wrf grid
+    write_record(f, struct.pack('>i', 0))
+    write_record(f, np.ascontiguousarray(slab, dtype='>f4').tobytes())
+
+def get_relative_humidity(tk, p, qv):
+    # same saturation formula as wrf-python
+    es = 6.112 * np.exp(17.67 * (tk - 273.15) / (tk - 29.65))
+    qvs = 0.622 * es / (0.01 * p - (1.0 - 0.622) * es)
+    return 100.0 * np.clip(qv / qvs, 0.0, 1.0)
+
+def get_fields(ncfile):
+    # model level fields on the mass points, level 1 is the lowest model level as in the upp output
+    fields = {}
+    p = ncfile['P'][0] + ncfile['PB'][0]
+    tk = (ncfile['T'][0] + 300.0) * (p / 100000.0) ** (287.0 / 1004.5)
+    qv = ncfile['QVAPOR'][0]
+    geopotential = ncfile['PH'][0] + ncfile['PHB'][0]
+
+    fields['PRESSURE'] = p
+    fields['TT'] = tk
+    fields['HGT'] = 0.5 * (geopotential[1:] + geopotential[:-1]) / gravity
+    fields['SPECHUMD'] = qv / (1.0 + qv)
+    fields['RH'] = get_relative_humidity(tk, p, qv)
+    fields['UU'] = 0.5 * (ncfile['U'][0, :, :, 1:] + ncfile['U'][0, :, :, :-1])
+    fields['VV'] = 0.5 * (ncfile['V'][0, :, 1:] + ncfile['V'][0, :, :-1])
+    fields['WW'] = 0.5 * (ncfile['W'][0, 1:] + ncfile['W'][0, :-1])
+    for field, name in hydrometeors.items():
+        if name in ncfile.variables.keys():
+            fields[field] = ncfile[name][0]
+
+    levels = [(field, float(k + 1), data[k]) for field, data in fields.items() for k in range(data.shape[0])]
+
+    # 2 m and 10 m fields are stored on the surface level like ungrib does
+    variables = ncfile.variables.keys()
+    if 'T2' in variables and 'Q2' in variables and 'PSFC' in variables:
+        t2, q2, psfc = ncfile['T2'][0], ncfile['Q2'][0], ncfile['PSFC'][0]
+        levels.append(('TT', surface_level, t2))
+        levels.append(('SPECHUMD', surface_level, q2 / (1.0 + q2)))
+        levels.append(('RH', surface_level, get_relative_humidity(t2, psfc, q2)))
+        levels.append(('PSFC', surface_level, psfc))
+        # reduction to sea level with the standard atmosphere lapse rate
+        levels.append(('PMSL', sea_level, psfc * (1.0 + 0.0065 * ncfile['HGT'][0] / t2) ** (gravity / (287.0 * 0.0065))))
+    if 'U10' in variables and 'V10' in variables:
+        levels.append(('UU', surface_level, ncfile['U10'][0]))
+        levels.append(('VV', surface_level, ncfile['V10'][0]))
+    levels.append(('SOILHGT', surface_level, ncfile['HGT'][0]))
+    for field, name in surface_fields.items():
+        if name in variables:
+            levels.append((field, surface_level, ncfile[name][0]))
+
+    # the soil layers are named by their depth range in cm, e.g. SM000010 and ST010040
+    if 'SMOIS' in variables and 'TSLB' in variables and 'ZS' in variables and 'DZS' in variables:
+        zs, dzs = ncfile['ZS'][0], ncfile['DZS'][0]
+        for k in range(len(zs)):
+            top, bottom = int(np.round(100 * (zs[k] - 0.5 * dzs[k]))), int(np.round(100 * (zs[k] + 0.5 * dzs[k])))
+            levels.append(('SM{:03d}{:03d}'.format(top, bottom), surface_level, ncfile['SMOIS'][0, k]))
+            levels.append(('ST{:03d}{:03d}'.format(top, bottom), surface_level, ncfile['TSLB'][0, k]))
+    return levels
+
+def convert_time(time, input_folder, output_folder, domain, prefix, interval):
+    wrfout_file = os.path.join(input_folder, 'wrfout_' + domain + '_' + time.strftime('%Y-%m-%d_%H:%M:%S'))
+    if not os.path.exists(wrfout_file):
+        return wrfout_file
+
+    out_file = os.path.join(output_folder, prefix + ':' + get_time_string(time, interval))
+    hdate = time.strftime('%Y-%m-%d_%H:%M:%S')
+    with Dataset(wrfout_file) as ncfile:
+        projection = get_projection(ncfile)
+        levels = get_fields(ncfile)
+
+    # write to a temporary file first so that metgrid never reads a partially written file
+    with open(out_file + '.tmp', 'wb') as f:
+        for field, level, slab in levels:
+            write_field(f, hdate, field, level, np.ma.filled(slab, 0.0), projection)
+    os.replace(out_file + '.tmp', out_file)
+    return None
+
+parser = argparse.ArgumentParser(description='Write the WPS intermediate files for the LES directly from the MESO wrfout')
+parser.add_argument('-d', '--date', required=True, help='Start date of the simulation')
+parser.add_argument('-i', '--input-folder', required=True, help='Folder with the wrfout files')
+parser.add_argument('-o', '--output-folder', required=True, help='Folder for the intermediate files, usually the WPS folder of the run')
+parser.add_argument('--domain', type=str, default='d03', help='Domain indentifier that is processed')
+parser.add_argument('--dt', type=int, required=True, help='Simulation interval in hours')
+parser.add_argument('--offset', type=int, default=0, help='Simulation start offset in hours')
+parser.add_argument('--increment', type=int, required=True, help='Increment between wrfout in minutes')
+parser.add_argument('--prefix', type=str, default='FILE', help='Prefix of the intermediate files (prefix in namelist.wps)')
+parser.add_argument('-w', '--workers', type=int, default=1, help='Number of timesteps that are converted in parallel')
+args = parser.parse_args()
+
+time = datetime.datetime.strptime(args.date, '%Y-%m-%d')
+time = time + datetime.timedelta(hours=args.offset)
+end_time = time + datetime.timedelta(hours=args.dt-args.offset)
+
+times = []
+while time <= end_time:
+    times.append(time)
+    time += datetime.timedelta(minutes=args.increment)
+
+os.makedirs(args.output_folder, exist_ok=True)
+convert_args = (args.input_folder, args.output_folder, args.domain, args.prefix, args.increment * 60)
+if args.workers > 1:
+    with Pool(args.workers) as pool:
+        missing = pool.starmap(convert_time, [(time,) + convert_args for time in times])
+else:
+    missing = [convert_time(time, *convert_args) for time in times]
+
+missing = [file for file in missing if file is not None]
+if len(missing) > 0:
+    print('Missing wrfout files:', ', '.join(missing))
+    exit(1)
+
+exit(0)